@@ -4,8 +4,13 @@ from utils.response_utils import create_error_response, create_success_response
 from utils.env_utils import should_import_cloud_services
 import os
 import base64
-import requests
-from firebase_admin import firestore
+from handlers.notification_dispatch import get_notification_dispatcher
+from handlers.animal_incidents import get_incident_aggregator, camera_key, frame_digest
+from handlers.profile_cache import get_farm_profile, get_farmer_profile
+from handlers.label_keywords import get_label_classifier
+from utils.animal_prefilter import get_animal_prefilter
+from utils.motion_gate import get_motion_gate
+from utils.services import get_firestore, get_realtime_db, get_vision_client
 from utils.request_utils import get_request_id
 
 def handle_detect_animals(req):
@@ -15,8 +20,6 @@ def handle_detect_animals(req):
     # Import vision only if needed
     if should_import_cloud_services():
         from google.cloud import vision
-        from main import vision_client
-        from firebase_admin import firestore, db
     else:
         logger.error("Vision API not available in local/mock mode")
         return create_error_response(get_request_id(req), "ER500", "Vision API not available in local/mock mode", "", 500)
@@ -40,6 +43,7 @@ def handle_detect_animals(req):
         farm_id = data.get('farm_id')
         logger.info(f"lat: {lat}, lng: {lng}, timestamp: {timestamp}, camera_id: {camera_id}, farm_id: {farm_id}")
         # Prepare image for Vision API
+        image_bytes = None
         if image_base64:
             if image_base64.startswith('data:image'):
                 image_base64 = image_base64.split(',', 1)[-1]
@@ -48,159 +52,201 @@ def handle_detect_animals(req):
             except Exception as e:
                 logger.error(f"Could not decode base64 image: {e}")
                 return create_error_response(get_request_id(req), "ER104", "Invalid image_base64", "Could not decode base64 image", 400)
-            image = vision.Image(content=image_bytes)
-            logger.info("Image prepared from base64")
-        elif image_url:
-            image = vision.Image()
-            image.source.image_uri = image_url
-            logger.info(f"Image prepared from URL: {image_url}")
-        else:
+        elif not image_url:
             logger.error("Missing image in request")
             return create_error_response(get_request_id(req), "ER106", "Missing image", "Provide image_base64 or image_url", 400)
-        # Call Vision API
-        logger.info("Calling Vision API for label detection")
-        response = vision_client.label_detection(image=image)
-        labels = response.label_annotations
-        logger.info(f"Vision API labels: {[label.description for label in labels]}")
-        # More flexible animal detection
-        animal_keywords = [
-            "cow", "buffalo", "bull", "ox", "boar", "nilgai", "goat", "pig", "deer",
-            "bovinae", "livestock", "herd", "cattle", "animal"
-        ]
-        detected = {}
-        for label in labels:
-            desc = label.description.lower()
-            for animal in animal_keywords:
-                animal_lc = animal.lower()
-                if (animal_lc in desc or desc in animal_lc) and label.score >= 0.6:
-                    detected[animal] = max(detected.get(animal, 0), float(label.score))
-        logger.info(f"Detected animals: {detected}")
-        if detected:
-            result = {
-                "status": "animal_detected",
-                "labels": list(detected.keys()),
-                "confidence": detected,
-                "alert_level": "high"
-            }
-        else:
-            result = {
-                "status": "clear",
-                "labels": [],
-                "alert_level": "none"
-            }
-        # Build event record
-        label_str = ", ".join(result["labels"]) if result["labels"] else None
-        # Fetch farm and farmer details from Firestore
-        farm_name = None
-        farm_address = None
-        farmer_id = None
-        farmer_language = 'en'
-        farmer_name = None
-        farmer_mobile = None
-        farm_doc = None
-        if should_import_cloud_services() and farm_id:
+        # A static scene needs no model, Vision call or writes; the camera's background model decides
+        key = camera_key(farm_id, camera_id)
+        gate = get_motion_gate() if camera_id and image_bytes is not None else None
+        moved = None
+        if gate:
             try:
-                # Try direct doc fetch
-                farm_doc_ref = firestore.client().collection('farms').document(farm_id)
-                farm_doc = farm_doc_ref.get()
-                if not farm_doc.exists:
-                    # Query by farm_id field if doc not found
-                    farm_query = firestore.client().collection('farms').where('farm_id', '==', farm_id).limit(1).get()
-                    if farm_query:
-                        farm_doc = farm_query[0]
-                if farm_doc and farm_doc.exists:
-                    farm_data = farm_doc.to_dict()
-                    farm_name = farm_data.get('name')
-                    farm_address = farm_data.get('address')
-                    farmer_id = farm_data.get('farmer_id')
+                moved, changed = gate.check(key, image_bytes)
             except Exception as e:
-                logger.error(f"Could not fetch farm details: {e}")
-        farmer_doc = None
-        if should_import_cloud_services() and farmer_id:
+                logger.error(f"Motion gate failed, processing frame: {e}")
+                moved, changed = True, None
+            if not moved:
+                logger.info(f"No motion from {key} ({changed:.4f} of pixels changed), skipping")
+                return create_success_response(get_request_id(req), {
+                    "status": "no_change",
+                    "labels": [],
+                    "alert_level": "none",
+                    "motion": round(changed, 4),
+                    "vision_skipped": True
+                })
+        # Bursts from one camera are folded into a single incident; a re-sent identical frame reuses the last labels
+        aggregator = get_incident_aggregator()
+        digest = frame_digest(image_bytes) if aggregator and image_bytes else None
+        result = aggregator.match_frame(key, digest, moved) if aggregator else None
+        vision_skipped = result is not None
+        if vision_skipped:
+            logger.info(f"Frame is identical to the previous frame from {key}, reusing its labels")
+        prefilter = get_animal_prefilter() if not vision_skipped and image_bytes is not None else None
+        prefilter_score = None
+        if prefilter:
+            # Frames the local model is confident are empty never reach Cloud Vision
             try:
-                # Try direct doc fetch
-                farmer_doc_ref = firestore.client().collection('farmers').document(farmer_id)
-                farmer_doc = farmer_doc_ref.get()
-                if not farmer_doc.exists:
-                    # Query by farmer_id field if doc not found
-                    farmer_query = firestore.client().collection('farmers').where('farmer_id', '==', farmer_id).limit(1).get()
-                    if farmer_query:
-                        farmer_doc = farmer_query[0]
-                if farmer_doc and farmer_doc.exists:
-                    farmer_data = farmer_doc.to_dict()
-                    farmer_language = farmer_data.get('language', 'en')
-                    farmer_name = farmer_data.get('name')
-                    farmer_mobile = farmer_data.get('mobile')
+                passes, prefilter_score = prefilter.maybe_animal(image_bytes)
             except Exception as e:
-                logger.error(f"Could not fetch farmer details: {e}")
-        notification_message = build_notification_message(
-            result["status"], farm_id, camera_id, lat, lng, timestamp, farmer_language, label_str, farmer_name, farm_name, farm_address
-        )
-        event_record = {
-            "status": result["status"],
-            "labels": result["labels"],
-            "confidence": result.get("confidence", {}),
-            "alert_level": result["alert_level"],
-            "lat": lat,
-            "lng": lng,
-            "timestamp": timestamp,
-            "camera_id": camera_id,
-            "farm_id": farm_id,
-            "image_url": image_url if image_url else None,
-            "notification_message": notification_message,
-            "farmer_id": farmer_id,
-            "farmer_language": farmer_language,
-            "farmer_name": farmer_name,
-            "farmer_mobile": farmer_mobile,
-            "farm_name": farm_name,
-            "farm_address": farm_address
-        }
+                logger.error(f"Pre-filter failed, sending frame to Vision: {e}")
+                passes = True
+            if not passes:
+                logger.info(f"Pre-filter score {prefilter_score:.3f} below threshold, skipping Vision")
+                result = {"status": "clear", "labels": [], "alert_level": "none"}
+                vision_skipped = True
+        if not vision_skipped:
+            if image_bytes is not None:
+                image = vision.Image(content=image_bytes)
+                logger.info("Image prepared from base64")
+            else:
+                image = vision.Image()
+                image.source.image_uri = image_url
+                logger.info(f"Image prepared from URL: {image_url}")
+            result = detect_animals_in_image(get_vision_client(), image, logger, label_classifier_for_farm(farm_id))
+        if aggregator:
+            incident, is_new, new_labels = aggregator.observe(key, result, digest, timestamp)
+        else:
+            incident, is_new, new_labels = None, True, result["labels"]
+        # Farm/farmer details and the message are only needed when a record is created or its labels change
+        label_str = None
+        if is_new or new_labels:
+            labels = incident["labels"] if incident else result["labels"]
+            label_str = ", ".join(labels) if labels else None
+            farm_name, farm_address, farmer_id = None, None, None
+            farmer_language, farmer_name, farmer_mobile = 'en', None, None
+            if should_import_cloud_services() and farm_id:
+                farm_name, farm_address, farmer_id = fetch_farm_details(farm_id, logger)
+            if should_import_cloud_services() and farmer_id:
+                farmer_language, farmer_name, farmer_mobile = fetch_farmer_details(farmer_id, logger)
+            notification_message = build_notification_message(
+                result["status"], farm_id, camera_id, lat, lng, timestamp, farmer_language, label_str, farmer_name, farm_name, farm_address
+            )
+            event_record = {
+                "status": result["status"],
+                "labels": result["labels"],
+                "confidence": result.get("confidence", {}),
+                "alert_level": result["alert_level"],
+                "lat": lat,
+                "lng": lng,
+                "timestamp": timestamp,
+                "camera_id": camera_id,
+                "farm_id": farm_id,
+                "image_url": image_url if image_url else None,
+                "notification_message": notification_message,
+                "farmer_id": farmer_id,
+                "farmer_language": farmer_language,
+                "farmer_name": farmer_name,
+                "farmer_mobile": farmer_mobile,
+                "farm_name": farm_name,
+                "farm_address": farm_address
+            }
+        else:
+            event_record = {"image_url": image_url if image_url else None}
+        if incident:
+            event_record.update(incident)
         logger.info(f"Event record to store: {event_record}")
         # Store in Firestore
         if should_import_cloud_services():
-            db_firestore = firestore.client()
-            db_firestore.collection("animal_detections").add(event_record)
-            logger.info("Event stored in Firestore")
-            # Push to Realtime Database for notification
-            if farm_id:
-                db.reference(f"/animal_alerts/{farm_id}").push(event_record)
-                logger.info(f"Event pushed to /animal_alerts/{farm_id} in Realtime Database")
-            elif camera_id:
-                db.reference(f"/animal_alerts/{camera_id}").push(event_record)
-                logger.info(f"Event pushed to /animal_alerts/{camera_id} in Realtime Database")
+            notify = result["status"] == "animal_detected" and (is_new or bool(new_labels))
+            user_phone = None
+            if notify:
+                user_phone = event_record["farmer_mobile"] or data.get('user_phone') or data.get('to') # fallback for demo
+                event_record["notification"] = {"status": "queued" if user_phone else "skipped"}
+            db_firestore = get_firestore()
+            db = get_realtime_db()
+            collection = db_firestore.collection("animal_detections")
+            detection_ref = collection.document(incident["incident_id"]) if incident else collection.document()
+            if is_new:
+                detection_ref.set(event_record)
+                logger.info("Event stored in Firestore")
             else:
-                db.reference(f"/animal_alerts/general").push(event_record)
-                logger.info("Event pushed to /animal_alerts/general in Realtime Database")
-            # Send WhatsApp and SMS notifications only if animal detected
-            if result["status"] == "animal_detected":
+                detection_ref.set(event_record, merge=True)
+                logger.info(f"Frame merged into incident {detection_ref.id} ({incident['frame_count']} frames)")
+            # Push new incidents to Realtime Database for notification; later frames update the same node
+            if is_new:
+                alert_ref = db.reference(f"/animal_alerts/{farm_id or camera_id or 'general'}").push(event_record)
+                logger.info(f"Event pushed to {alert_ref.path} in Realtime Database")
+                if aggregator:
+                    aggregator.set_alert_path(key, incident["incident_id"], alert_ref.path)
+            elif incident["alert_path"]:
+                db.reference(incident["alert_path"]).update(event_record)
+            # WhatsApp and SMS go out in the background; delivery status lands on the detection record.
+            # The dedup key is the farm (or camera) and labels, not the record: frames without
+            # aggregation and re-opened incidents get new record ids but are the same alert.
+            if notify and user_phone:
                 try:
-                    user_phone = farmer_mobile or data.get('user_phone') or data.get('to') # fallback for demo
-                    notify_payload = {
-                        "message": notification_message,
-                        "to": user_phone
-                    }
-                    wa_resp = requests.post(
-                        "https://api-indwreiyca-uc.a.run.app/send-whatsapp-message",
-                        json=notify_payload,
-                        headers={"Content-Type": "application/json"},
-                        timeout=10
+                    job_id = get_notification_dispatcher().enqueue(
+                        event_record["notification_message"], user_phone, farmer_id=event_record["farmer_id"],
+                        alert_key=f"{farm_id or camera_id}|{label_str}", record_id=detection_ref.id
                     )
-                    logger.info(f"WhatsApp notification sent: {wa_resp.status_code}, {wa_resp.text}")
-                    sms_resp = requests.post(
-                        "https://api-indwreiyca-uc.a.run.app/send-sms",
-                        json=notify_payload,
-                        headers={"Content-Type": "application/json"},
-                        timeout=10
-                    )
-                    logger.info(f"SMS notification sent: {sms_resp.status_code}, {sms_resp.text}")
+                    logger.info(f"Notification job {job_id} queued for detection {detection_ref.id}")
                 except Exception as notify_err:
-                    logger.error(f"Failed to send WhatsApp/SMS notification: {notify_err}")
+                    logger.error(f"Failed to queue WhatsApp/SMS notification: {notify_err}")
+            result["detection_id"] = detection_ref.id
+        if incident:
+            result["frame_count"] = incident["frame_count"]
+        result["vision_skipped"] = vision_skipped
+        if prefilter_score is not None:
+            result["prefilter_score"] = round(prefilter_score, 4)
         return create_success_response(get_request_id(req), result)
     except Exception as e:
         logger.error(f"Exception in handle_detect_animals: {e}")
         logger.error(traceback.format_exc())
         return create_error_response(get_request_id(req), "ER500", "Internal server error", str(e), 500)
 
+def detect_animals_in_image(vision_client, image, logger, classifier):
+    """Label the frame with Vision and map the labels to an animal_detected/clear result"""
+    logger.info("Calling Vision API for label detection")
+    response = vision_client.label_detection(image=image)
+    labels = response.label_annotations
+    logger.info(f"Vision API labels: {[label.description for label in labels]}")
+    # One pass over all labels; keyword sets and per-class thresholds can be overridden per farm or region
+    detected = dict(classifier.classify(labels)['animals']['classes'])
+    logger.info(f"Detected animals: {detected}")
+    if detected:
+        return {
+            "status": "animal_detected",
+            "labels": list(detected.keys()),
+            "confidence": detected,
+            "alert_level": "high"
+        }
+    return {
+        "status": "clear",
+        "labels": [],
+        "alert_level": "none"
+    }
+
+def label_classifier_for_farm(farm_id):
+    """Keyword classifier for the farm's own override, then its region's, then the built-in one"""
+    farm = None
+    if farm_id and should_import_cloud_services():
+        try:
+            farm = get_farm_profile(farm_id)
+        except Exception as e:
+            print(f"[LABEL_KEYWORDS] Could not resolve region for farm {farm_id}: {e}")
+    region = (farm.get('region') or farm.get('state')) if farm else None
+    return get_label_classifier(farm_id, region)
+
+def fetch_farm_details(farm_id, logger):
+    """(name, address, farmer_id) of a farm, by document id or farm_id field, from the profile cache"""
+    try:
+        farm_data = get_farm_profile(farm_id)
+        if farm_data:
+            return farm_data.get('name'), farm_data.get('address'), farm_data.get('farmer_id')
+    except Exception as e:
+        logger.error(f"Could not fetch farm details: {e}")
+    return None, None, None
+
+def fetch_farmer_details(farmer_id, logger):
+    """(language, name, mobile) of a farmer, by document id or farmer_id field, from the profile cache"""
+    try:
+        farmer_data = get_farmer_profile(farmer_id)
+        if farmer_data:
+            return farmer_data.get('language', 'en'), farmer_data.get('name'), farmer_data.get('mobile')
+    except Exception as e:
+        logger.error(f"Could not fetch farmer details: {e}")
+    return 'en', None, None
+
 def build_notification_message(result, farm_id, camera_id, lat, lng, timestamp, lang, label_str=None, farmer_name=None, farm_name=None, farm_address=None):
     """Builds a notification message in the preferred language, with salutation, name, and farm details."""
     name_part = f"{farmer_name}, " if farmer_name else ""
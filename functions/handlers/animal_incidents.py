@@ -0,0 +1,140 @@
+import uuid
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from utils.cache_utils import LRUCache
+from utils.metrics_utils import register_metrics
+from utils.settings import get_settings
+
+# Consecutive frames from one camera with the same outcome, each within the incident window
+# of the previous one, are merged into a single animal_detections incident. A frame
+# byte-identical to the camera's previous frame (a re-sent upload) reuses its Vision labels;
+# only exact content matches, since a small animal barely moves a perceptual hash.
+
+def camera_key(farm_id, camera_id):
+    return f"{farm_id or ''}|{camera_id or ''}"
+
+def frame_digest(image_bytes):
+    """Content digest of the frame bytes"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+class Incident:
+    __slots__ = ('incident_id', 'status', 'labels', 'confidence', 'frame_count', 'first_seen', 'last_seen',
+                 'first_timestamp', 'last_timestamp', 'frame_digest', 'result', 'alert_path')
+
+    def __init__(self, status, now, timestamp):
+        self.incident_id = uuid.uuid4().hex
+        self.status = status
+        self.labels = []
+        self.confidence = {}
+        self.frame_count = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.first_timestamp = timestamp
+        self.last_timestamp = timestamp
+        self.frame_digest = None
+        self.result = None
+        self.alert_path = None
+
+    def fields(self):
+        """Incident fields merged into the animal_detections document on every frame"""
+        return {
+            "alert_path": self.alert_path,
+            "incident_id": self.incident_id,
+            "labels": list(self.labels),
+            "confidence": dict(self.confidence),
+            "frame_count": self.frame_count,
+            "first_seen": self.first_timestamp,
+            "last_seen": self.last_timestamp,
+            "timestamp": self.first_timestamp
+        }
+
+class IncidentAggregator:
+    """
+    Per camera/farm sliding-window aggregation of detection frames into incidents.
+    `match_frame` lets a byte-identical frame reuse the previous Vision result, and
+    `observe` folds a frame's result into the open incident or starts a new one; it
+    reports which labels are new so callers only notify when something changed.
+    State is per instance, so frames of one burst that land on different instances
+    still produce separate incidents.
+    """
+
+    def __init__(self, window=None, max_cameras=None, reuse=None):
+        settings = get_settings()
+        self.window = settings.incident_window if window is None else window
+        self.reuse = settings.frame_reuse_enabled if reuse is None else reuse
+        self._open = LRUCache(settings.incident_tracked_cameras if max_cameras is None else max_cameras, ttl=self.window)
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.incidents = 0
+        self.vision_skipped = 0
+
+    def match_frame(self, key, digest=None, moved=None):
+        """
+        Vision result of the open incident's last frame if this frame has the same content
+        digest. `moved` is the motion gate's verdict (None when it did not run); a frame that
+        moved never reuses a "clear" result, since the change may be an animal entering.
+        """
+        if not self.reuse or digest is None:
+            return None
+        with self._lock:
+            incident = self._open.get(key, count=False)
+            if incident is None or incident.result is None or incident.frame_digest != digest:
+                return None
+            if moved and incident.result.get("status") != "animal_detected":
+                return None
+            self.vision_skipped += 1
+            return dict(incident.result)
+
+    def observe(self, key, result, digest=None, timestamp=None):
+        """Fold one frame in; returns (incident fields snapshot, is_new, new_labels)"""
+        now = time.time()
+        with self._lock:
+            self.frames += 1
+            incident = self._open.get(key)
+            is_new = incident is None or incident.status != result["status"] or now - incident.last_seen > self.window
+            if is_new:
+                incident = Incident(result["status"], now, timestamp)
+                self.incidents += 1
+            new_labels = [label for label in result.get("labels", []) if label not in incident.labels]
+            incident.labels.extend(new_labels)
+            for label, score in result.get("confidence", {}).items():
+                incident.confidence[label] = max(incident.confidence.get(label, 0), score)
+            incident.frame_count += 1
+            incident.last_seen = now
+            incident.last_timestamp = timestamp
+            incident.frame_digest = digest
+            incident.result = dict(result)
+            # Re-setting refreshes the TTL, so the window slides with each frame
+            self._open.set(key, incident)
+            return incident.fields(), is_new, new_labels
+
+    def set_alert_path(self, key, incident_id, path):
+        """Remember where the incident was pushed in the Realtime Database, for later updates"""
+        with self._lock:
+            incident = self._open.get(key, count=False)
+            if incident is not None and incident.incident_id == incident_id:
+                incident.alert_path = path
+
+    def stats(self):
+        return OrderedDict([
+            ("open_incidents", len(self._open)),
+            ("frames", self.frames),
+            ("incidents", self.incidents),
+            ("vision_skipped", self.vision_skipped)
+        ])
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+def get_incident_aggregator():
+    """Per-instance IncidentAggregator, or None when INCIDENT_AGGREGATION_ENABLED=false"""
+    global _aggregator
+    if not get_settings().incident_aggregation_enabled:
+        return None
+    with _aggregator_lock:
+        if _aggregator is None:
+            _aggregator = IncidentAggregator()
+            register_metrics('animal_incidents', _aggregator.stats)
+        return _aggregator
@@ -1,14 +1,27 @@
 # This module supports dual registration: Flask routes for local dev, and Google Cloud Functions for deployment.
 # Use register_crop_diagnose_routes(app) for Flask, and @https_fn.on_request() in main.py for GCF.
+import time
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from collections import OrderedDict
 from utils.request_utils import get_auth_token, validate_auth_token, get_request_id, get_field
-from utils.response_utils import create_error_response, create_success_response, ordered_json_response
+from utils.response_utils import create_error_response, create_success_response, ordered_json_response, stream_response, STREAM_MIMETYPES
+from utils.json_stream import IncrementalObjectParser
 from utils.env_utils import is_local_environment
+from utils.settings import get_settings, debug
+from handlers.diagnosis_cache import get_diagnosis_cache, get_near_duplicate_index, diagnosis_cache_key
+from handlers.diagnosis_history import (
+    HISTORY_VIEWS, fetch_history_page, encode_history_cursor, serialize_history_entry, record_recent_diagnosis
+)
+from utils.image_utils import normalize_image, image_normalization_stats
+from utils.metrics_utils import register_metrics
+from utils.write_behind import get_write_behind
+from handlers.label_keywords import get_label_classifier
 from collections import OrderedDict
 from utils.response_utils import ordered_json_response, get_request_id
 from utils.request_utils import get_field
-from firebase_admin import firestore
+from utils.services import get_firestore, get_storage_bucket, get_vision_client, get_gemini_model
 
 # --- Supported languages and schema ---
 SUPPORTED_LANGUAGES = {
@@ -238,6 +251,117 @@ def get_nearby_dealers(location):
     ]
     return mock_dealers
 
+# --- Diagnosis pipeline execution ---
+# Settings.diagnosis_execution_mode: 'concurrent' overlaps the storage upload with Vision +
+# Gemini, 'sequential' runs them one by one. Settings.diagnosis_skip_vision starts Gemini
+# straight away, trading the Vision label context in the prompt for one fewer round trip.
+
+_diagnosis_executor = None
+_diagnosis_executor_lock = threading.Lock()
+
+register_metrics('image_normalization', image_normalization_stats)
+
+def get_diagnosis_executor():
+    global _diagnosis_executor
+    with _diagnosis_executor_lock:
+        if _diagnosis_executor is None:
+            _diagnosis_executor = ThreadPoolExecutor(max_workers=get_settings().diagnosis_max_workers, thread_name_prefix='diagnose')
+        return _diagnosis_executor
+
+def _timed(timings, stage, fn, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+class _ReuseLookup:
+    """Cache/near-duplicate lookup state for one image, so a fresh result can be remembered"""
+    __slots__ = ('cache', 'cache_key', 'near_index', 'group_key', 'image_hash', 'result')
+
+    def __init__(self):
+        self.cache = self.cache_key = self.near_index = self.group_key = self.image_hash = self.result = None
+
+def find_reusable_diagnosis(image_bytes, user_id, crop_type, language, decoded_image=None, timings=None, is_local=None):
+    """Look up an earlier result for this image in the diagnosis cache and near-duplicate index"""
+    timings = OrderedDict() if timings is None else timings
+    lookup = _ReuseLookup()
+    if is_local is None:
+        is_local = is_local_environment()
+    if is_local:
+        return lookup
+    # Identical image + crop + language: reuse the earlier Vision/Gemini result
+    lookup.cache = get_diagnosis_cache()
+    if lookup.cache:
+        lookup.cache_key = diagnosis_cache_key(image_bytes, crop_type, language)
+        lookup.result = _timed(timings, 'cache_lookup', lookup.cache.get, lookup.cache_key)
+    if lookup.result is not None:
+        return lookup
+    # Re-encoded or slightly cropped copy from the same user and crop: reuse the recent result
+    lookup.near_index = get_near_duplicate_index()
+    if lookup.near_index:
+        lookup.group_key = lookup.near_index.group_key(user_id, crop_type, language)
+        try:
+            lookup.image_hash = _timed(timings, 'image_hash', lookup.near_index.image_hash,
+                                       decoded_image if decoded_image is not None else image_bytes)
+            lookup.result = lookup.near_index.find(lookup.group_key, lookup.image_hash)
+        except Exception as e:
+            print(f"[DIAGNOSE] Perceptual hash failed, skipping near-duplicate lookup: {e}")
+        if lookup.result is not None and lookup.cache:
+            lookup.cache.set(lookup.cache_key, lookup.result)
+    return lookup
+
+def remember_diagnosis(lookup, diagnosis_result):
+    if lookup.cache:
+        lookup.cache.set(lookup.cache_key, diagnosis_result)
+    if lookup.image_hash is not None:
+        lookup.near_index.add(lookup.group_key, lookup.image_hash, diagnosis_result)
+
+def run_diagnosis_stages(image_bytes, user_id, crop_type, language, skip_vision=None, decoded_image=None, thumbnail_bytes=None, timings=None):
+    """Run upload, Vision and Gemini; returns (image_url, diagnosis_result, timings_ms)"""
+    timings = OrderedDict() if timings is None else timings
+    start = time.perf_counter()
+    lookup = find_reusable_diagnosis(image_bytes, user_id, crop_type, language, decoded_image, timings)
+    if lookup.result is not None:
+        image_url = _timed(timings, 'upload', upload_image_to_storage, image_bytes, user_id, crop_type, thumbnail_bytes)
+        timings['total'] = round((time.perf_counter() - start) * 1000, 1)
+        return image_url, lookup.result, timings
+    image_url, diagnosis_result, timings = _run_uncached_stages(image_bytes, user_id, crop_type, language, skip_vision, thumbnail_bytes, timings)
+    remember_diagnosis(lookup, diagnosis_result)
+    timings['total'] = round((time.perf_counter() - start) * 1000, 1)
+    return image_url, diagnosis_result, timings
+
+def _run_uncached_stages(image_bytes, user_id, crop_type, language, skip_vision, thumbnail_bytes, timings):
+    settings = get_settings()
+    if settings.diagnosis_execution_mode == 'sequential':
+        image_url = _timed(timings, 'upload', upload_image_to_storage, image_bytes, user_id, crop_type, thumbnail_bytes)
+        vision_analysis = _timed(timings, 'vision', analyze_image_with_vision, image_bytes)
+        diagnosis_result = _timed(timings, 'gemini', get_gemini_diagnosis, image_bytes, crop_type, vision_analysis, language)
+        return image_url, diagnosis_result, timings
+    if skip_vision is None:
+        skip_vision = settings.diagnosis_skip_vision
+    executor = get_diagnosis_executor()
+    cancelled = threading.Event()
+    def vision_then_gemini():
+        vision_analysis = _timed(timings, 'vision', analyze_image_with_vision, image_bytes)
+        if cancelled.is_set():
+            return None
+        return _timed(timings, 'gemini', get_gemini_diagnosis, image_bytes, crop_type, vision_analysis, language)
+    futures = {'upload': executor.submit(_timed, timings, 'upload', upload_image_to_storage, image_bytes, user_id, crop_type, thumbnail_bytes)}
+    if skip_vision:
+        futures['gemini'] = executor.submit(_timed, timings, 'gemini', get_gemini_diagnosis, image_bytes, crop_type, [], language)
+    else:
+        futures['gemini'] = executor.submit(vision_then_gemini)
+    done, pending = wait(futures.values(), return_when=FIRST_EXCEPTION)
+    for future in done:
+        if future.exception() is not None:
+            # First failing stage wins; stop anything not yet started and drop the rest
+            cancelled.set()
+            for other in pending:
+                other.cancel()
+            raise future.exception()
+    return futures['upload'].result(), futures['gemini'].result(), timings
+
 def process_diagnosis_request(request_data):
     user_id = request_data['user_id']
     crop_type = request_data['crop_type']
@@ -245,64 +369,161 @@ def process_diagnosis_request(request_data):
     image_bytes = request_data['image_bytes']
     language = request_data.get('language', DEFAULT_LANGUAGE)
     try:
-        image_url = upload_image_to_storage(image_bytes, user_id, crop_type)
-        vision_analysis = analyze_image_with_vision(image_bytes)
-        diagnosis_result = get_gemini_diagnosis(image_bytes, crop_type, vision_analysis, language)
+        # Decode, orient and downsize once; every later stage shares normalized.data
+        normalized = normalize_image(image_bytes)
+        timings = OrderedDict([('normalize', normalized.elapsed_ms)])
+        debug('DIAGNOSE', 'normalized image', original_bytes=normalized.original_size, bytes=len(normalized.data),
+              saved=normalized.bytes_saved, ms=normalized.elapsed_ms)
+        image_url, diagnosis_result, timings = run_diagnosis_stages(
+            normalized.data, user_id, crop_type, language,
+            decoded_image=normalized.image, thumbnail_bytes=normalized.thumbnail, timings=timings
+        )
+        debug('DIAGNOSE', 'stage timings (ms)', user_id=user_id, crop=crop_type, **timings)
         diagnosis_result = to_ordered(diagnosis_result, DIAGNOSIS_SCHEMA_ORDER)
-        nearby_dealers = get_nearby_dealers(location)
-        response_data = OrderedDict([
-            ("user_id", user_id),
-            ("crop", crop_type),
-            ("diagnosis_result", diagnosis_result),
-            ("nearby_dealer", nearby_dealers),
-            ("image_url", image_url),
-            ("language", language)
-        ])
-        return response_data
+        return build_diagnosis_response(request_data, diagnosis_result, image_url, timings)
     except Exception as e:
         raise
 
+def build_diagnosis_response(request_data, diagnosis_result, image_url, timings):
+    return OrderedDict([
+        ("user_id", request_data['user_id']),
+        ("crop", request_data['crop_type']),
+        ("diagnosis_result", diagnosis_result),
+        ("nearby_dealer", get_nearby_dealers(request_data['location'])),
+        ("image_url", image_url),
+        ("language", request_data.get('language', DEFAULT_LANGUAGE)),
+        ("timings_ms", timings)
+    ])
+
+# --- Streaming diagnosis ---
+def get_stream_format(req):
+    """'sse' or 'ndjson' when the client asked for a streamed diagnosis, otherwise None"""
+    accept = req.headers.get('Accept', '') if hasattr(req, 'headers') else ''
+    if 'text/event-stream' in accept:
+        return 'sse'
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    stream = (req.args.get('stream', '') if hasattr(req, 'args') else '').lower()
+    if stream in STREAM_MIMETYPES:
+        return stream
+    return 'sse' if stream == 'true' else None
+
+def _section_event(key, value):
+    schema = DIAGNOSIS_SCHEMA_ORDER.get(key)
+    return 'section', OrderedDict([("key", key), ("value", to_ordered(value, schema if isinstance(schema, dict) else {}))])
+
+def stream_diagnosis_events(request_data, save_result=False):
+    """
+    Yield (event, data) pairs for one diagnosis: 'accepted', then one 'section' per top-level
+    diagnosis field as soon as Gemini has produced it (disease_name, severity and stage come
+    first), then 'complete' with the full response, or 'error'.
+    """
+    user_id = request_data['user_id']
+    crop_type = request_data['crop_type']
+    language = request_data.get('language', DEFAULT_LANGUAGE)
+    start = time.perf_counter()
+    try:
+        normalized = normalize_image(request_data['image_bytes'])
+        timings = OrderedDict([('normalize', normalized.elapsed_ms)])
+        yield 'accepted', OrderedDict([("user_id", user_id), ("crop", crop_type), ("language", language)])
+        upload_future = get_diagnosis_executor().submit(
+            _timed, timings, 'upload', upload_image_to_storage, normalized.data, user_id, crop_type, normalized.thumbnail
+        )
+        lookup = find_reusable_diagnosis(normalized.data, user_id, crop_type, language, normalized.image, timings)
+        if lookup.result is not None:
+            diagnosis_result = lookup.result
+            for key, value in to_ordered(diagnosis_result, DIAGNOSIS_SCHEMA_ORDER).items():
+                yield _section_event(key, value)
+        else:
+            vision_analysis = _timed(timings, 'vision', analyze_image_with_vision, normalized.data)
+            gemini_start = time.perf_counter()
+            parser = IncrementalObjectParser()
+            for chunk in stream_gemini_diagnosis(normalized.data, crop_type, vision_analysis, language):
+                for key, value in parser.feed(chunk):
+                    if 'gemini_first_section' not in timings:
+                        timings['gemini_first_section'] = round((time.perf_counter() - gemini_start) * 1000, 1)
+                    yield _section_event(key, value)
+            diagnosis_result = parser.close()
+            timings['gemini'] = round((time.perf_counter() - gemini_start) * 1000, 1)
+            remember_diagnosis(lookup, diagnosis_result)
+        image_url = upload_future.result()
+        timings['total'] = round((time.perf_counter() - start) * 1000, 1)
+        response_data = build_diagnosis_response(request_data, to_ordered(diagnosis_result, DIAGNOSIS_SCHEMA_ORDER), image_url, timings)
+        if save_result:
+            diagnosis_id = save_to_firestore(user_id, {'crop': crop_type, 'location': request_data['location']}, response_data, image_url)
+            response_data = OrderedDict([*response_data.items(), ("diagnosis_id", diagnosis_id)])
+        yield 'complete', response_data
+    except Exception as e:
+        yield 'error', OrderedDict([("code", "ER500"), ("message", "Internal server error"), ("description", str(e))])
+
 # --- Image processing and AI functions ---
-def upload_image_to_storage(image_bytes, user_id, crop_type):
-    import os
+def upload_image_to_storage(image_bytes, user_id, crop_type, thumbnail_bytes=None):
     import time
+    import uuid
     if is_local_environment():
         return None
-    from firebase_admin import storage
-    BUCKET_NAME = os.getenv('GCS_BUCKET', 'cropmind-89afe.appspot.com')
-    bucket = storage.bucket(BUCKET_NAME)
-    timestamp = str(int(time.time()))
-    filename = f"diagnoses/{user_id}/{crop_type}_{timestamp}.jpg"
-    blob = bucket.blob(filename)
-    blob.upload_from_string(image_bytes, content_type='image/jpeg')
+    bucket = get_storage_bucket(get_settings().bucket_name)
+    # Unique per image: batch uploads for one user and crop share the same second
+    name = f"diagnoses/{user_id}/{crop_type}_{int(time.time())}_{uuid.uuid4().hex}"
+    blob = bucket.blob(f"{name}.jpg")
+    uploads = [(blob, image_bytes)]
+    if thumbnail_bytes:
+        uploads.append((bucket.blob(f"{name}_thumb.jpg"), thumbnail_bytes))
+    write_behind = get_write_behind()
+    for target, data in uploads:
+        # public_url is derived from the object name, so it can be returned before the upload lands
+        if write_behind:
+            write_behind.submit(target.upload_from_string, data, 'image/jpeg')
+        else:
+            target.upload_from_string(data, content_type='image/jpeg')
     return blob.public_url
 
+VISION_BATCH_SIZE = 16  # Vision API limit on images per batch_annotate_images call
+FIRESTORE_BATCH_LIMIT = 500  # Firestore limit on writes per batched commit
+
+def _agricultural_labels(labels):
+    matched = get_label_classifier().classify(labels)['agricultural']['labels']
+    return [{'description': label.description, 'confidence': label.score} for label in matched]
+
 def analyze_image_with_vision(image_bytes):
     from utils.env_utils import is_local_environment, should_import_cloud_services
     if is_local_environment():
         return []
     from google.cloud import vision
-    from main import vision_client
+    vision_client = get_vision_client()
     image = vision.Image(content=image_bytes)
     response = vision_client.label_detection(image=image)
-    labels = response.label_annotations
-    agricultural_labels = []
-    for label in labels:
-        if any(keyword in label.description.lower() for keyword in 
-               ['plant', 'leaf', 'disease', 'fungus', 'spot', 'yellow', 'brown', 'white']):
-            agricultural_labels.append({
-                'description': label.description,
-                'confidence': label.score
-            })
-    return agricultural_labels
+    return _agricultural_labels(response.label_annotations)
 
-def get_gemini_diagnosis(image_bytes, crop_type, vision_analysis, language=DEFAULT_LANGUAGE):
-    import json
+def analyze_images_with_vision_batch(images):
+    """Label many images with batch_annotate_images; returns one label list or Exception per image"""
     if is_local_environment():
-        return get_mock_diagnosis_result()
-    import google.generativeai as genai
-    image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-    model = genai.GenerativeModel('gemini-1.5-flash')
+        return [[] for _ in images]
+    from google.cloud import vision
+    vision_client = get_vision_client()
+    results = []
+    for start in range(0, len(images), VISION_BATCH_SIZE):
+        chunk = images[start:start + VISION_BATCH_SIZE]
+        requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=image_bytes),
+                features=[vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION)]
+            )
+            for image_bytes in chunk
+        ]
+        try:
+            response = vision_client.batch_annotate_images(requests=requests)
+        except Exception as e:
+            results.extend(e for _ in chunk)
+            continue
+        for item in response.responses:
+            if item.error and item.error.message:
+                results.append(RuntimeError(f"Vision error: {item.error.message}"))
+            else:
+                results.append(_agricultural_labels(item.label_annotations))
+    return results
+
+def build_diagnosis_prompt(crop_type, vision_analysis, language=DEFAULT_LANGUAGE):
     vision_context = "\n".join([f"- {label['description']} (confidence: {label['confidence']:.2f})" for label in vision_analysis])
     language_name = SUPPORTED_LANGUAGES.get(language, 'English')
     prompt = f"""
@@ -380,7 +601,16 @@ def get_gemini_diagnosis(image_bytes, crop_type, vision_analysis, language=DEFAU
         "confidence_score": 85
     }}
     """
-    response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": image_base64}])
+    return prompt
+
+def get_gemini_diagnosis(image_bytes, crop_type, vision_analysis, language=DEFAULT_LANGUAGE):
+    import json
+    if is_local_environment():
+        return get_mock_diagnosis_result()
+    model = get_gemini_model()
+    prompt = build_diagnosis_prompt(crop_type, vision_analysis, language)
+    # Raw bytes: the client serializes the blob itself, no extra base64 copy needed
+    response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": image_bytes}])
     text = response.text.strip()
     if text.startswith("```json"):
         text = text[len("```json"):].strip()
@@ -391,23 +621,79 @@ def get_gemini_diagnosis(image_bytes, crop_type, vision_analysis, language=DEFAU
     result = json.loads(text)
     return result
 
+def stream_gemini_diagnosis(image_bytes, crop_type, vision_analysis, language=DEFAULT_LANGUAGE):
+    """Yield raw text chunks of the Gemini diagnosis JSON as they are generated"""
+    if is_local_environment():
+        import json
+        text = json.dumps(get_mock_diagnosis_result(), ensure_ascii=False)
+        for start in range(0, len(text), 64):
+            yield text[start:start + 64]
+        return
+    model = get_gemini_model()
+    prompt = build_diagnosis_prompt(crop_type, vision_analysis, language)
+    response = model.generate_content([prompt, {"mime_type": "image/jpeg", "data": image_bytes}], stream=True)
+    for chunk in response:
+        if chunk.parts:
+            yield chunk.text
+
+def _stored_response(response_data):
+    # Stage timings describe one request's latency, not the diagnosis; they stay out of history
+    return OrderedDict((key, value) for key, value in response_data.items() if key != 'timings_ms')
+
 def save_to_firestore(user_id, request_data, response_data, image_url=None):
     from utils.env_utils import is_local_environment
     if is_local_environment():
         return None
     from firebase_admin import firestore
-    db = firestore.client()
+    db = get_firestore()
+    # The document ID is allocated client-side, so it can be returned before the write commits
     doc_ref = db.collection('diagnoses').document()
     doc_data = {
         'user_id': user_id,
         'timestamp': firestore.SERVER_TIMESTAMP,
         'request': request_data,
-        'response': response_data,
+        'response': _stored_response(response_data),
         'image_url': image_url
     }
-    doc_ref.set(doc_data)
+    write_behind = get_write_behind()
+    if write_behind:
+        write_behind.set_document('diagnoses', doc_ref.id, doc_data)
+    else:
+        doc_ref.set(doc_data)
+    record_recent_diagnosis(user_id, doc_ref.id, doc_data)
     return doc_ref.id
 
+def save_batch_to_firestore(records):
+    """Write (user_id, request_data, response_data, image_url) records with batched commits; returns doc IDs"""
+    from utils.env_utils import is_local_environment
+    if is_local_environment() or not records:
+        return []
+    from firebase_admin import firestore
+    db = get_firestore()
+    write_behind = get_write_behind()
+    doc_ids = []
+    for start in range(0, len(records), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for user_id, request_data, response_data, image_url in records[start:start + FIRESTORE_BATCH_LIMIT]:
+            doc_ref = db.collection('diagnoses').document()
+            doc_data = {
+                'user_id': user_id,
+                'timestamp': firestore.SERVER_TIMESTAMP,
+                'request': request_data,
+                'response': _stored_response(response_data),
+                'image_url': image_url
+            }
+            # The write-behind worker groups queued sets into batched commits itself
+            if write_behind:
+                write_behind.set_document('diagnoses', doc_ref.id, doc_data)
+            else:
+                batch.set(doc_ref, doc_data)
+            record_recent_diagnosis(user_id, doc_ref.id, doc_data)
+            doc_ids.append(doc_ref.id)
+        if not write_behind:
+            batch.commit()
+    return doc_ids
+
 def use_mock_response(req):
     if hasattr(req, 'headers'):
         return req.headers.get('X-Mock-Response', 'false').lower() == 'true'
@@ -430,6 +716,9 @@ def handle_diagnose_request(req):
         if not is_valid:
             return create_error_response(request_id, code, message, description, status_code)
         mock_mode = use_mock_response(req)
+        stream_format = get_stream_format(req)
+        if stream_format and not mock_mode:
+            return stream_response(stream_diagnosis_events(request_data, save_result=not is_local), stream_format)
         if mock_mode:
             response_data = get_mock_diagnosis_result()
             ordered_result = OrderedDict([
@@ -441,14 +730,16 @@ def handle_diagnose_request(req):
         else:
             ordered_result = process_diagnosis_request(request_data)
         if not is_local:
-            save_to_firestore(
+            diagnosis_id = save_to_firestore(
                 request_data['user_id'],
                 {
                     'crop': request_data['crop_type'],
                     'location': request_data['location']
                 },
-                ordered_result
+                ordered_result,
+                ordered_result.get('image_url')
             )
+            ordered_result = OrderedDict([*ordered_result.items(), ("diagnosis_id", diagnosis_id)])
         return create_success_response(request_id, ordered_result)
     except Exception as e:
         return create_error_response(request_id, "ER500", "Internal server error", str(e), 500)
@@ -466,23 +757,28 @@ def handle_diagnosis_history(req):
     user_id = get_field('user_id')
     limit = int(get_field('limit') or 10)
     offset = int(get_field('offset') or 0)
+    # Opaque cursor from a previous page's next_cursor; preferred over offset
+    start_after = get_field('start_after')
+    view = get_field('view') or 'full'
+    if view not in HISTORY_VIEWS:
+        return create_error_response(request_id, "ER106", "Invalid view", f"view must be one of: {', '.join(HISTORY_VIEWS)}", 400)
     try:
-        db = firestore.client()
-        query = db.collection('diagnoses').where('user_id', '==', user_id).order_by('timestamp', direction=firestore.Query.DESCENDING)
-        docs = query.offset(offset).limit(limit).stream()
-        history = []
-        for doc in docs:
-            data = doc.to_dict()
-            # Convert Firestore timestamp to ISO string if present
-            if 'timestamp' in data and hasattr(data['timestamp'], 'isoformat'):
-                data['timestamp'] = data['timestamp'].isoformat()
-            history.append(data)
+        try:
+            items, has_more = fetch_history_page(user_id, limit=limit, view=view, cursor=start_after, offset=offset)
+        except ValueError as e:
+            return create_error_response(request_id, "ER106", "Invalid start_after", str(e), 400)
+        next_cursor = None
+        if has_more and items:
+            next_cursor = encode_history_cursor(items[-1][0])
+        history = [serialize_history_entry(doc_id, data) for doc_id, data in items]
         resp = OrderedDict([
             ("status", "success"),
             ("requestId", request_id),
             ("data", OrderedDict([
                 ("user_id", user_id),
-                ("history", history)
+                ("history", history),
+                ("next_cursor", next_cursor),
+                ("has_more", has_more)
             ]))
         ])
         return ordered_json_response(resp)
@@ -528,8 +824,236 @@ def handle_diagnose_crop_json(req):
             'image_bytes': image_bytes,
             'language': language
         }
+        stream_format = get_stream_format(req)
+        if stream_format:
+            return stream_response(stream_diagnosis_events(request_data), stream_format)
         ordered_result = process_diagnosis_request(request_data)
         return create_success_response(get_request_id(req), ordered_result)
     except Exception as e:
         return create_error_response(get_request_id(req), "ER500", "Internal server error", str(e), 500)
 
+
+
+# --- Batch diagnosis for multi-image field surveys ---
+
+def extract_batch_request_data(req, is_local=False):
+    """Parse a batch request (JSON images array or multipart 'images' files) into per-image dicts"""
+    try:
+        if req.content_type and 'application/json' in req.content_type:
+            data = req.get_json(force=True, silent=True)
+            if not data:
+                return False, "ER105", "Invalid JSON", "Request body must be valid JSON", 400, None
+            user_id = data.get('user_id')
+            crop_type = data.get('crop')
+            location = data.get('location', 'Unknown')
+            language = data.get('language', DEFAULT_LANGUAGE)
+            raw_images = data.get('images') or []
+            images = []
+            for i, item in enumerate(raw_images):
+                # Each item is a base64 string or {"image_base64": ..., "crop": ..., "id": ...}
+                if isinstance(item, str):
+                    item = {'image_base64': item}
+                image_base64 = item.get('image_base64') or ''
+                if image_base64.startswith('data:image'):
+                    image_base64 = image_base64.split(',', 1)[-1]
+                try:
+                    image_bytes = base64.b64decode(image_base64)
+                except Exception:
+                    image_bytes = b''
+                images.append({
+                    'id': str(item.get('id', i)),
+                    'crop_type': item.get('crop', crop_type),
+                    'image_bytes': image_bytes
+                })
+        elif (req.content_type and 'multipart/form-data' in req.content_type) or is_local:
+            form_data = req.form
+            user_id = form_data.get('user_id')
+            crop_type = form_data.get('crop')
+            location = form_data.get('location', 'Unknown')
+            language = form_data.get('language', DEFAULT_LANGUAGE)
+            files = req.files.getlist('images') or req.files.getlist('image')
+            images = [
+                {'id': image_file.filename or str(i), 'crop_type': crop_type, 'image_bytes': image_file.read()}
+                for i, image_file in enumerate(files)
+            ]
+        else:
+            return False, "ER105", "Invalid content type", "multipart/form-data or application/json required", 400, None
+        if not user_id:
+            return False, "ER101", "Missing user_id", "user_id is required", 400, None
+        if not crop_type and any(not image['crop_type'] for image in images):
+            return False, "ER102", "Missing crop", "crop name is required", 400, None
+        if not images:
+            return False, "ER103", "Missing images", "At least one image is required", 400, None
+        max_images = get_settings().batch_max_images
+        if len(images) > max_images:
+            return False, "ER107", "Too many images", f"At most {max_images} images per batch", 400, None
+        if language not in SUPPORTED_LANGUAGES:
+            language = DEFAULT_LANGUAGE
+        return True, None, None, None, None, {
+            'user_id': user_id,
+            'crop_type': crop_type,
+            'location': location,
+            'language': language,
+            'images': images
+        }
+    except Exception as e:
+        return False, "ER500", "Data extraction error", str(e), 500, None
+
+def summarize_batch_results(results):
+    """Field-level summary: disease counts, severity distribution and mean confidence"""
+    diseases = OrderedDict()
+    severities = OrderedDict()
+    confidences = []
+    for item in results:
+        diagnosis = item.get('diagnosis_result')
+        if not diagnosis:
+            continue
+        disease = diagnosis.get('disease_name') or 'Unknown'
+        diseases[disease] = diseases.get(disease, 0) + 1
+        severity = diagnosis.get('severity') or 'Unknown'
+        severities[severity] = severities.get(severity, 0) + 1
+        try:
+            confidences.append(float(diagnosis.get('confidence_score')))
+        except (TypeError, ValueError):
+            pass
+    diagnosed = sum(diseases.values())
+    return OrderedDict([
+        ("images", len(results)),
+        ("diagnosed", diagnosed),
+        ("failed", len(results) - diagnosed),
+        ("most_common_disease", max(diseases, key=diseases.get) if diseases else None),
+        ("diseases", OrderedDict(sorted(diseases.items(), key=lambda kv: -kv[1]))),
+        ("severity", severities),
+        ("avg_confidence_score", round(sum(confidences) / len(confidences), 1) if confidences else None)
+    ])
+
+def process_diagnosis_batch(batch_data, mock_mode=False):
+    user_id = batch_data['user_id']
+    language = batch_data['language']
+    images = batch_data['images']
+    is_local = is_local_environment()
+    timings = OrderedDict()
+    start = time.perf_counter()
+    executor = get_diagnosis_executor()
+    results = [OrderedDict([("id", image['id']), ("crop", image['crop_type'])]) for image in images]
+
+    # Normalize every image once, in parallel (Pillow releases the GIL while decoding/resizing)
+    stage_start = time.perf_counter()
+    valid = [i for i, image in enumerate(images) if image['image_bytes']]
+    for i, image in enumerate(images):
+        if not image['image_bytes']:
+            results[i]['error'] = OrderedDict([("code", "ER104"), ("message", "Invalid image"), ("description", "Image is empty or not valid base64")])
+    normalized = dict(zip(valid, executor.map(normalize_image, [images[i]['image_bytes'] for i in valid])))
+    timings['normalize'] = round((time.perf_counter() - stage_start) * 1000, 1)
+
+    # Reuse cached or near-duplicate diagnoses; only the rest go to Vision and Gemini
+    lookups = {}
+    pending = []
+    first_by_key = {}
+    duplicates = {}
+    for i in valid:
+        if mock_mode:
+            results[i]['diagnosis_result'] = get_mock_diagnosis_result()
+            continue
+        lookups[i] = find_reusable_diagnosis(normalized[i].data, user_id, images[i]['crop_type'], language,
+                                             normalized[i].image, is_local=is_local)
+        if lookups[i].result is not None:
+            results[i]['diagnosis_result'] = lookups[i].result
+            results[i]['cached'] = True
+        elif lookups[i].cache_key is not None and lookups[i].cache_key in first_by_key:
+            # Same photo twice in one survey: diagnose it once
+            duplicates[i] = first_by_key[lookups[i].cache_key]
+        else:
+            first_by_key[lookups[i].cache_key] = i
+            pending.append(i)
+
+    upload_futures = {} if mock_mode else {
+        i: executor.submit(upload_image_to_storage, normalized[i].data, user_id, images[i]['crop_type'], normalized[i].thumbnail)
+        for i in valid
+    }
+
+    stage_start = time.perf_counter()
+    vision_results = analyze_images_with_vision_batch([normalized[i].data for i in pending]) if pending else []
+    timings['vision'] = round((time.perf_counter() - stage_start) * 1000, 1)
+
+    stage_start = time.perf_counter()
+    def diagnose(i, vision_analysis):
+        return get_gemini_diagnosis(normalized[i].data, images[i]['crop_type'], vision_analysis, language)
+    gemini_futures = {}
+    # A dedicated pool caps concurrent Gemini calls for this batch
+    with ThreadPoolExecutor(max_workers=get_settings().batch_gemini_concurrency, thread_name_prefix='diagnose-batch') as gemini_pool:
+        for i, vision_analysis in zip(pending, vision_results):
+            if isinstance(vision_analysis, Exception):
+                results[i]['error'] = OrderedDict([("code", "ER500"), ("message", "Vision error"), ("description", str(vision_analysis))])
+                continue
+            gemini_futures[i] = gemini_pool.submit(diagnose, i, vision_analysis)
+        for i, future in gemini_futures.items():
+            try:
+                diagnosis_result = future.result()
+                remember_diagnosis(lookups[i], diagnosis_result)
+                results[i]['diagnosis_result'] = diagnosis_result
+            except Exception as e:
+                results[i]['error'] = OrderedDict([("code", "ER500"), ("message", "Diagnosis error"), ("description", str(e))])
+    timings['gemini'] = round((time.perf_counter() - stage_start) * 1000, 1)
+    for i, first in duplicates.items():
+        for field in ('diagnosis_result', 'error'):
+            if field in results[first]:
+                results[i][field] = results[first][field]
+
+    for i, future in upload_futures.items():
+        try:
+            results[i]['image_url'] = future.result()
+        except Exception as e:
+            print(f"[DIAGNOSE_BATCH] Upload failed for image {images[i]['id']}: {e}")
+            results[i]['image_url'] = None
+    for item in results:
+        if 'diagnosis_result' in item:
+            item['diagnosis_result'] = to_ordered(item['diagnosis_result'], DIAGNOSIS_SCHEMA_ORDER)
+    timings['total'] = round((time.perf_counter() - start) * 1000, 1)
+    print(f"[DIAGNOSE_BATCH] {len(images)} images for {user_id}: {len(pending)} sent to Vision/Gemini, timings (ms) {dict(timings)}")
+    return OrderedDict([
+        ("user_id", user_id),
+        ("location", batch_data['location']),
+        ("language", language),
+        ("summary", summarize_batch_results(results)),
+        ("results", results),
+        ("nearby_dealer", get_nearby_dealers(batch_data['location'])),
+        ("timings_ms", timings)
+    ])
+
+def handle_diagnose_batch(req):
+    request_id = get_request_id(req)
+    auth_token = get_auth_token(req)
+    is_local = is_local_environment()
+    is_valid, error_msg = validate_auth_token(auth_token)
+    if not is_valid:
+        return create_error_response(request_id, "ER100", error_msg, "Auth token required in header.", 401)
+    try:
+        is_valid, code, message, description, status_code, batch_data = extract_batch_request_data(req, is_local)
+        if not is_valid:
+            return create_error_response(request_id, code, message, description, status_code)
+        ordered_result = process_diagnosis_batch(batch_data, mock_mode=use_mock_response(req))
+        if not is_local:
+            # One batched commit for the whole survey instead of a write per image
+            records = [
+                (
+                    batch_data['user_id'],
+                    {'crop': item['crop'], 'location': batch_data['location'], 'batch_request_id': request_id},
+                    OrderedDict([
+                        ("user_id", batch_data['user_id']),
+                        ("crop", item['crop']),
+                        ("diagnosis_result", item['diagnosis_result']),
+                        ("image_url", item.get('image_url')),
+                        ("language", batch_data['language'])
+                    ]),
+                    item.get('image_url')
+                )
+                for item in ordered_result['results'] if 'diagnosis_result' in item
+            ]
+            doc_ids = save_batch_to_firestore(records)
+            diagnosed = [item for item in ordered_result['results'] if 'diagnosis_result' in item]
+            for item, doc_id in zip(diagnosed, doc_ids):
+                item['diagnosis_id'] = doc_id
+        return create_success_response(request_id, ordered_result)
+    except Exception as e:
+        return create_error_response(request_id, "ER500", "Internal server error", str(e), 500)
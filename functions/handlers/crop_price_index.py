@@ -0,0 +1,237 @@
+import os
+import threading
+
+# Denormalized crop slug -> mandi price entries, so "where can I sell crop X near me"
+# never walks every mandi's crops array. Entries carry just enough mandi metadata to
+# answer the crop price endpoint; the persisted copy also drops price_history.
+CROP_PRICE_COLLECTION = os.getenv('CROP_PRICE_COLLECTION', 'crop_prices')
+# One entry document per mandi under crop_prices/{slug}/mandis/{mandi_id}: a single map per
+# crop would pass Firestore's 1 MB document limit for widely traded crops
+CROP_PRICE_ENTRIES = 'mandis'
+# Nearest mandis considered before re-ranking by price when no radius is given
+CROP_PRICE_CANDIDATES = int(os.getenv('CROP_PRICE_CANDIDATES', '20'))
+MANDI_ENTRY_FIELDS = ('mandi_id', 'mandi_name', 'address', 'open_time', 'mobile', 'city', 'state', 'lat', 'lng')
+FIRESTORE_BATCH_LIMIT = 500
+
+def crop_price_entries(mandi_id, mandi, include_history=True):
+    """Map crop slug -> {mandi fields..., 'crop': crop} for one mandi document"""
+    if not mandi or mandi.get('lat') is None or mandi.get('lng') is None:
+        return {}
+    base = {field: mandi[field] for field in MANDI_ENTRY_FIELDS if field in mandi}
+    base['mandi_id'] = mandi.get('mandi_id', mandi_id)
+    base['lat'] = float(mandi['lat'])
+    base['lng'] = float(mandi['lng'])
+    entries = {}
+    for crop in mandi.get('crops', []):
+        slug = crop.get('slug')
+        if not slug:
+            continue
+        if not include_history:
+            crop = {key: value for key, value in crop.items() if key != 'price_history'}
+        entries[slug] = {**base, 'crop': crop}
+    return entries
+
+class CropPriceIndex:
+    """
+    In-memory crop slug -> {mandi_id: entry} index with a per-crop HaversineEngine,
+    so nearest/cheapest queries only touch mandis that actually list the crop.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._by_crop = {}   # slug -> {mandi_id: entry}
+        self._by_mandi = {}  # mandi_id -> set of slugs
+        self._engines = {}   # slug -> HaversineEngine, dropped when that crop changes
+
+    def __len__(self):
+        return len(self._by_crop)
+
+    def crops(self):
+        return list(self._by_crop)
+
+    def entries(self, slug):
+        return dict(self._by_crop.get(slug, {}))
+
+    def upsert_mandi(self, mandi_id, mandi):
+        self.set_mandi_entries(mandi_id, crop_price_entries(mandi_id, mandi))
+
+    def set_mandi_entries(self, mandi_id, entries):
+        with self._lock:
+            for slug in self._by_mandi.get(mandi_id, set()) - set(entries):
+                self._drop(slug, mandi_id)
+            for slug, entry in entries.items():
+                self._by_crop.setdefault(slug, {})[mandi_id] = entry
+                self._engines.pop(slug, None)
+            if entries:
+                self._by_mandi[mandi_id] = set(entries)
+            else:
+                self._by_mandi.pop(mandi_id, None)
+
+    def remove_mandi(self, mandi_id):
+        self.set_mandi_entries(mandi_id, {})
+
+    def load_crop(self, slug, mandis):
+        """Replace every entry for one crop, e.g. from its persisted crop_prices entries"""
+        with self._lock:
+            for mandi_id in list(self._by_crop.get(slug, {})):
+                if mandi_id not in mandis:
+                    self._drop(slug, mandi_id)
+            for mandi_id, entry in mandis.items():
+                if entry.get('lat') is None or entry.get('lng') is None:
+                    continue
+                self._by_crop.setdefault(slug, {})[mandi_id] = entry
+                self._by_mandi.setdefault(mandi_id, set()).add(slug)
+            self._engines.pop(slug, None)
+
+    def _drop(self, slug, mandi_id):
+        mandis = self._by_crop.get(slug)
+        if mandis is not None:
+            mandis.pop(mandi_id, None)
+            if not mandis:
+                del self._by_crop[slug]
+        slugs = self._by_mandi.get(mandi_id)
+        if slugs is not None:
+            slugs.discard(slug)
+        self._engines.pop(slug, None)
+
+    def _engine(self, slug):
+        """(HaversineEngine, {mandi_id: entry}) snapshot for one crop"""
+        with self._lock:
+            cached = self._engines.get(slug)
+            if cached is None:
+                from utils.haversine_engine import HaversineEngine
+                mandis = dict(self._by_crop.get(slug, {}))
+                keys = list(mandis)
+                engine = HaversineEngine(keys, [mandis[k]['lat'] for k in keys], [mandis[k]['lng'] for k in keys])
+                cached = self._engines[slug] = (engine, mandis)
+            return cached
+
+    def nearest(self, slug, lat, lng, k=3, radius_km=None):
+        """Return [(entry, distance_km)] for mandis listing the crop, nearest first"""
+        if slug not in self._by_crop:
+            return []
+        engine, mandis = self._engine(slug)
+        if radius_km is not None:
+            hits = engine.within(lat, lng, radius_km, limit=k)
+        else:
+            hits = engine.nearest(lat, lng, k)
+        return [(mandis[mandi_id], dist) for mandi_id, dist in hits]
+
+    def cheapest(self, slug, lat, lng, k=3, radius_km=None, candidates=CROP_PRICE_CANDIDATES, price_field='modal_price'):
+        """
+        Return [(entry, distance_km)] ranked by price (then distance) among mandis within
+        radius_km, or among the `candidates` nearest when no radius is given
+        """
+        if radius_km is not None:
+            pool = self.nearest(slug, lat, lng, k=None, radius_km=radius_km)
+        else:
+            pool = self.nearest(slug, lat, lng, k=max(k, candidates))
+        priced = [item for item in pool if item[0]['crop'].get(price_field) is not None]
+        priced.sort(key=lambda item: (item[0]['crop'][price_field], item[1]))
+        return priced[:k]
+
+def _crop_doc(db, slug):
+    return db.collection(CROP_PRICE_COLLECTION).document(slug)
+
+def _entry_doc(db, slug, mandi_id):
+    return _crop_doc(db, slug).collection(CROP_PRICE_ENTRIES).document(mandi_id)
+
+def _commit_writes(db, writes):
+    """Apply (doc_ref, data) pairs in batches; data None deletes the document"""
+    for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for doc_ref, data in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+            if data is None:
+                batch.delete(doc_ref)
+            else:
+                batch.set(doc_ref, data)
+        batch.commit()
+
+def _touch_crops(slugs):
+    """Parent crop_prices/{slug} writes: the crop list, and what the snapshot listener watches"""
+    from firebase_admin import firestore
+    return [(slug, {'slug': slug, 'updated_at': firestore.SERVER_TIMESTAMP}) for slug in slugs]
+
+def load_crop_entries(db, slug):
+    """{mandi_id: entry} stored under crop_prices/{slug}/mandis"""
+    return {doc.id: doc.to_dict() or {} for doc in _crop_doc(db, slug).collection(CROP_PRICE_ENTRIES).stream()}
+
+def load_crop_price_collection(index, db=None):
+    """Fill an index from the persisted crop_prices collection, without reading mandi documents"""
+    if db is None:
+        from utils.services import get_firestore
+        db = get_firestore()
+    for doc in db.collection(CROP_PRICE_COLLECTION).select([]).stream():
+        index.load_crop(doc.id, load_crop_entries(db, doc.id))
+
+def previous_crop_slugs(db, mandi_ids, collection_name='mandis'):
+    """{mandi_id: set of crop slugs} the stored mandi documents list, read before they are overwritten"""
+    collection = db.collection(collection_name)
+    refs = [collection.document(str(mandi_id)) for mandi_id in mandi_ids]
+    slugs = {}
+    for start in range(0, len(refs), FIRESTORE_BATCH_LIMIT):
+        for doc in db.get_all(refs[start:start + FIRESTORE_BATCH_LIMIT], field_paths=['crops']):
+            if doc.exists:
+                slugs[doc.id] = {crop.get('slug') for crop in (doc.to_dict() or {}).get('crops', []) if crop.get('slug')}
+    return slugs
+
+def persist_mandi_crop_prices(db, mandi_id, mandi, previous=None):
+    """
+    Upsert one mandi's entries into crop_prices/{slug}/mandis/{mandi_id} and delete its
+    entries for crops the previous version of the document listed but this one does not
+    """
+    mandi_id = str(mandi_id)
+    entries = crop_price_entries(mandi_id, mandi, include_history=False)
+    stale = set(crop_price_entries(mandi_id, previous)) - set(entries) if previous else set()
+    _persist_entries(db, {mandi_id: entries}, {mandi_id: stale})
+    return len(entries), len(stale)
+
+def persist_crop_prices_bulk(db, mandis, previous=None):
+    """
+    Apply many changed (mandi_id, mandi) pairs. `previous` maps mandi_id -> crop slugs the
+    stored version listed (see previous_crop_slugs) so dropped crops lose their entry; only
+    the affected entry documents are touched, never the whole collection.
+    """
+    changed = {str(mandi_id): crop_price_entries(str(mandi_id), mandi, include_history=False) for mandi_id, mandi in mandis}
+    if not changed:
+        return 0
+    previous = previous or {}
+    stale = {mandi_id: set(previous.get(mandi_id, ())) - set(entries) for mandi_id, entries in changed.items()}
+    return _persist_entries(db, changed, stale)
+
+def _persist_entries(db, changed, stale):
+    """Write {mandi_id: {slug: entry}}, delete {mandi_id: stale slugs}; returns the crops touched"""
+    writes = []
+    slugs = set()
+    for mandi_id, entries in changed.items():
+        for slug, entry in entries.items():
+            writes.append((_entry_doc(db, slug, mandi_id), entry))
+            slugs.add(slug)
+    for mandi_id, dropped in stale.items():
+        for slug in dropped:
+            writes.append((_entry_doc(db, slug, mandi_id), None))
+            slugs.add(slug)
+    # Parents last, so a listener reloading a crop sees its new entries
+    writes += [(_crop_doc(db, slug), data) for slug, data in _touch_crops(sorted(slugs))]
+    _commit_writes(db, writes)
+    return len(slugs)
+
+def rebuild_crop_price_collection(db, mandis):
+    """Rewrite crop_prices from scratch for an iterable of (mandi_id, mandi) pairs"""
+    by_crop = {}
+    for mandi_id, mandi in mandis:
+        for slug, entry in crop_price_entries(str(mandi_id), mandi, include_history=False).items():
+            by_crop.setdefault(slug, {})[str(mandi_id)] = entry
+    writes = []
+    for doc in db.collection(CROP_PRICE_COLLECTION).select([]).stream():
+        keep = by_crop.get(doc.id, {})
+        for entry in doc.reference.collection(CROP_PRICE_ENTRIES).select([]).stream():
+            if entry.id not in keep:
+                writes.append((entry.reference, None))
+        if doc.id not in by_crop:
+            writes.append((doc.reference, None))
+    for slug, entries in by_crop.items():
+        writes += [(_entry_doc(db, slug, mandi_id), entry) for mandi_id, entry in entries.items()]
+    writes += [(_crop_doc(db, slug), data) for slug, data in _touch_crops(by_crop)]
+    _commit_writes(db, writes)
+    return len(by_crop)
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from utils.cache_utils import LRUCache
+from utils.metrics_utils import register_metrics
+from utils.settings import get_settings
+
+# In-process tier and the optional shared tier ('none', 'firestore' or 'disk'), plus the
+# near-duplicate index: same user + crop + language, perceptual hash within a max distance,
+# inside a window. Configured by Settings.diagnosis_cache_* and near_duplicate_*.
+NEAR_DUPLICATE_REBUILD_EVERY = 64
+
+def diagnosis_cache_key(image_bytes, crop_type, language):
+    """Content-addressed key: sha256 of the image plus normalized crop and language"""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    crop = (crop_type or '').strip().lower()
+    return hashlib.sha256(f"{digest}|{crop}|{language}".encode('utf-8')).hexdigest()
+
+class DiskDiagnosisStore:
+    """Shared tier on local disk, one JSON file per key; oldest files pruned past max_entries"""
+
+    def __init__(self, directory=None, max_entries=None):
+        settings = get_settings()
+        directory = settings.diagnosis_cache_dir if directory is None else directory
+        self.directory = directory
+        self.max_entries = settings.diagnosis_cache_disk_max_entries if max_entries is None else max_entries
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key, ttl):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if ttl and time.time() - entry.get('stored_at', 0) > ttl:
+            return None
+        return entry.get('result')
+
+    def set(self, key, result):
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'stored_at': time.time(), 'result': result}, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def _prune(self):
+        entries = [e for e in os.scandir(self.directory) if e.name.endswith('.json')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+class FirestoreDiagnosisStore:
+    """Shared tier in a Firestore collection; expires_at can back a Firestore TTL policy"""
+
+    def __init__(self, collection=None, ttl=None):
+        settings = get_settings()
+        self.collection = settings.diagnosis_cache_collection if collection is None else collection
+        self.ttl = settings.diagnosis_cache_ttl if ttl is None else ttl
+
+    def get(self, key, ttl):
+        from utils.services import get_firestore
+        doc = get_firestore().collection(self.collection).document(key).get()
+        if not doc.exists:
+            return None
+        entry = doc.to_dict()
+        if ttl and time.time() - entry.get('stored_at', 0) > ttl:
+            return None
+        return entry.get('result')
+
+    def set(self, key, result):
+        from datetime import datetime, timezone, timedelta
+        from utils.services import get_firestore
+        get_firestore().collection(self.collection).document(key).set({
+            'stored_at': time.time(),
+            'expires_at': datetime.now(timezone.utc) + timedelta(seconds=self.ttl),
+            'result': result
+        })
+
+class DiagnosisCache:
+    """Two-tier diagnosis cache: bounded in-process LRU in front of an optional shared store"""
+
+    def __init__(self, max_size=None, ttl=None, shared=None):
+        settings = get_settings()
+        self.ttl = ttl = settings.diagnosis_cache_ttl if ttl is None else ttl
+        self.local = LRUCache(max_size=settings.diagnosis_cache_size if max_size is None else max_size, ttl=ttl)
+        self.shared = shared
+        self.shared_hits = 0
+        self.shared_errors = 0
+
+    def get(self, key):
+        result = self.local.get(key)
+        if result is not None or self.shared is None:
+            return result
+        try:
+            result = self.shared.get(key, self.ttl)
+        except Exception as e:
+            self.shared_errors += 1
+            print(f"[DIAGNOSIS_CACHE] Shared tier read failed: {e}")
+            return None
+        if result is not None:
+            self.shared_hits += 1
+            self.local.set(key, result)
+        return result
+
+    def set(self, key, result):
+        self.local.set(key, result)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, result)
+            except Exception as e:
+                self.shared_errors += 1
+                print(f"[DIAGNOSIS_CACHE] Shared tier write failed: {e}")
+
+    def stats(self):
+        stats = self.local.stats()
+        stats["ttl"] = self.ttl
+        stats["shared"] = type(self.shared).__name__ if self.shared else None
+        stats["shared_hits"] = self.shared_hits
+        stats["shared_errors"] = self.shared_errors
+        return stats
+
+class NearDuplicateIndex:
+    """
+    Perceptual-hash index of recent diagnoses, one BK-tree per (user, crop, language) group.
+    Groups are LRU-bounded; entries older than the window are ignored and dropped on rebuild.
+    """
+
+    def __init__(self, max_distance=None, window=None, max_groups=None, hash_name=None):
+        settings = get_settings()
+        self.max_distance = settings.near_duplicate_max_distance if max_distance is None else max_distance
+        self.window = settings.near_duplicate_window if window is None else window
+        self.hash_name = settings.near_duplicate_hash if hash_name is None else hash_name
+        self.groups = LRUCache(max_size=settings.near_duplicate_max_groups if max_groups is None else max_groups, ttl=self.window)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def image_hash(self, image):
+        from utils.image_hash import phash, dhash
+        return dhash(image) if self.hash_name == 'dhash' else phash(image)
+
+    @staticmethod
+    def group_key(user_id, crop_type, language):
+        return (str(user_id), (crop_type or '').strip().lower(), language)
+
+    def find(self, group_key, image_hash):
+        """Closest earlier result within max_distance and the time window, or None"""
+        cutoff = time.time() - self.window
+        with self._lock:
+            tree = self.groups.get(group_key, count=False)
+            matches = tree.search(image_hash, self.max_distance) if tree else []
+        for distance, (stored_at, result) in matches:
+            if stored_at >= cutoff:
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def add(self, group_key, image_hash, result):
+        from utils.image_hash import BKTree
+        now = time.time()
+        with self._lock:
+            tree = self.groups.get(group_key, count=False)
+            if tree is None:
+                tree = BKTree()
+            elif tree.size % NEAR_DUPLICATE_REBUILD_EVERY == 0:
+                # BK-trees cannot delete; periodically rebuild without the expired entries
+                tree = self._rebuild(tree, now - self.window)
+            tree.add(image_hash, (now, result))
+            self.groups.set(group_key, tree)
+
+    @staticmethod
+    def _rebuild(tree, cutoff):
+        from utils.image_hash import BKTree
+        fresh = BKTree()
+        for item_hash, (stored_at, result) in tree.items():
+            if stored_at >= cutoff:
+                fresh.add(item_hash, (stored_at, result))
+        return fresh
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "groups": len(self.groups),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "max_distance": self.max_distance,
+            "window": self.window
+        }
+
+_diagnosis_cache = None
+_near_duplicate_index = None
+_diagnosis_cache_lock = threading.Lock()
+
+def get_diagnosis_cache():
+    """Per-instance DiagnosisCache configured from env, or None when disabled"""
+    global _diagnosis_cache
+    if not get_settings().diagnosis_cache_enabled:
+        return None
+    with _diagnosis_cache_lock:
+        if _diagnosis_cache is None:
+            shared = None
+            tier = get_settings().diagnosis_cache_shared
+            if tier == 'firestore':
+                shared = FirestoreDiagnosisStore()
+            elif tier == 'disk':
+                shared = DiskDiagnosisStore()
+            _diagnosis_cache = DiagnosisCache(shared=shared)
+            register_metrics('diagnosis_cache', _diagnosis_cache.stats)
+        return _diagnosis_cache
+
+def get_near_duplicate_index():
+    """Per-instance NearDuplicateIndex configured from env, or None when disabled"""
+    global _near_duplicate_index
+    if not get_settings().near_duplicate_enabled:
+        return None
+    with _diagnosis_cache_lock:
+        if _near_duplicate_index is None:
+            _near_duplicate_index = NearDuplicateIndex()
+            register_metrics('near_duplicate_index', _near_duplicate_index.stats)
+        return _near_duplicate_index
@@ -0,0 +1,152 @@
+import json
+import base64
+from datetime import datetime, timezone
+import threading
+from utils.cache_utils import LRUCache
+from utils.metrics_utils import register_metrics
+from utils.settings import get_settings
+
+# Keyset pagination over (timestamp DESC, doc ID DESC). Needs the composite index
+# diagnoses: user_id ASC, timestamp DESC, __name__ DESC. Cursors carry only the doc ID;
+# the query resumes from that document's stored timestamp, never from an instance clock.
+HISTORY_VIEWS = ('full', 'summary')
+HISTORY_SUMMARY_FIELDS = [
+    'user_id',
+    'timestamp',
+    'image_url',
+    'request',
+    'response.crop',
+    'response.language',
+    'response.diagnosis_result.disease_name',
+    'response.diagnosis_result.severity',
+    'response.diagnosis_result.stage',
+    'response.diagnosis_result.confidence_score'
+]
+# Per-user cache of the most recent entries, kept current only as *this* instance saves
+# diagnoses. Deployed, diagnose and history run as separate functions, so a cached first page
+# would miss new entries for up to the TTL; only enable it where both share a process.
+_recent_history = None
+_recent_history_lock = threading.Lock()
+
+def get_recent_history():
+    """Per-instance (user_id, view) -> recent entries cache, or None when HISTORY_CACHE_ENABLED=false"""
+    global _recent_history
+    settings = get_settings()
+    if not settings.history_cache_enabled:
+        return None
+    with _recent_history_lock:
+        if _recent_history is None:
+            _recent_history = LRUCache(max_size=settings.history_cache_users, ttl=settings.history_cache_ttl)
+            register_metrics('diagnosis_history_cache', _recent_history.stats)
+        return _recent_history
+
+def encode_history_cursor(doc_id):
+    """Opaque cursor for the entry a page ended on"""
+    payload = json.dumps({'id': doc_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_history_cursor(cursor):
+    """Return the doc ID a page ended on; raises ValueError for malformed cursors"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return str(payload['id'])
+    except Exception as e:
+        raise ValueError(f"Invalid start_after cursor: {e}")
+
+def _get_path(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict) or part not in data:
+            return None, False
+        data = data[part]
+    return data, True
+
+def project_fields(data, fields):
+    """In-memory equivalent of a Firestore select() projection"""
+    projected = {}
+    for path in fields:
+        value, found = _get_path(data, path)
+        if not found:
+            continue
+        target = projected
+        parts = path.split('.')
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return projected
+
+def _query_history(user_id, limit, view, start_after=None, offset=0):
+    from firebase_admin import firestore
+    from utils.services import get_firestore
+    db = get_firestore()
+    query = (db.collection('diagnoses')
+             .where('user_id', '==', user_id)
+             .order_by('timestamp', direction=firestore.Query.DESCENDING)
+             .order_by('__name__', direction=firestore.Query.DESCENDING))
+    if view == 'summary':
+        query = query.select(HISTORY_SUMMARY_FIELDS)
+    if start_after:
+        # Resuming from the snapshot uses its stored timestamp (full precision) and ID
+        snapshot = db.collection('diagnoses').document(start_after).get()
+        if not snapshot.exists or (snapshot.to_dict() or {}).get('user_id') != user_id:
+            raise ValueError("Invalid start_after cursor: entry not found")
+        query = query.start_after(snapshot)
+    elif offset:
+        # Legacy offset paging: Firestore still reads and bills every skipped document
+        query = query.offset(offset)
+    return [(doc.id, doc.to_dict()) for doc in query.limit(limit).stream()]
+
+def fetch_history_page(user_id, limit=10, view='full', cursor=None, offset=0):
+    """Return ([(doc_id, data)], has_more) for one page of a user's history, newest first"""
+    start_after = decode_history_cursor(cursor) if cursor else None
+    recent = get_recent_history()
+    depth = get_settings().history_cache_depth
+    if recent is not None and not offset and limit <= depth:
+        cached = recent.get((user_id, view))
+        if cached is not None:
+            items = cached['items']
+            start = 0
+            if start_after:
+                ids = [doc_id for doc_id, _ in items]
+                start = ids.index(start_after) + 1 if start_after in ids else None
+            if start is not None:
+                page = items[start:start + limit]
+                if start + limit < len(items):
+                    return page, True
+                if cached['complete']:
+                    return page, False
+        if not start_after:
+            # First page miss: fetch a full cache window, one extra to know whether it is complete
+            items = _query_history(user_id, depth + 1, view)
+            complete = len(items) <= depth
+            items = items[:depth]
+            recent.set((user_id, view), {'items': items, 'complete': complete})
+            return items[:limit], len(items) > limit or not complete
+    items = _query_history(user_id, limit + 1, view, start_after, offset)
+    return items[:limit], len(items) > limit
+
+def record_recent_diagnosis(user_id, doc_id, doc_data):
+    """Prepend a newly saved diagnosis to this user's cached history, if cached"""
+    recent = get_recent_history()
+    if recent is None:
+        return
+    depth = get_settings().history_cache_depth
+    # SERVER_TIMESTAMP only resolves on commit; the local time is for display only, since
+    # cursors resume from the stored document
+    data = dict(doc_data, timestamp=datetime.now(timezone.utc))
+    for view in HISTORY_VIEWS:
+        cached = recent.get((user_id, view), count=False)
+        if cached is None:
+            continue
+        entry = (doc_id, data if view == 'full' else project_fields(data, HISTORY_SUMMARY_FIELDS))
+        items = [entry] + cached['items']
+        complete = cached['complete'] and len(items) <= depth
+        recent.set((user_id, view), {'items': items[:depth], 'complete': complete})
+
+def serialize_history_entry(doc_id, data):
+    entry = dict(data)
+    entry['diagnosis_id'] = doc_id
+    # Convert Firestore timestamp to ISO string if present
+    if 'timestamp' in entry and hasattr(entry['timestamp'], 'isoformat'):
+        entry['timestamp'] = entry['timestamp'].isoformat()
+    return entry
@@ -0,0 +1,52 @@
+import os
+import threading
+from utils.cache_utils import LRUCache
+from utils.label_matcher import LabelClassifier, DEFAULT_LABEL_SETS
+from utils.metrics_utils import register_metrics
+
+# Keyword sets can be overridden per farm or region with a document in this collection,
+# e.g. label_keywords/FARM123 or label_keywords/karnataka: {"sets": {"animals": {...}}}.
+# Sets in the document replace the built-in set of the same name. Documents are re-read
+# after LABEL_KEYWORDS_TTL seconds, so edits apply without a redeploy.
+LABEL_KEYWORDS_COLLECTION = os.getenv('LABEL_KEYWORDS_COLLECTION', 'label_keywords')
+LABEL_KEYWORDS_TTL = int(os.getenv('LABEL_KEYWORDS_TTL', '300'))
+LABEL_KEYWORDS_CACHE_SIZE = int(os.getenv('LABEL_KEYWORDS_CACHE_SIZE', '512'))
+
+_default_classifier = LabelClassifier(DEFAULT_LABEL_SETS)
+_NO_OVERRIDE = object()
+_classifiers = LRUCache(LABEL_KEYWORDS_CACHE_SIZE, ttl=LABEL_KEYWORDS_TTL)
+_classifiers_lock = threading.Lock()
+register_metrics('label_keywords', _classifiers.stats)
+
+def _load_profile(profile):
+    """Compiled classifier for one override document, or _NO_OVERRIDE if there is none"""
+    try:
+        from utils.services import get_firestore
+        doc = get_firestore().collection(LABEL_KEYWORDS_COLLECTION).document(str(profile)).get()
+    except Exception as e:
+        print(f"[LABEL_KEYWORDS] Could not load keyword profile {profile}: {e}")
+        return _NO_OVERRIDE
+    sets = (doc.to_dict() or {}).get('sets') if doc.exists else None
+    if not sets:
+        return _NO_OVERRIDE
+    try:
+        return LabelClassifier({**DEFAULT_LABEL_SETS, **sets})
+    except Exception as e:
+        print(f"[LABEL_KEYWORDS] Ignoring invalid keyword profile {profile}: {e}")
+        return _NO_OVERRIDE
+
+def get_label_classifier(*profiles):
+    """Classifier of the first profile (farm id, region, ...) with an override, else the built-in one"""
+    for profile in profiles:
+        if not profile:
+            continue
+        classifier = _classifiers.get(profile)
+        if classifier is None:
+            with _classifiers_lock:
+                classifier = _classifiers.get(profile, count=False)
+                if classifier is None:
+                    classifier = _load_profile(profile)
+                    _classifiers.set(profile, classifier)
+        if classifier is not _NO_OVERRIDE:
+            return classifier
+    return _default_classifier
@@ -1,102 +1,297 @@
-import math
-from firebase_admin import firestore
+import os
+import time
+import threading
+import numpy as np
+from utils.services import get_firestore
+from utils.settings import get_settings
 from collections import OrderedDict
 from utils.response_utils import get_request_id, ordered_json_response
 from utils.request_utils import get_field
+from utils.geo_index import GeoIndex
+from utils.text_search import TrigramIndex
+from handlers.mandi_views import get_mandi_view_cache
+from handlers.price_series_store import get_price_series_store
+from utils.price_series import PriceSeries, RESAMPLE_UNITS, parse_day
+from handlers.crop_price_index import CropPriceIndex, load_crop_price_collection, load_crop_entries, CROP_PRICE_COLLECTION
 
 # Business logic functions only, no Flask route registration
 
-def haversine(lat1, lng1, lat2, lng2):
-    R = 6371
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lng2 - lng1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+# --- Per-instance mandi geo index ---
+# Loaded once from the first snapshot of the 'mandis' collection and kept current by the
+# same listener. If the listener cannot be attached the index is re-streamed after
+# Settings.mandi_index_ttl. Settings.mandi_nearest_backend picks the k-d tree walk ('kdtree')
+# or a vectorized scan ('numpy'); Settings.crop_price_index_source derives crop prices from
+# the mandi listener ('mandis') or reads the persisted crop_prices collection ('crop_prices'),
+# so crop price queries never load mandi documents.
+PRICE_FORECAST_HORIZON = int(os.getenv('PRICE_FORECAST_HORIZON', '7'))
+PRICE_MOVING_AVERAGE_WINDOW = int(os.getenv('PRICE_MOVING_AVERAGE_WINDOW', '7'))
+
+_mandi_index = None
+_mandi_index_loaded_at = 0
+_mandi_watch = None
+_mandi_index_lock = threading.Lock()
+# Derived from the same snapshots as the geo index
+_crop_price_index = CropPriceIndex()
+_persisted_crop_price_index = None
+_crop_price_watch = None
+_crop_price_index_lock = threading.Lock()
+# Name search over every indexed mandi, including ones without coordinates
+_mandi_search_index = TrigramIndex()
+_mandi_documents = {}
+# Document update times, the version localized views are checked against
+_mandi_versions = {}
+_mandi_views = get_mandi_view_cache()
+
+def _mandi_search_fields(data):
+    """(text, weight) pairs a farmer might type: names, places and their translations"""
+    fields = [(data.get('mandi_name'), 1.0)]
+    for key in ('translations', 'transliterations'):
+        names = data.get(key) or {}
+        fields.extend((name, 1.0) for name in (names.values() if isinstance(names, dict) else names))
+    fields.extend((data.get(key), 0.7) for key in ('city', 'district', 'state'))
+    for crop in data.get('crops', []):
+        fields.append((crop.get('name'), 0.5))
+        fields.extend((name, 0.5) for name in crop.get('translations', {}).values())
+    return [(text, weight) for text, weight in fields if text]
+
+def _index_mandi(index, doc_id, data, version=None):
+    _crop_price_index.upsert_mandi(doc_id, data)
+    _mandi_views.invalidate(doc_id)
+    if data:
+        _mandi_documents[doc_id] = data
+        _mandi_versions[doc_id] = version
+        _mandi_search_index.add(doc_id, _mandi_search_fields(data))
+    else:
+        _mandi_documents.pop(doc_id, None)
+        _mandi_versions.pop(doc_id, None)
+        _mandi_search_index.remove(doc_id)
+    if not data or data.get('lat') is None or data.get('lng') is None:
+        index.remove(doc_id)
+        return
+    index.upsert(doc_id, float(data['lat']), float(data['lng']), data)
+
+def _on_mandis_snapshot(index, ready):
+    def callback(col_snapshot, changes, read_time):
+        for change in changes:
+            if change.type.name == 'REMOVED':
+                _index_mandi(index, change.document.id, None)
+            else:
+                _index_mandi(index, change.document.id, change.document.to_dict(), change.document.update_time)
+        ready.set()
+    return callback
+
+def _stream_mandis_into(index):
+    """Load every mandi into index; mandis indexed earlier but no longer in the collection are dropped"""
+    db = get_firestore()
+    seen = set()
+    for doc in db.collection('mandis').stream():
+        seen.add(doc.id)
+        _index_mandi(index, doc.id, doc.to_dict(), doc.update_time)
+    # Deletions made while no listener was attached never reach us as changes
+    for doc_id in set(_mandi_documents) - seen:
+        _index_mandi(index, doc_id, None)
+    index.rebuild()
+
+def get_mandi_index():
+    global _mandi_index, _mandi_index_loaded_at, _mandi_watch
+    with _mandi_index_lock:
+        if _mandi_index is not None:
+            if _mandi_watch is None and time.time() - _mandi_index_loaded_at > get_settings().mandi_index_ttl:
+                # Rebuilt from the stream rather than merged into, so deleted mandis disappear
+                index = GeoIndex()
+                _stream_mandis_into(index)
+                _mandi_index = index
+                _mandi_index_loaded_at = time.time()
+            return _mandi_index
+        index = GeoIndex()
+        ready = threading.Event()
+        try:
+            _mandi_watch = get_firestore().collection('mandis').on_snapshot(_on_mandis_snapshot(index, ready))
+        except Exception as e:
+            print(f"[MANDI_INDEX] Snapshot listener unavailable, falling back to TTL refresh: {e}")
+            _mandi_watch = None
+        if _mandi_watch is None or not ready.wait(get_settings().mandi_index_load_timeout):
+            _stream_mandis_into(index)
+        else:
+            index.rebuild()
+        _mandi_index = index
+        _mandi_index_loaded_at = time.time()
+        return _mandi_index
+
+def _on_crop_prices_snapshot(index, ready):
+    # Watches the small crop_prices/{slug} documents; each write to a crop's entries touches
+    # its parent, and the changed crop is then reloaded from its mandis subcollection
+    def callback(col_snapshot, changes, read_time):
+        db = get_firestore()
+        for change in changes:
+            slug = change.document.id
+            try:
+                index.load_crop(slug, {} if change.type.name == 'REMOVED' else load_crop_entries(db, slug))
+            except Exception as e:
+                print(f"[CROP_PRICE_INDEX] Could not reload {slug}: {e}")
+        ready.set()
+    return callback
+
+def get_crop_price_index():
+    global _persisted_crop_price_index, _crop_price_watch
+    if get_settings().crop_price_index_source != 'crop_prices':
+        get_mandi_index()
+        return _crop_price_index
+    with _crop_price_index_lock:
+        if _persisted_crop_price_index is not None:
+            return _persisted_crop_price_index
+        index = CropPriceIndex()
+        ready = threading.Event()
+        try:
+            _crop_price_watch = get_firestore().collection(CROP_PRICE_COLLECTION).on_snapshot(_on_crop_prices_snapshot(index, ready))
+        except Exception as e:
+            print(f"[CROP_PRICE_INDEX] Snapshot listener unavailable, loading once: {e}")
+            _crop_price_watch = None
+        if _crop_price_watch is None or not ready.wait(get_settings().mandi_index_load_timeout):
+            load_crop_price_collection(index)
+        _persisted_crop_price_index = index
+        return _persisted_crop_price_index
+
+def _nearest_mandi_ids(lat, lng, limit=3, radius_km=None):
+    """[(mandi doc id, distance_km)] nearest first, optionally restricted to radius_km"""
+    index = get_mandi_index()
+    if radius_km is not None:
+        return index.within(lat, lng, radius_km, limit)
+    if get_settings().mandi_nearest_backend == 'numpy':
+        return index.engine().nearest(lat, lng, limit)
+    return index.nearest(lat, lng, limit)
 
 def find_nearby_mandis(lat, lng, limit=3):
-    db = firestore.client()
-    mandis = db.collection('mandis').stream()
-    mandi_list = []
-    for doc in mandis:
-        data = doc.to_dict()
-        dist = haversine(lat, lng, data['lat'], data['lng'])
-        mandi_list.append({**data, 'distance_km': dist})
-    mandi_list.sort(key=lambda x: x['distance_km'])
-    return mandi_list[:limit]
+    index = get_mandi_index()
+    return [{**index.get(mandi_id), 'distance_km': dist} for mandi_id, dist in _nearest_mandi_ids(lat, lng, limit)]
+
+def find_mandis_within(lat, lng, radius_km, limit=None):
+    index = get_mandi_index()
+    return [{**index.get(mandi_id), 'distance_km': dist} for mandi_id, dist in _nearest_mandi_ids(lat, lng, limit, radius_km)]
+
+def _crop_price_result(mandi, crop, distance_km, language):
+    crop_name = crop['name']
+    if language in crop.get('translations', {}):
+        crop_name = crop['translations'][language]
+    return {
+        'mandi_id': mandi['mandi_id'],
+        'mandi_name': mandi['mandi_name'],
+        'distance_km': distance_km,
+        'address': mandi.get('address', ''),
+        'open_time': mandi.get('open_time', ''),
+        'mobile': mandi.get('mobile', ''),
+        'crop': crop_name,
+        **crop
+    }
 
 def find_crop_in_mandis(mandis, crop_slug, language='en'):
     results = []
     for mandi in mandis:
         for crop in mandi.get('crops', []):
             if crop['slug'] == crop_slug:
-                crop_name = crop['name']
-                if language in crop.get('translations', {}):
-                    crop_name = crop['translations'][language]
-                results.append({
-                    'mandi_id': mandi['mandi_id'],
-                    'mandi_name': mandi['mandi_name'],
-                    'distance_km': mandi['distance_km'],
-                    'address': mandi.get('address', ''),
-                    'open_time': mandi.get('open_time', ''),
-                    'mobile': mandi.get('mobile', ''),
-                    'crop': crop_name,
-                    **crop
-                })
+                results.append(_crop_price_result(mandi, crop, mandi['distance_km'], language))
     return results
 
-def get_crop_trend(mandi_id, crop_slug):
-    db = firestore.client()
-    doc = db.collection('mandis').document(str(mandi_id)).get()
-    if not doc.exists:
+def find_crop_prices(lat, lng, crop_slug, limit=3, radius_km=None, sort='distance', language='en'):
+    """Closest (or cheapest) mandis that list the crop, answered from the crop price index"""
+    index = get_crop_price_index()
+    if sort == 'price':
+        hits = index.cheapest(crop_slug, lat, lng, k=limit, radius_km=radius_km)
+    else:
+        hits = index.nearest(crop_slug, lat, lng, k=limit, radius_km=radius_km)
+    return [_crop_price_result(entry, entry['crop'], dist, language) for entry, dist in hits]
+
+def _round_or_none(value, digits=2):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+def get_crop_trend(mandi_id, crop_slug, start_date=None, end_date=None, resample='D', max_points=None, language='en'):
+    """
+    Price history and vectorized analytics for one (mandi, crop). History comes from the
+    price_series store, falling back to the mandi document's embedded price_history.
+    """
+    mandi = None
+    if _mandi_index is not None:
+        mandi = _mandi_index.get(str(mandi_id))
+    if mandi is None:
+        doc = get_firestore().collection('mandis').document(str(mandi_id)).get()
+        if not doc.exists:
+            return None
+        mandi = doc.to_dict()
+    crop = next((c for c in mandi.get('crops', []) if c['slug'] == crop_slug), None)
+    if crop is None:
         return None
-    mandi = doc.to_dict()
-    for crop in mandi.get('crops', []):
-        if crop['slug'] == crop_slug:
-            return {
-                'mandi_id': mandi_id,
-                'mandi_name': mandi['mandi_name'],
-                'crop': crop['name'],
-                'price_history': crop.get('price_history', []),
-                'trend': crop.get('trend', ''),
-                'predicted_price': crop.get('predicted_price', None)
-            }
-    return None
+    series = None
+    try:
+        series = get_price_series_store().get(mandi_id, crop_slug)
+    except Exception as e:
+        print(f"[PRICE_SERIES] Store read failed for {mandi_id}/{crop_slug}, using embedded history: {e}")
+    if not series:
+        series = PriceSeries.from_history(crop.get('price_history', []))
+    window = series.between(start_date, end_date)
+    points = window.resample(resample).downsample(max_points)
+    forecast = series.forecast(horizon_days=PRICE_FORECAST_HORIZON)
+    moving_average = points.moving_average(min(PRICE_MOVING_AVERAGE_WINDOW, max(len(points), 1)))
+    return {
+        'mandi_id': mandi_id,
+        'mandi_name': mandi['mandi_name'],
+        'crop': crop.get('translations', {}).get(language, crop['name']),
+        'price_history': points.to_history(),
+        'trend': series.trend() or crop.get('trend', ''),
+        'predicted_price': forecast['price'] if forecast else crop.get('predicted_price', None),
+        'analytics': {
+            'start_date': str(window.days[0]) if len(window) else None,
+            'end_date': str(window.days[-1]) if len(window) else None,
+            'points': len(window),
+            'resample': resample,
+            'change_pct': _round_or_none(window.change_pct()),
+            'volatility_pct': _round_or_none(window.volatility()),
+            'moving_average': [_round_or_none(v) for v in moving_average],
+            'forecast': forecast
+        }
+    }
 
 def get_mandi_details(mandi_id):
-    db = firestore.client()
+    db = get_firestore()
     doc = db.collection('mandis').document(str(mandi_id)).get()
     if not doc.exists:
         return None
     return doc.to_dict()
 
+def _mandi_view(mandi_id, language):
+    """Cached localized view of an indexed mandi, or None if it is not in the index"""
+    data = _mandi_documents.get(mandi_id)
+    if data is None:
+        return None
+    return _mandi_views.get(mandi_id, language, _mandi_versions.get(mandi_id), data)
+
+def get_mandi_view(mandi_id, language='en'):
+    """Read-only mandi document with crop names in `language`, or None if it does not exist"""
+    get_mandi_index()
+    mandi_id = str(mandi_id)
+    view = _mandi_view(mandi_id, language)
+    if view is None:
+        # Not delivered by the listener yet; read it directly
+        doc = get_firestore().collection('mandis').document(mandi_id).get()
+        if not doc.exists:
+            return None
+        view = _mandi_views.get(mandi_id, language, doc.update_time, doc.to_dict())
+    return view
+
 def search_mandis(pincode=None, name=None, limit=10, language='en'):
-    db = firestore.client()
-    query = db.collection('mandis')
     results = []
     # Search by pincode (exact match)
     if pincode:
-        query = query.where('pincode', '==', str(pincode))
-        docs = query.stream()
+        db = get_firestore()
+        docs = db.collection('mandis').where('pincode', '==', str(pincode)).stream()
         for doc in docs:
-            data = doc.to_dict()
-            for c in data.get('crops', []):
-                if language in c.get('translations', {}):
-                    c['name'] = c['translations'][language]
-            results.append(data)
-    # Search by name (case-insensitive, partial match)
+            results.append(_mandi_views.get(doc.id, language, doc.update_time, doc.to_dict()).document)
+    # Search by name: typo-tolerant, ranked, over names, places and their translations
     elif name:
-        docs = query.stream()
-        name_lower = name.lower()
-        for doc in docs:
-            data = doc.to_dict()
-            if name_lower in data.get('mandi_name', '').lower():
-                for c in data.get('crops', []):
-                    if language in c.get('translations', {}):
-                        c['name'] = c['translations'][language]
-                results.append(data)
-            if len(results) >= limit:
-                break
+        get_mandi_index()
+        for mandi_id, _ in _mandi_search_index.search(name, limit=limit):
+            view = _mandi_view(mandi_id, language)
+            if view is not None:
+                results.append(view.document)
     return results[:limit]
 
 # Handler functions for both Flask and Google Cloud Functions
@@ -109,22 +304,24 @@ def handle_mandi_nearby(req):
         lng = float(get_field('lng'))
         limit = int(get_field('limit') or 3)
         language = get_field('language') or 'en'
-        mandis = find_nearby_mandis(lat, lng, limit=limit)
+        radius_km = get_field('radius_km')
+        nearest = _nearest_mandi_ids(lat, lng, limit, float(radius_km) if radius_km else None)
+        views = [(_mandi_view(mandi_id, language), dist) for mandi_id, dist in nearest]
         result = [
             OrderedDict([
-                ('mandi_id', m['mandi_id']),
-                ('mandi_name', m['mandi_name']),
-                ('distance_km', m['distance_km']),
-                ('address', m.get('address', '')),
-                ('open_time', m.get('open_time', '')),
-                ('mobile', m.get('mobile', '')),
-                ('city', m.get('city', '')),
-                ('state', m.get('state', '')),
-                ('lat', m.get('lat')),
-                ('lng', m.get('lng')),
-                ('crops', [c['translations'].get(language, c['name']) if 'translations' in c else c['name'] for c in m.get('crops', [])])
+                ('mandi_id', view.document['mandi_id']),
+                ('mandi_name', view.document['mandi_name']),
+                ('distance_km', dist),
+                ('address', view.document.get('address', '')),
+                ('open_time', view.document.get('open_time', '')),
+                ('mobile', view.document.get('mobile', '')),
+                ('city', view.document.get('city', '')),
+                ('state', view.document.get('state', '')),
+                ('lat', view.document.get('lat')),
+                ('lng', view.document.get('lng')),
+                ('crops', view.crop_names)
             ])
-            for m in mandis
+            for view, dist in views if view is not None
         ]
         resp = OrderedDict([
             ("status", "success"),
@@ -157,8 +354,10 @@ def handle_mandi_crop_price(req):
         crop = get_field('crop')
         limit = int(get_field('limit') or 3)
         language = get_field('language') or 'en'
-        mandis = find_nearby_mandis(lat, lng, limit=limit)
-        results = find_crop_in_mandis(mandis, crop, language)
+        radius_km = get_field('radius_km')
+        # 'distance' (default) or 'price' for the cheapest mandis nearby
+        sort = get_field('sort') or 'distance'
+        results = find_crop_prices(lat, lng, crop, limit=limit, radius_km=float(radius_km) if radius_km else None, sort=sort, language=language)
         resp = OrderedDict([
             ("status", "success"),
             ("requestId", request_id),
@@ -188,7 +387,57 @@ def handle_mandi_crop_trend(req):
         mandi_id = get_field('mandi_id')
         crop = get_field('crop')
         language = get_field('language') or 'en'
-        trend = get_crop_trend(mandi_id, crop)
+        # Optional range (YYYY-MM-DD, inclusive) and downsampling of the returned history
+        start_date = get_field('start_date')
+        end_date = get_field('end_date')
+        resample = (get_field('resample') or 'D').upper()
+        max_points = get_field('max_points')
+        if resample not in RESAMPLE_UNITS:
+            err = OrderedDict([
+                ("status", "error"),
+                ("requestId", request_id),
+                ("error", OrderedDict([
+                    ("code", "ER400"),
+                    ("message", "Invalid resample"),
+                    ("description", f"resample must be one of: {', '.join(RESAMPLE_UNITS)}")
+                ]))
+            ])
+            return ordered_json_response(err, status=400)
+        try:
+            for value in (start_date, end_date):
+                if value:
+                    parse_day(value)
+        except ValueError as e:
+            err = OrderedDict([
+                ("status", "error"),
+                ("requestId", request_id),
+                ("error", OrderedDict([
+                    ("code", "ER400"),
+                    ("message", "Invalid date"),
+                    ("description", str(e))
+                ]))
+            ])
+            return ordered_json_response(err, status=400)
+        if max_points not in (None, ''):
+            try:
+                max_points = int(max_points)
+            except (TypeError, ValueError):
+                max_points = 0
+            if max_points < 1:
+                err = OrderedDict([
+                    ("status", "error"),
+                    ("requestId", request_id),
+                    ("error", OrderedDict([
+                        ("code", "ER400"),
+                        ("message", "Invalid max_points"),
+                        ("description", "max_points must be a positive integer")
+                    ]))
+                ])
+                return ordered_json_response(err, status=400)
+        else:
+            max_points = None
+        trend = get_crop_trend(mandi_id, crop, start_date=start_date, end_date=end_date,
+                               resample=resample, max_points=max_points, language=language)
         if not trend:
             err = OrderedDict([
                 ("status", "error"),
@@ -200,13 +449,6 @@ def handle_mandi_crop_trend(req):
                 ]))
             ])
             return ordered_json_response(err, status=404)
-        # Localize crop name
-        if 'crop' in trend and language != 'en':
-            mandi = get_mandi_details(mandi_id)
-            if mandi:
-                for c in mandi.get('crops', []):
-                    if c['slug'] == crop and language in c.get('translations', {}):
-                        trend['crop'] = c['translations'][language]
         resp = OrderedDict([
             ("status", "success"),
             ("requestId", request_id),
@@ -234,8 +476,8 @@ def handle_mandi_details(req):
     try:
         mandi_id = get_field('mandi_id')
         language = get_field('language') or 'en'
-        details = get_mandi_details(mandi_id)
-        if not details:
+        view = get_mandi_view(mandi_id, language)
+        if view is None:
             err = OrderedDict([
                 ("status", "error"),
                 ("requestId", request_id),
@@ -246,16 +488,12 @@ def handle_mandi_details(req):
                 ]))
             ])
             return ordered_json_response(err, status=404)
-        # Localize crop names
-        for c in details.get('crops', []):
-            if language in c.get('translations', {}):
-                c['name'] = c['translations'][language]
         resp = OrderedDict([
             ("status", "success"),
             ("requestId", request_id),
             ("data", OrderedDict([
                 ("user_id", user_id),
-                *details.items()
+                *view.document.items()
             ]))
         ])
         return ordered_json_response(resp)
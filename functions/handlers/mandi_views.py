@@ -0,0 +1,64 @@
+from utils.settings import get_settings
+from utils.cache_utils import LRUCache, freeze
+from utils.metrics_utils import register_metrics
+
+# Pre-rendered, read-only mandi documents per language, so handlers stop rewriting crop
+# names from translations on every request. Views carry the document's update time and
+# are rebuilt when the caller presents a newer one.
+MANDI_VIEW_LANGUAGES = ('en', 'hi', 'kn', 'hi-en')
+# Bookkeeping the uploader stores on each document, never returned by the API
+MANDI_INTERNAL_FIELDS = ('content_hash',)
+
+class MandiView:
+    __slots__ = ('version', 'document', 'crop_names')
+
+    def __init__(self, version, document, crop_names):
+        self.version = version
+        self.document = document
+        self.crop_names = crop_names
+
+def render_mandi_view(data, language, version=None):
+    """Immutable copy of a mandi document with crop names in `language`"""
+    crops = [
+        {**c, 'name': c['translations'][language]} if language in c.get('translations', {}) else c
+        for c in data.get('crops', [])
+    ]
+    document = freeze({**{k: v for k, v in data.items() if k not in MANDI_INTERNAL_FIELDS}, 'crops': crops})
+    return MandiView(version, document, tuple(c.get('name') for c in document['crops']))
+
+class MandiViewCache:
+    """LRU of MandiView keyed by (mandi_id, language), checked against the document version"""
+
+    def __init__(self, max_size=None):
+        self._views = LRUCache(max_size=get_settings().mandi_view_cache_size if max_size is None else max_size)
+        self.renders = 0
+        self.stale = 0
+
+    def get(self, mandi_id, language, version, data):
+        """View for this version of the document, rendering it from `data` if needed"""
+        # Unsupported languages fall back to English, so they cannot fill the cache with extra keys
+        if language not in MANDI_VIEW_LANGUAGES:
+            language = 'en'
+        key = (mandi_id, language)
+        view = self._views.get(key)
+        if view is not None and (version is None or view.version == version):
+            return view
+        if view is not None:
+            self.stale += 1
+        view = render_mandi_view(data, language, version)
+        self.renders += 1
+        self._views.set(key, view)
+        return view
+
+    def invalidate(self, mandi_id):
+        for language in MANDI_VIEW_LANGUAGES:
+            self._views.pop((mandi_id, language))
+
+    def stats(self):
+        return {**self._views.stats(), "renders": self.renders, "stale": self.stale}
+
+_mandi_views = MandiViewCache()
+register_metrics('mandi_views', _mandi_views.stats)
+
+def get_mandi_view_cache():
+    return _mandi_views
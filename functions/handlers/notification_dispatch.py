@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import queue
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from utils.cache_utils import LRUCache
+from utils.metrics_utils import register_metrics
+from utils.write_behind import retry_with_backoff
+from utils.settings import get_settings
+
+# Alert notifications are sent on the request path by default: deployed functions lose CPU
+# after the response, and neither their /tmp journal nor a retry timer outlives the instance.
+# NOTIFY_ASYNC_ENABLED=true (always-on hosts only) sends them from worker threads, with pending
+# jobs journaled to Settings.notify_queue_dir and failed jobs retried with backoff
+CHANNEL_PATHS = {'whatsapp': '/send-whatsapp-message', 'sms': '/send-sms'}
+NOTIFY_TRACKED_RECIPIENTS = 4096
+
+def notification_dedup_key(recipient, alert_key):
+    return hashlib.sha256(f"{recipient}|{alert_key}".encode('utf-8')).hexdigest()
+
+class SlidingWindowLimiter:
+    """Per-key sliding-window counter; least recently seen keys are forgotten past max_keys"""
+
+    def __init__(self, limit, window, max_keys=NOTIFY_TRACKED_RECIPIENTS):
+        self.limit = limit
+        self.window = window
+        self._events = LRUCache(max_keys)
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.time()
+        with self._lock:
+            events = self._events.get(key, count=False)
+            if events is None:
+                events = deque()
+                self._events.set(key, events)
+            while events and events[0] <= now - self.window:
+                events.popleft()
+            if len(events) >= self.limit:
+                return False
+            events.append(now)
+            return True
+
+class NotificationDispatcher:
+    """
+    Journaled queue of alert notifications drained by a few worker threads.
+    Each job is written to its own JSON file before it is queued and removed once it has
+    a final status, so jobs left behind by a crash are replayed on start. Channels for one
+    job are sent concurrently through the pooled HTTP client. With worker threads, a job on
+    which every channel failed stays journaled and is retried with exponential backoff;
+    inline, it ends as 'failed' after the HTTP client's own retries. Jobs are de-duplicated
+    per recipient + alert key once one of them reached the recipient (or while one is in
+    flight), rate limited per farmer, and the outcome is merged into the source record's
+    `notification` field.
+    Note: on Cloud Functions /tmp is per instance and in memory, so the journal covers
+    worker crashes and restarts of a live instance, not instance shutdown.
+    """
+
+    def __init__(self, directory=None, workers=None, max_size=None, channels=None, asynchronous=None):
+        settings = get_settings()
+        workers = settings.notify_workers if workers is None else workers
+        asynchronous = settings.notify_async_enabled if asynchronous is None else asynchronous
+        directory = settings.notify_queue_dir if directory is None else directory
+        max_size = settings.notify_queue_size if max_size is None else max_size
+        self.directory = directory
+        self.channels = list(channels or settings.notify_channels)
+        # With asynchronous=False jobs are still journaled but delivered on the caller's thread
+        self.workers = workers if asynchronous else 0
+        self._queue = queue.Queue(maxsize=max_size)
+        self._channel_pool = ThreadPoolExecutor(max_workers=max(1, workers * len(self.channels)), thread_name_prefix='notify-channel')
+        self._recent = LRUCache(NOTIFY_TRACKED_RECIPIENTS, ttl=settings.notify_dedup_window)
+        self._inflight = set()  # dedup keys of jobs being delivered or waiting for a retry
+        self._limiter = SlidingWindowLimiter(settings.notify_rate_limit, settings.notify_rate_window)
+        self._threads = []
+        self._lock = threading.Lock()
+        self.counts = OrderedDict((key, 0) for key in (
+            'enqueued', 'replayed', 'sent', 'partial', 'retrying', 'failed', 'duplicate', 'rate_limited', 'skipped', 'inline'))
+        os.makedirs(directory, exist_ok=True)
+        self._start()
+        self._replay()
+
+    def _start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._run, name=f'notify-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _journal(self, job):
+        tmp_path = f"{self._path(job['job_id'])}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(job['job_id']))
+
+    def _forget(self, job_id):
+        try:
+            os.remove(self._path(job_id))
+        except OSError:
+            pass
+
+    def _replay(self):
+        entries = sorted((e for e in os.scandir(self.directory) if e.name.endswith('.json')), key=lambda e: e.stat().st_mtime)
+        for entry in entries:
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[NOTIFY] Dropping unreadable journal entry {entry.name}: {e}")
+                self._forget(entry.name[:-len('.json')])
+                continue
+            self.counts['replayed'] += 1
+            # Replayed retries own their dedup key again until they reach a final status
+            if job.get('attempts'):
+                self._inflight.add(job['dedup_key'])
+            self._enqueue(job)
+
+    def enqueue(self, message, recipient, farmer_id=None, alert_key=None, record_id=None):
+        """
+        Journal and queue one alert; returns its job id. `alert_key` identifies the alert for
+        de-duplication (defaults to the message) and `record_id` is the animal_detections
+        document that receives the delivery status.
+        """
+        job = {
+            'job_id': hashlib.sha256(f"{record_id}|{recipient}|{message}|{time.time()}".encode('utf-8')).hexdigest()[:32],
+            'message': message,
+            'recipient': recipient,
+            'farmer_id': farmer_id,
+            'dedup_key': notification_dedup_key(recipient, alert_key or message),
+            'record_id': record_id,
+            'created_at': time.time(),
+            'attempts': 0
+        }
+        self._journal(job)
+        self.counts['enqueued'] += 1
+        self._enqueue(job)
+        return job['job_id']
+
+    def _enqueue(self, job):
+        if not self.workers:
+            self.counts['inline'] += 1
+            self._deliver(job)
+            return
+        self._start()
+        try:
+            self._queue.put(job, timeout=0.05)
+        except queue.Full:
+            # Deliver on the caller's thread rather than let the backlog grow unbounded
+            self.counts['inline'] += 1
+            self._deliver(job)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._deliver(job)
+            except Exception as e:
+                print(f"[NOTIFY] Worker error for job {job.get('job_id')}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _claim(self, job):
+        """Status that ends the job before sending, or None once it owns its dedup key"""
+        if not job.get('recipient'):
+            return 'skipped'
+        retry = job.get('attempts', 0) > 0
+        with self._lock:
+            if self._recent.get(job['dedup_key'], count=False) is not None:
+                return 'duplicate'
+            if not retry:
+                if job['dedup_key'] in self._inflight:
+                    return 'duplicate'
+                # A retry already used its rate-limit slot on the first attempt
+                if not self._limiter.allow(job.get('farmer_id') or job['recipient']):
+                    return 'rate_limited'
+                self._inflight.add(job['dedup_key'])
+        return None
+
+    def _deliver(self, job):
+        status = self._claim(job)
+        if status is not None:
+            outcome = self._outcome(status, {})
+        else:
+            futures = {channel: self._channel_pool.submit(self._send, channel, job) for channel in self.channels}
+            wait(futures.values())
+            results = {channel: future.result() for channel, future in futures.items()}
+            delivered = [r['status'] == 'sent' for r in results.values()]
+            status = 'sent' if all(delivered) else 'partial' if any(delivered) else 'failed'
+            job['attempts'] = job.get('attempts', 0) + 1
+            outcome = self._outcome(status, results)
+            # Timer retries need a live process; inline delivery records the failure instead
+            if status == 'failed' and self.workers and job['attempts'] < get_settings().notify_max_attempts:
+                self._schedule_retry(job, outcome)
+                return outcome
+            with self._lock:
+                self._inflight.discard(job['dedup_key'])
+                # Only an alert that reached the recipient suppresses later copies
+                if status != 'failed':
+                    self._recent.set(job['dedup_key'], job['job_id'])
+        self.counts[outcome['status']] += 1
+        self._record(job, outcome)
+        self._forget(job['job_id'])
+        return outcome
+
+    def _schedule_retry(self, job, outcome):
+        delay = get_settings().notify_retry_backoff * (2 ** (job['attempts'] - 1))
+        outcome['status'] = 'retrying'
+        outcome['attempts'] = job['attempts']
+        outcome['next_attempt_at'] = time.time() + delay
+        # The journal keeps the job (with its attempt count) until it has a final status
+        self._journal(job)
+        self.counts['retrying'] += 1
+        self._record(job, outcome)
+        timer = threading.Timer(delay, self._enqueue, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _outcome(self, status, channels):
+        return {'status': status, 'channels': channels, 'updated_at': time.time()}
+
+    def _send(self, channel, job):
+        from utils.http_client import get_http_client
+        settings = get_settings()
+        try:
+            resp = get_http_client().post(
+                settings.notify_api_url + CHANNEL_PATHS[channel],
+                upstream=f'notify-{channel}',
+                retries=settings.notify_max_retries,
+                json={"message": job['message'], "to": job['recipient']},
+                headers={"Content-Type": "application/json"}
+            )
+        except Exception as e:
+            print(f"[NOTIFY] {channel} send failed for job {job['job_id']}: {e}")
+            return {'status': 'failed', 'error': str(e)}
+        ok = 200 <= resp.status_code < 300
+        if not ok:
+            print(f"[NOTIFY] {channel} send failed for job {job['job_id']}: {resp.status_code}, {resp.text[:200]}")
+        return {'status': 'sent' if ok else 'failed', 'status_code': resp.status_code}
+
+    def _record(self, job, outcome):
+        if not job.get('record_id'):
+            return
+        try:
+            from utils.services import get_firestore
+            doc_ref = get_firestore().collection(get_settings().notify_status_collection).document(job['record_id'])
+            update = {'notification': {**outcome, 'job_id': job['job_id']}}
+            retry_with_backoff(lambda: doc_ref.set(update, merge=True))
+        except Exception as e:
+            print(f"[NOTIFY] Could not record delivery status for {job['record_id']}: {e}")
+
+    def flush(self, timeout=None):
+        """Block until every queued job has been delivered, or the timeout passes"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self):
+        return OrderedDict([("queued", self._queue.qsize()), *self.counts.items()])
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_notification_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher()
+            atexit.register(_dispatcher.flush, 5)
+            register_metrics('notifications', _dispatcher.stats)
+        return _dispatcher
@@ -1,5 +1,6 @@
 from utils.request_utils import get_request_id, get_auth_token, validate_auth_token
 from utils.response_utils import create_error_response, create_success_response
+from utils.metrics_utils import collect_metrics
 
 def handle_ping_request(req):
     """Health check endpoint handler (shared by Flask and GCF)"""
@@ -8,4 +9,9 @@ def handle_ping_request(req):
     is_valid, error_msg = validate_auth_token(auth_token)
     if not is_valid:
         return create_error_response(request_id, "ER100", error_msg, "Auth token required in header.", 401)
-    return create_success_response(request_id, {"message": "server is up and running"}) 
\ No newline at end of file
+    data = {"message": "server is up and running"}
+    # Cache/latency metrics of this instance, only on request: /ping?metrics=true. Deployed,
+    # other functions' instances report theirs as structured log lines (log_metrics_if_due)
+    if hasattr(req, 'args') and req.args.get('metrics', 'false').lower() == 'true':
+        data["metrics"] = collect_metrics()
+    return create_success_response(request_id, data)
@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+import numpy as np
+from utils.cache_utils import LRUCache
+from utils.metrics_utils import register_metrics
+from utils.price_series import PriceSeries, SERIES_CACHE_DTYPE
+
+# One packed document per (mandi, crop) instead of an ever-growing price_history array
+# inside the mandi document: 8 bytes per day, so ~125k days fit under Firestore's 1 MB.
+PRICE_SERIES_COLLECTION = os.getenv('PRICE_SERIES_COLLECTION', 'price_series')
+# Local .npy copies are memory-mapped on later reads instead of re-fetched
+PRICE_SERIES_CACHE_DIR = os.getenv('PRICE_SERIES_CACHE_DIR', '/tmp/cropmind_price_series')
+PRICE_SERIES_CACHE_SIZE = int(os.getenv('PRICE_SERIES_CACHE_SIZE', '512'))
+PRICE_SERIES_CACHE_TTL = int(os.getenv('PRICE_SERIES_CACHE_TTL', '3600'))
+
+def price_series_id(mandi_id, crop_slug):
+    return f"{mandi_id}__{crop_slug}"
+
+class PriceSeriesStore:
+    """Firestore-backed price series with an in-process LRU and a memory-mapped disk tier"""
+
+    def __init__(self, collection=PRICE_SERIES_COLLECTION, directory=PRICE_SERIES_CACHE_DIR,
+                 cache_size=PRICE_SERIES_CACHE_SIZE, ttl=PRICE_SERIES_CACHE_TTL):
+        self.collection = collection
+        self.directory = directory
+        self.ttl = ttl
+        self.local = LRUCache(max_size=cache_size, ttl=ttl)
+        self.disk_hits = 0
+        self.remote_reads = 0
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        except OSError:
+            self.directory = None
+
+    def _path(self, series_id):
+        return os.path.join(self.directory, f"{series_id}.npy")
+
+    def _load_disk(self, series_id):
+        if not self.directory:
+            return None
+        path = self._path(series_id)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            return PriceSeries.from_records(np.load(path, mmap_mode='r'))
+        except (OSError, ValueError):
+            return None
+
+    def _save_disk(self, series_id, series):
+        if not self.directory:
+            return
+        tmp_path = f"{self._path(series_id)}.{threading.get_ident()}.tmp.npy"
+        try:
+            np.save(tmp_path, series.to_records(SERIES_CACHE_DTYPE))
+            os.replace(tmp_path, self._path(series_id))
+        except OSError as e:
+            print(f"[PRICE_SERIES] Could not write disk cache for {series_id}: {e}")
+
+    def get(self, mandi_id, crop_slug):
+        """PriceSeries for (mandi, crop); empty if nothing has been stored"""
+        series_id = price_series_id(mandi_id, crop_slug)
+        series = self.local.get(series_id)
+        if series is not None:
+            return series
+        series = self._load_disk(series_id)
+        if series is not None:
+            self.disk_hits += 1
+        else:
+            from utils.services import get_firestore
+            self.remote_reads += 1
+            doc = get_firestore().collection(self.collection).document(series_id).get()
+            # Missing series are cached empty so mandis without one do not re-read on every request
+            series = PriceSeries.from_bytes(doc.to_dict().get('series') or b'') if doc.exists else PriceSeries([], [])
+            if len(series):
+                self._save_disk(series_id, series)
+        self.local.set(series_id, series)
+        return series
+
+    def put(self, mandi_id, crop_slug, series, db=None):
+        from firebase_admin import firestore
+        from utils.services import get_firestore
+        if db is None:
+            db = get_firestore()
+        series_id = price_series_id(mandi_id, crop_slug)
+        db.collection(self.collection).document(series_id).set({
+            'mandi_id': str(mandi_id),
+            'crop': crop_slug,
+            'points': len(series),
+            'start': str(series.days[0]) if len(series) else None,
+            'end': str(series.days[-1]) if len(series) else None,
+            'series': series.to_bytes(),
+            'updated_at': firestore.SERVER_TIMESTAMP
+        })
+        self.local.pop(series_id)
+
+    def stats(self):
+        return {**self.local.stats(), "disk_hits": self.disk_hits, "remote_reads": self.remote_reads}
+
+_price_series_store = None
+_price_series_store_lock = threading.Lock()
+
+def get_price_series_store():
+    global _price_series_store
+    with _price_series_store_lock:
+        if _price_series_store is None:
+            _price_series_store = PriceSeriesStore()
+            register_metrics('price_series', _price_series_store.stats)
+        return _price_series_store
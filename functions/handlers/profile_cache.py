@@ -0,0 +1,171 @@
+import threading
+from utils.cache_utils import LRUCache, freeze
+from utils.metrics_utils import register_metrics
+from utils.settings import get_settings
+
+# Farm and farmer profiles are read on every animal detection; keep them in-process.
+# The TTL bounds how stale a cached profile can get. PROFILE_CACHE_WATCH=true adds a listener,
+# but on the whole collection: every instance then reads every farm/farmer document at start
+# and every later change, cached or not, so it is off by default.
+# Firestore get_all / 'in' query limits per round trip
+PROFILE_GET_ALL_LIMIT = 100
+PROFILE_IN_QUERY_LIMIT = 30
+
+_MISSING = object()
+
+class ProfileCache:
+    """
+    Read-through cache of one profile collection (e.g. farms), keyed by the id callers
+    pass: either the document id or the value of `id_field` on the document.
+    Misses are resolved in two batched round trips, a get_all on document ids and one
+    'in' query on `id_field` for the rest; profiles that do not exist are cached for
+    `negative_ttl`. Entries expire after `ttl`; with `watch`, a collection snapshot
+    listener also refreshes or drops cached entries as soon as their document changes.
+    """
+
+    def __init__(self, collection, id_field, max_size=None, ttl=None, negative_ttl=None, watch=None, db=None):
+        settings = get_settings()
+        self.collection = collection
+        self.id_field = id_field
+        self.negative_ttl = settings.profile_cache_negative_ttl if negative_ttl is None else negative_ttl
+        self._db = db
+        max_size = settings.profile_cache_size if max_size is None else max_size
+        self._cache = LRUCache(max_size, ttl=settings.profile_cache_ttl if ttl is None else ttl)  # key -> (doc id, frozen profile) or _MISSING
+        self._keys_by_doc = {}                      # doc id -> keys it was cached under
+        self._lock = threading.Lock()
+        self._watch = None
+        self._watching = settings.profile_cache_watch if watch is None else watch
+        self.fetches = 0
+        self.invalidations = 0
+
+    def _client(self):
+        if self._db is None:
+            from utils.services import get_firestore
+            self._db = get_firestore()
+        return self._db
+
+    def _ensure_watch(self):
+        if not self._watching or self._watch is not None:
+            return
+        with self._lock:
+            if self._watch is not None:
+                return
+            try:
+                self._watch = self._client().collection(self.collection).on_snapshot(self._on_snapshot)
+            except Exception as e:
+                print(f"[PROFILE_CACHE] Snapshot listener for {self.collection} unavailable, relying on TTL: {e}")
+                self._watching = False
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        for change in changes:
+            doc_id = change.document.id
+            data = None if change.type.name == 'REMOVED' else change.document.to_dict() or {}
+            with self._lock:
+                keys = set(self._keys_by_doc.get(doc_id, ())) | {doc_id}
+                if data and data.get(self.id_field):
+                    keys.add(str(data[self.id_field]))
+                for key in keys:
+                    # Only keys already cached are touched; the initial snapshot does not fill the cache
+                    if self._cache.get(key, count=False) is None:
+                        continue
+                    self.invalidations += 1
+                    if data is None:
+                        self._set_missing(key)
+                    else:
+                        self._cache.set(key, (doc_id, freeze(data)))
+                        self._keys_by_doc.setdefault(doc_id, set()).add(key)
+                if data is None:
+                    self._keys_by_doc.pop(doc_id, None)
+
+    def _set_missing(self, key):
+        if self.negative_ttl:
+            self._cache.set(key, _MISSING, ttl=self.negative_ttl)
+        else:
+            self._cache.pop(key)
+
+    def _store(self, key, doc_id, data):
+        with self._lock:
+            if data is None:
+                self._set_missing(key)
+                return None
+            profile = freeze(data)
+            self._cache.set(key, (doc_id, profile))
+            self._keys_by_doc.setdefault(doc_id, set()).add(key)
+            return profile
+
+    def get(self, key):
+        """Profile dict (read-only) for a document id or id_field value, or None"""
+        if not key:
+            return None
+        return self.get_many([key]).get(str(key))
+
+    def get_many(self, keys):
+        """{key: profile or None} resolving all cache misses in at most two batched round trips"""
+        self._ensure_watch()
+        results = {}
+        pending = []
+        for key in dict.fromkeys(str(k) for k in keys if k):
+            entry = self._cache.get(key)
+            if entry is None:
+                pending.append(key)
+            else:
+                results[key] = None if entry is _MISSING else entry[1]
+        if pending:
+            results.update(self._fetch(pending))
+        return results
+
+    def prefetch(self, keys):
+        """Warm the cache for keys that are about to be looked up"""
+        self.get_many(keys)
+
+    def _fetch(self, keys):
+        db = self._client()
+        collection = db.collection(self.collection)
+        self.fetches += 1
+        found = {}
+        for start in range(0, len(keys), PROFILE_GET_ALL_LIMIT):
+            refs = [collection.document(key) for key in keys[start:start + PROFILE_GET_ALL_LIMIT]]
+            for doc in db.get_all(refs):
+                if doc.exists:
+                    found[doc.id] = self._store(doc.id, doc.id, doc.to_dict() or {})
+        # Fall back to the id field for keys that are not document ids
+        rest = [key for key in keys if key not in found]
+        for start in range(0, len(rest), PROFILE_IN_QUERY_LIMIT):
+            chunk = rest[start:start + PROFILE_IN_QUERY_LIMIT]
+            for doc in collection.where(self.id_field, 'in', chunk).stream():
+                key = str((doc.to_dict() or {}).get(self.id_field))
+                if key in chunk and key not in found:
+                    found[key] = self._store(key, doc.id, doc.to_dict() or {})
+        for key in keys:
+            if key not in found:
+                found[key] = self._store(key, None, None)
+        return found
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats["fetches"] = self.fetches
+        stats["invalidations"] = self.invalidations
+        stats["watching"] = self._watch is not None
+        return stats
+
+_profile_caches = {}
+_profile_caches_lock = threading.Lock()
+
+def get_profile_cache(collection, id_field):
+    """Shared ProfileCache per collection; with PROFILE_CACHE_ENABLED=false it caches nothing"""
+    with _profile_caches_lock:
+        cache = _profile_caches.get(collection)
+        if cache is None:
+            if get_settings().profile_cache_enabled:
+                cache = ProfileCache(collection, id_field)
+            else:
+                cache = ProfileCache(collection, id_field, max_size=0, watch=False)
+            _profile_caches[collection] = cache
+            register_metrics(f'profile_cache_{collection}', cache.stats)
+        return cache
+
+def get_farm_profile(farm_id):
+    return get_profile_cache('farms', 'farm_id').get(farm_id)
+
+def get_farmer_profile(farmer_id):
+    return get_profile_cache('farmers', 'farmer_id').get(farmer_id)
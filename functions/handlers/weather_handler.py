@@ -1,8 +1,57 @@
+import threading
 from utils.response_utils import create_error_response, create_success_response
 from utils.request_utils import get_request_id
+from utils.metrics_utils import register_metrics
+from utils.swr_cache import StaleWhileRevalidateCache
+from utils.http_client import get_http_client
+from utils.settings import get_settings
+from utils import geohash
+
+# Requests are answered per geohash cell (Settings.weather_geohash_precision, 5 is ~4.9 km)
+# using the cell center, so a whole village shares one cached upstream response
+
+class WeatherUpstreamError(Exception):
+    def __init__(self, status_code, body):
+        super().__init__(f"Status: {status_code}, Body: {body}")
+        self.status_code = status_code
+        self.body = body
+
+_weather_cache = None
+_weather_cache_lock = threading.Lock()
+
+def get_weather_cache():
+    global _weather_cache
+    with _weather_cache_lock:
+        if _weather_cache is None:
+            settings = get_settings()
+            _weather_cache = StaleWhileRevalidateCache(settings.weather_cache_ttl, settings.weather_cache_stale_ttl,
+                                                       max_size=settings.weather_cache_size)
+            register_metrics('weather_cache', _weather_cache.stats)
+        return _weather_cache
+
+def fetch_weather(lat, lon):
+    settings = get_settings()
+    headers = {
+        "Accept-Encoding": "gzip",
+        "Accept-Language": "en",
+        "api-key": settings.weather_api_key,
+        "User-Agent": "plantix-production-4.5.1"
+    }
+    resp = get_http_client().get(settings.weather_api_url, upstream='weather', params={"lat": lat, "lon": lon},
+                                 headers=headers, timeout=(settings.http_connect_timeout, settings.weather_api_timeout))
+    if resp.status_code != 200:
+        raise WeatherUpstreamError(resp.status_code, resp.text)
+    return resp.json()
+
+def get_weather(lat, lon):
+    """Weather for the geohash cell containing (lat, lon), cached with stale-while-revalidate"""
+    if not get_settings().weather_cache_enabled:
+        return fetch_weather(lat, lon)
+    cell = geohash.encode(float(lat), float(lon), get_settings().weather_geohash_precision)
+    center_lat, center_lon = geohash.decode(cell)
+    return get_weather_cache().get(cell, lambda: fetch_weather(round(center_lat, 4), round(center_lon, 4)))
 
 def handle_weather_request(req):
-    import requests
     try:
         if req.method == 'GET':
             lat = req.args.get('lat')
@@ -13,19 +62,13 @@ def handle_weather_request(req):
             lon = data.get('lon')
         if not lat or not lon:
             return create_error_response(get_request_id(req), "ER400", "Missing lat/lon", "Latitude and longitude are required.", 400)
-        url = f"https://ape.peat-cloud.com/v2/weather?lat={lat}&lon={lon}"
-        headers = {
-            "Accept-Encoding": "gzip",
-            "Accept-Language": "en",
-            "api-key": "d0723c386c6590bcbcb75df05f60fce9ba8685db",
-            "Connection": "Keep-Alive",
-            "Host": "ape.peat-cloud.com",
-            "User-Agent": "plantix-production-4.5.1"
-        }
-        resp = requests.get(url, headers=headers, timeout=10)
-        if resp.status_code != 200:
-            return create_error_response(get_request_id(req), "ER500", "Weather API error", f"Status: {resp.status_code}, Body: {resp.text}", 500)
-        return create_success_response(get_request_id(req), resp.json())
+        if not get_settings().weather_api_key:
+            return create_error_response(get_request_id(req), "ER500", "Weather API not configured", "WEATHER_API_KEY is not set.", 500)
+        try:
+            weather = get_weather(lat, lon)
+        except WeatherUpstreamError as e:
+            return create_error_response(get_request_id(req), "ER500", "Weather API error", str(e), 500)
+        return create_success_response(get_request_id(req), weather)
     except Exception as e:
         import traceback
-        return create_error_response(get_request_id(req), "ER500", "Internal server error", str(e) + "\n" + traceback.format_exc(), 500) 
\ No newline at end of file
+        return create_error_response(get_request_id(req), "ER500", "Internal server error", str(e) + "\n" + traceback.format_exc(), 500)
@@ -1,20 +1,3 @@
-import os
-from handlers.mandi_handler import (
-    handle_mandi_nearby,
-    handle_mandi_crop_price,
-    handle_mandi_crop_trend,
-    handle_mandi_details,
-    handle_mandi_search
-)
-from handlers.ping_handler import handle_ping_request
-from handlers.crop_diagnose_handler import (handle_diagnose_request, handle_diagnosis_history, handle_diagnose_crop_json, handle_detect_animals)
-from utils.request_utils import (get_auth_token, validate_auth_token, get_request_id, get_field)
-from utils.response_utils import (create_error_response, create_success_response, ordered_json_response)
-from utils.env_utils import is_local_environment, is_deployed_environment, should_import_cloud_services, MockHttpsFn
-from handlers.animal_detect_handler import handle_detect_animals
-from handlers.weather_handler import handle_weather_request
-from handlers.govt_insurance_handler import handle_govt_schemes
-from handlers.insurance_handler import handle_insurance_options
 # Load .env for local development
 try:
     from dotenv import load_dotenv
@@ -23,29 +6,19 @@ except ImportError:
     pass
 
 from firebase_functions import https_fn
+from utils.settings import get_settings
+from utils.write_behind import install_shutdown_flush
 
 # Set bucket name from environment variable or default
-BUCKET_NAME = os.getenv('GCS_BUCKET', 'cropmind-team')
-
-# Import Firestore, Storage, Vision, Gemini in both deployed and FORCE_REAL_API=true local runs
-if should_import_cloud_services():
-    from firebase_admin import initialize_app, firestore, storage
-    from google.cloud import vision
-    from google.cloud import aiplatform
-    import google.generativeai as genai
-    # Initialize Firebase Admin SDK only in deployed environment or real local
-    import firebase_admin
-    if not firebase_admin._apps:
-        initialize_app(options={
-            "storageBucket": BUCKET_NAME,
-            "databaseURL": "https://cropmind-89afe-default-rtdb.asia-southeast1.firebasedatabase.app"
-        })
-    vision_client = None
-    try:
-        vision_client = vision.ImageAnnotatorClient()
-        genai.configure(api_key=os.getenv('GEMINI_API_KEY', 'gemini-api-key'))
-    except Exception as e:
-        print(f"Failed to initialize Google Cloud clients: {e}")
+BUCKET_NAME = get_settings().bucket_name
+
+# Queued Firestore writes and uploads are flushed on SIGTERM; the handler has to be
+# installed here, on the main thread, because handlers are first used on request threads
+install_shutdown_flush()
+
+# Handlers and cloud clients are imported on first use: each entry point imports only its
+# own handler module, and Firebase/Vision/Gemini are created lazily by utils.services,
+# so a cold start only pays for what that function touches.
 
 # --- Common endpoint handlers ---
 def use_mock_response(req):
@@ -62,108 +35,136 @@ def add_cors_headers(response):
     response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Mock-Response'
     return response
 
+def finish_response(response):
+    # Each function runs in its own instances, so each one logs its own metrics
+    from utils.metrics_utils import log_metrics_if_due
+    log_metrics_if_due()
+    return add_cors_headers(response)
+
 # --- Google Cloud Functions endpoints ---
 @https_fn.on_request(memory=512)
 def ping_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.ping_handler import handle_ping_request
     response = handle_ping_request(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def diagnose_crop_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.crop_diagnose_handler import handle_diagnose_request
     response = handle_diagnose_request(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def diagnosis_history_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.crop_diagnose_handler import handle_diagnosis_history
     response = handle_diagnosis_history(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def mandi_nearby_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.mandi_handler import handle_mandi_nearby
     response = handle_mandi_nearby(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def mandi_crop_price_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.mandi_handler import handle_mandi_crop_price
     response = handle_mandi_crop_price(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def mandi_crop_trend_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.mandi_handler import handle_mandi_crop_trend
     response = handle_mandi_crop_trend(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def mandi_details_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.mandi_handler import handle_mandi_details
     response = handle_mandi_details(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def mandi_search_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.mandi_handler import handle_mandi_search
     response = handle_mandi_search(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def diagnose_crop_json_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.crop_diagnose_handler import handle_diagnose_crop_json
     response = handle_diagnose_crop_json(req)
-    return add_cors_headers(response)
+    return finish_response(response)
+
+@https_fn.on_request(memory=1024)
+def diagnose_crop_batch_entry(req: https_fn.Request) -> https_fn.Response:
+    if req.method == 'OPTIONS':
+        response = https_fn.Response('', status=204)
+        return add_cors_headers(response)
+    from handlers.crop_diagnose_handler import handle_diagnose_batch
+    response = handle_diagnose_batch(req)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def detect_animals_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.animal_detect_handler import handle_detect_animals
     response = handle_detect_animals(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def weather_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.weather_handler import handle_weather_request
     response = handle_weather_request(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def govt_schemes_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.govt_insurance_handler import handle_govt_schemes
     response = handle_govt_schemes(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
 @https_fn.on_request(memory=512)
 def insurance_options_entry(req: https_fn.Request) -> https_fn.Response:
     if req.method == 'OPTIONS':
         response = https_fn.Response('', status=204)
         return add_cors_headers(response)
+    from handlers.insurance_handler import handle_insurance_options
     response = handle_insurance_options(req)
-    return add_cors_headers(response)
+    return finish_response(response)
 
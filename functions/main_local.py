@@ -1,5 +1,9 @@
 from flask import Flask, request
 from dotenv import load_dotenv
+
+# Before any handler import: handlers resolve Settings (and copy values from it) at import
+load_dotenv()
+
 from handlers.ping_handler import handle_ping_request
 from handlers.mandi_handler import (
     handle_mandi_nearby,
@@ -11,7 +15,7 @@ from handlers.mandi_handler import (
 from handlers.crop_diagnose_handler import (
     handle_diagnose_request, 
     handle_diagnosis_history,
-    handle_detect_animals
+    handle_diagnose_batch
     )
 
 from handlers.animal_detect_handler import handle_detect_animals
@@ -19,20 +23,23 @@ from handlers.weather_handler import handle_weather_request
 from handlers.insurance_handler import handle_insurance_options
 from handlers.govt_insurance_handler import handle_govt_schemes 
 
-import os
 import firebase_admin
 
 from firebase_admin import initialize_app
+from utils.settings import get_settings
+from utils.write_behind import install_shutdown_flush
 
-BUCKET_NAME = os.getenv('GCS_BUCKET', 'cropmind-89afe.appspot.com')
+BUCKET_NAME = get_settings().bucket_name
 
 if not firebase_admin._apps:
     initialize_app(options={
         "storageBucket": BUCKET_NAME,
-        "databaseURL": "https://cropmind-89afe-default-rtdb.asia-southeast1.firebasedatabase.app"
+        "databaseURL": get_settings().firebase_database_url
     })
 
-load_dotenv()
+# Queued Firestore writes and uploads are flushed on SIGTERM (main thread only)
+install_shutdown_flush()
+
 app = Flask(__name__)
 
 @app.route('/ping', methods=['GET'])
@@ -43,6 +50,10 @@ def ping():
 def diagnose_crop():
     return handle_diagnose_request(request)
 
+@app.route('/api/diagnose-crop-batch', methods=['POST'])
+def diagnose_crop_batch():
+    return handle_diagnose_batch(request)
+
 @app.route('/api/mandi-nearby', methods=['POST'])
 def mandi_nearby():
     return handle_mandi_nearby(request)
@@ -87,6 +98,7 @@ if __name__ == '__main__':
     print("🚀 Starting CropMind API server locally...")
     print(" Health check: http://localhost:8080/ping")
     print(" Disease diagnosis: http://localhost:8080/api/diagnose-crop")
+    print(" Batch diagnosis: http://localhost:8080/api/diagnose-crop-batch")
     print(" Mandi endpoints:")
     print("   - Nearby: http://localhost:8080/api/mandi-nearby")
     print("   - Crop price: http://localhost:8080/api/mandi-crop-price")
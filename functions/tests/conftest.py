@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Handlers import their siblings as top-level packages (utils.*, handlers.*), as in deployment
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,68 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from handlers.animal_incidents import IncidentAggregator, camera_key, frame_digest
+from utils.motion_gate import MotionGate
+
+CLEAR = {"status": "clear", "labels": [], "confidence": {}}
+GOAT = {"status": "animal_detected", "labels": ["goat"], "confidence": {"goat": 0.91}}
+
+def _scene(animal_at=None, size=64):
+    """640x480 JPEG of a textured field, with an optional dark animal-sized blob"""
+    rng = np.random.default_rng(0)
+    pixels = np.tile(np.linspace(90, 170, 640), (480, 1)) + rng.normal(0, 6, (480, 640))
+    if animal_at is not None:
+        x, y = animal_at
+        pixels[y:y + size, x:x + size] = 30
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'L').convert('RGB').save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+def _frame(gate, aggregator, key, image_bytes):
+    """The gate, then frame reuse, as handle_detect_animals runs them; returns (moved, reused result)"""
+    moved, _ = gate.check(key, image_bytes)
+    if not moved:
+        return moved, None
+    return moved, aggregator.match_frame(key, frame_digest(image_bytes), moved)
+
+def test_small_animal_entering_is_not_answered_from_the_previous_frame():
+    gate = MotionGate(max_cameras=4, ttl=60)
+    aggregator = IncidentAggregator(window=60, max_cameras=4, reuse=True)
+    key = camera_key('farm1', 'cam1')
+    empty = _scene()
+
+    moved, reused = _frame(gate, aggregator, key, empty)
+    assert moved and reused is None
+    aggregator.observe(key, CLEAR, frame_digest(empty))
+
+    # The same empty field again: the gate drops it before Vision
+    moved, _ = _frame(gate, aggregator, key, empty)
+    assert not moved
+
+    # A goat covering ~1% of the frame moves the gate and must not reuse the "clear" result
+    entering = _scene(animal_at=(20, 400))
+    moved, changed = gate.check(key, entering)
+    assert moved and changed < 0.05
+    assert aggregator.match_frame(key, frame_digest(entering), moved) is None
+    aggregator.observe(key, GOAT, frame_digest(entering))
+
+    # A re-sent copy of the goat frame reuses its Vision result
+    assert aggregator.match_frame(key, frame_digest(entering), True) == GOAT
+    assert aggregator.stats()["vision_skipped"] == 1
+
+def test_match_frame_needs_identical_bytes():
+    aggregator = IncidentAggregator(window=60, max_cameras=4, reuse=True)
+    key = camera_key('farm1', 'cam2')
+    empty = _scene()
+    aggregator.observe(key, CLEAR, frame_digest(empty))
+    assert aggregator.match_frame(key, frame_digest(empty)) == CLEAR
+    # A moved frame never reuses "clear", even with the same bytes
+    assert aggregator.match_frame(key, frame_digest(empty), moved=True) is None
+    # One changed byte is a different frame
+    nudged = bytearray(empty)
+    nudged[len(nudged) // 2] ^= 1
+    assert aggregator.match_frame(key, frame_digest(bytes(nudged))) is None
+    assert aggregator.match_frame(camera_key('farm1', 'other'), frame_digest(empty)) is None
+    assert IncidentAggregator(reuse=False).match_frame(key, frame_digest(empty)) is None
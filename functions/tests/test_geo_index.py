@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from utils.geo_index import GeoIndex
+from utils.geo_utils import haversine
+
+def _brute_force(points, lat, lng):
+    return sorted((haversine(lat, lng, p_lat, p_lng), key) for key, (p_lat, p_lng) in points.items())
+
+def _random_points(rng, count, lat_range=(-60, 60), lng_range=(-180, 180)):
+    return {f"m{i}": (rng.uniform(*lat_range), rng.uniform(*lng_range)) for i in range(count)}
+
+def _build_index(points):
+    index = GeoIndex()
+    for key, (lat, lng) in points.items():
+        index.upsert(key, lat, lng)
+    return index
+
+def _assert_same(found, expected):
+    assert [key for key, _ in found] == [key for _, key in expected]
+    for (_, distance), (expected_distance, _) in zip(found, expected):
+        assert distance == pytest.approx(expected_distance, abs=1e-6)
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(7)
+    points = _random_points(rng, 500)
+    index = _build_index(points)
+    for _ in range(50):
+        lat, lng = rng.uniform(-60, 60), rng.uniform(-180, 180)
+        _assert_same(index.nearest(lat, lng, k=5), _brute_force(points, lat, lng)[:5])
+
+def test_within_matches_brute_force():
+    rng = random.Random(11)
+    points = _random_points(rng, 500, lat_range=(8, 30), lng_range=(70, 88))
+    index = _build_index(points)
+    for radius in (10, 75, 300):
+        lat, lng = rng.uniform(8, 30), rng.uniform(70, 88)
+        expected = [(d, key) for d, key in _brute_force(points, lat, lng) if d <= radius]
+        _assert_same(index.within(lat, lng, radius), expected)
+    assert len(index.within(lat, lng, 300, limit=3)) == min(3, len(expected))
+
+def test_queries_across_the_antimeridian():
+    rng = random.Random(3)
+    points = {f"e{i}": (rng.uniform(-5, 5), rng.uniform(179.0, 180.0)) for i in range(60)}
+    points.update({f"w{i}": (rng.uniform(-5, 5), rng.uniform(-180.0, -179.0)) for i in range(60)})
+    index = _build_index(points)
+    for lat, lng in ((0.0, 179.99), (0.0, -179.99), (1.0, 180.0)):
+        expected = _brute_force(points, lat, lng)
+        found = index.nearest(lat, lng, k=10)
+        _assert_same(found, expected[:10])
+        # Both sides of the antimeridian are within a few km of these origins
+        assert {key[0] for key, _ in index.within(lat, lng, 60)} == {'e', 'w'}
+        _assert_same(index.within(lat, lng, 60), [(d, key) for d, key in expected if d <= 60])
+
+def test_upserts_and_removals_match_brute_force():
+    rng = random.Random(5)
+    points = _random_points(rng, 300)
+    index = _build_index(points)
+    # Move some points and drop others, so the tree, pending points and tombstones all take part
+    for key in rng.sample(sorted(points), 40):
+        points[key] = (rng.uniform(-60, 60), rng.uniform(-180, 180))
+        index.upsert(key, *points[key])
+    for key in rng.sample(sorted(points), 40):
+        del points[key]
+        index.remove(key)
+    assert len(index) == len(points)
+    for _ in range(30):
+        lat, lng = rng.uniform(-60, 60), rng.uniform(-180, 180)
+        _assert_same(index.nearest(lat, lng, k=4), _brute_force(points, lat, lng)[:4])
+        expected = [(d, key) for d, key in _brute_force(points, lat, lng) if d <= 1500]
+        _assert_same(index.within(lat, lng, 1500), expected)
@@ -0,0 +1,58 @@
+import random
+from collections import namedtuple
+
+from handlers.label_keywords import get_label_classifier
+from utils.label_matcher import ANIMAL_KEYWORDS, AGRICULTURAL_KEYWORDS, KeywordAutomaton, LabelClassifier
+
+Label = namedtuple('Label', 'description score')
+
+VOCABULARY = [
+    "Cow", "Water buffalo", "Bull", "Ox", "Wild boar", "Nilgai", "Goat", "Pig", "Deer", "Bovinae",
+    "Livestock", "Herd", "Cattle", "Animal", "Terrestrial animal", "Working animal", "Dairy cow",
+    "Plant", "Leaf", "Plant disease", "Fungus", "Leaf spot", "Yellow", "Brown", "White", "Whitefly",
+    "Grass", "Sky", "Tree", "Soil", "Tractor", "Cow-calf", "Pasture", "Ow", "Bo", "Oat", "Er"
+]
+
+def _old_animals(labels):
+    # The substring loop handle_detect_animals used before the keyword automaton
+    detected = {}
+    for label in labels:
+        desc = label.description.lower()
+        for animal in ANIMAL_KEYWORDS:
+            animal_lc = animal.lower()
+            if (animal_lc in desc or desc in animal_lc) and label.score >= 0.6:
+                detected[animal] = max(detected.get(animal, 0), float(label.score))
+    return detected
+
+def _old_agricultural(labels):
+    return [label for label in labels
+            if any(keyword in label.description.lower() for keyword in AGRICULTURAL_KEYWORDS)]
+
+def test_default_classifier_matches_old_substring_loops():
+    rng = random.Random(21)
+    classifier = get_label_classifier()
+    for _ in range(500):
+        labels = [Label(rng.choice(VOCABULARY), round(rng.uniform(0.3, 1.0), 3))
+                  for _ in range(rng.randint(0, 8))]
+        result = classifier.classify(labels)
+        assert dict(result['animals']['classes']) == _old_animals(labels)
+        assert list(result['animals']['classes']) == list(_old_animals(labels))
+        assert result['agricultural']['labels'] == _old_agricultural(labels)
+
+def test_automaton_finds_overlapping_keywords():
+    automaton = KeywordAutomaton(['he', 'she', 'his', 'hers'])
+    assert automaton.find('ushers') == {'she', 'he', 'hers'}
+    assert automaton.find('cow') == set()
+
+def test_class_thresholds_and_synonyms():
+    classifier = LabelClassifier({
+        'animals': {
+            'match': 'contains',
+            'threshold': 0.5,
+            'classes': {'cattle': {'keywords': ['cow', 'bull', 'bovinae']},
+                        'boar': {'keywords': ['boar'], 'threshold': 0.9}}
+        }
+    })
+    result = classifier.classify([Label('Dairy cow', 0.7), Label('Bull', 0.8), Label('Wild boar', 0.85)])
+    assert dict(result['animals']['classes']) == {'cattle': 0.8}
+    assert [label.description for label in result['animals']['labels']] == ['Dairy cow', 'Bull']
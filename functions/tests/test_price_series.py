@@ -0,0 +1,76 @@
+import datetime
+import random
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from utils.price_series import PriceSeries
+
+def _daily_series(start, count, seed=1):
+    rng = random.Random(seed)
+    first = datetime.date.fromisoformat(start)
+    history = [
+        {'date': (first + datetime.timedelta(days=i)).isoformat(), 'modal_price': rng.uniform(1000, 3000)}
+        for i in range(count) if rng.random() < 0.8
+    ]
+    return history, PriceSeries.from_history(history)
+
+def _bucket_means(history, bucket):
+    groups = defaultdict(list)
+    for row in history:
+        groups[bucket(datetime.date.fromisoformat(row['date']))].append(row['modal_price'])
+    return sorted((day, sum(prices) / len(prices)) for day, prices in groups.items())
+
+def _as_pairs(series):
+    return [(datetime.date.fromisoformat(str(day)), price) for day, price in zip(series.days, series.prices)]
+
+def _assert_pairs(found, expected):
+    assert [day for day, _ in found] == [day for day, _ in expected]
+    assert [price for _, price in found] == pytest.approx([price for _, price in expected])
+
+def test_weekly_resample_buckets_start_on_monday():
+    history, series = _daily_series('2024-02-20', 120)
+    expected = _bucket_means(history, lambda day: day - datetime.timedelta(days=day.weekday()))
+    weekly = series.resample('W')
+    assert all(day.weekday() == 0 for day, _ in _as_pairs(weekly))
+    _assert_pairs(_as_pairs(weekly), expected)
+
+def test_monthly_resample_buckets_start_on_the_first():
+    history, series = _daily_series('2023-11-15', 200, seed=2)
+    expected = _bucket_means(history, lambda day: day.replace(day=1))
+    _assert_pairs(_as_pairs(series.resample('M')), expected)
+
+def test_daily_resample_and_bad_unit():
+    _, series = _daily_series('2024-01-01', 30)
+    assert series.resample('D') is series
+    with pytest.raises(ValueError):
+        series.resample('Y')
+
+def test_downsample_averages_consecutive_buckets():
+    _, series = _daily_series('2024-01-01', 100, seed=3)
+    n = len(series)
+    reduced = series.downsample(7)
+    assert len(reduced) == 7
+    expected = []
+    for bucket in range(7):
+        start, end = bucket * n // 7, (bucket + 1) * n // 7
+        expected.append((series.days[end - 1], series.prices[start:end].mean()))
+    assert list(reduced.days) == [day for day, _ in expected]
+    assert list(reduced.prices) == pytest.approx([price for _, price in expected])
+    # Bucket means of equal-width buckets keep the overall mean close
+    assert reduced.prices.mean() == pytest.approx(series.prices.mean(), rel=0.05)
+
+def test_downsample_keeps_short_series():
+    _, series = _daily_series('2024-01-01', 10)
+    assert series.downsample(len(series)) is series
+    assert series.downsample(None) is series
+    assert len(PriceSeries([], []).downsample(5)) == 0
+
+def test_between_then_resample():
+    history, series = _daily_series('2024-03-01', 90, seed=4)
+    window = series.between('2024-03-10', '2024-04-20')
+    assert window.days[0] >= np.datetime64('2024-03-10') and window.days[-1] <= np.datetime64('2024-04-20')
+    in_window = [row for row in history if '2024-03-10' <= row['date'] <= '2024-04-20']
+    expected = _bucket_means(in_window, lambda day: day - datetime.timedelta(days=day.weekday()))
+    _assert_pairs(_as_pairs(window.resample('W')), expected)
@@ -0,0 +1,85 @@
+import dataclasses
+
+import pytest
+
+from handlers import animal_incidents, diagnosis_history
+from utils import env_utils, motion_gate, http_client
+from utils.settings import Settings, get_settings, override_settings, reset_settings, log
+
+def test_from_env_parses_environment_and_flags():
+    settings = Settings.from_env({
+        'ENVIRONMENT': 'Local', 'FORCE_REAL_API': 'TRUE', 'GCS_BUCKET': 'test-bucket',
+        'MOTION_GATE_ENABLED': 'false', 'HTTP_READ_TIMEOUT': '2.5', 'NOTIFY_WORKERS': '7'
+    })
+    assert settings.env == 'local' and settings.is_local and not settings.is_deployed
+    assert settings.use_cloud_services
+    assert settings.bucket_name == 'test-bucket'
+    assert settings.motion_gate_enabled is False
+    assert settings.http_read_timeout == 2.5
+    assert settings.notify_workers == 7
+    assert Settings.from_env({}) == Settings()
+
+def test_from_env_parses_feature_knobs():
+    settings = Settings.from_env({
+        'NOTIFY_CHANNELS': ' sms , ', 'MANDI_NEAREST_BACKEND': 'NumPy', 'HISTORY_CACHE_ENABLED': 'true',
+        'HTTP_BREAKER_FAILURES': '3', 'MOTION_MIN_CHANGED': '0.05', 'DIAGNOSIS_SKIP_VISION': 'TRUE'
+    })
+    assert settings.notify_channels == ('sms',)
+    assert settings.mandi_nearest_backend == 'numpy'
+    assert settings.history_cache_enabled is True
+    assert settings.http_breaker_failures == 3
+    assert settings.motion_min_changed == 0.05
+    assert settings.diagnosis_skip_vision is True
+
+def test_override_reaches_constructor_defaults():
+    with override_settings(http_breaker_failures=2, motion_min_changed=0.5, incident_window=7):
+        assert http_client.CircuitBreaker().failures == 2
+        assert motion_gate.MotionGate().min_changed == 0.5
+        assert animal_incidents.IncidentAggregator().window == 7
+    with override_settings(history_cache_enabled=False):
+        assert diagnosis_history.get_recent_history() is None
+    with override_settings(history_cache_enabled=True):
+        assert diagnosis_history.get_recent_history() is not None
+
+def test_settings_are_immutable():
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        get_settings().env = 'local'
+
+def test_override_reaches_environment_checks():
+    with override_settings(env='local', force_real_api=False):
+        assert env_utils.is_local_environment()
+        assert not env_utils.should_import_cloud_services()
+    with override_settings(env='production'):
+        assert env_utils.is_deployed_environment()
+        assert env_utils.should_import_cloud_services()
+
+def test_override_disables_feature_factories():
+    with override_settings(motion_gate_enabled=False, incident_aggregation_enabled=False):
+        assert motion_gate.get_motion_gate() is None
+        assert animal_incidents.get_incident_aggregator() is None
+    with override_settings(motion_gate_enabled=True, incident_aggregation_enabled=True):
+        assert motion_gate.get_motion_gate() is not None
+        assert animal_incidents.get_incident_aggregator() is not None
+
+def test_override_is_restored_on_exit():
+    before = get_settings()
+    with pytest.raises(RuntimeError):
+        with override_settings(bucket_name='other'):
+            assert get_settings().bucket_name == 'other'
+            raise RuntimeError
+    assert get_settings() is before
+
+def test_reset_rereads_environment(monkeypatch):
+    monkeypatch.setenv('GCS_BUCKET', 'from-env')
+    reset_settings()
+    try:
+        assert get_settings().bucket_name == 'from-env'
+    finally:
+        monkeypatch.undo()
+        reset_settings()
+
+def test_log_is_gated_by_level(capsys):
+    with override_settings(log_level='INFO'):
+        log('DEBUG', 'TEST', 'hidden')
+        log('INFO', 'TEST', 'shown', cell='tdr1y', hits=3)
+    assert capsys.readouterr().out == '[TEST] shown cell=tdr1y hits=3\n'
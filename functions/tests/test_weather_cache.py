@@ -0,0 +1,149 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from handlers import weather_handler
+from utils import geohash
+from utils.metrics_utils import collect_metrics, log_metrics_if_due
+from utils.settings import get_settings, override_settings
+from utils.swr_cache import StaleWhileRevalidateCache
+
+class StubWeatherServer:
+    """Local stand-in for the weather API: counts requests and answers with the call number"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.requests = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests.append(parse_qs(urlparse(self.path).query))
+                    call = len(stub.requests)
+                time.sleep(stub.delay)
+                body = json.dumps({"call": call}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v2/weather"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = StubWeatherServer()
+    monkeypatch.setattr(weather_handler, '_weather_cache', None)
+    with override_settings(weather_cache_enabled=True, weather_api_url=server.url, weather_api_key='test-key'):
+        yield server
+    server.close()
+
+def use_cache(monkeypatch, ttl, stale_ttl):
+    cache = StaleWhileRevalidateCache(ttl, stale_ttl, max_size=16)
+    monkeypatch.setattr(weather_handler, '_weather_cache', cache)
+    return cache
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+def test_fresh_hit_is_served_from_cache(stub, monkeypatch):
+    cache = use_cache(monkeypatch, ttl=60, stale_ttl=60)
+    first = weather_handler.get_weather('28.6139', '77.2090')
+    # A nearby point in the same geohash cell shares the cached response
+    second = weather_handler.get_weather('28.6140', '77.2091')
+    assert first == second == {"call": 1}
+    assert len(stub.requests) == 1
+    cell = geohash.encode(28.6139, 77.2090, get_settings().weather_geohash_precision)
+    center_lat, center_lon = geohash.decode(cell)
+    assert stub.requests[0]['lat'] == [str(round(center_lat, 4))]
+    assert stub.requests[0]['lon'] == [str(round(center_lon, 4))]
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_stale_hit_returns_old_value_and_revalidates(stub, monkeypatch):
+    cache = use_cache(monkeypatch, ttl=0.1, stale_ttl=60)
+    assert weather_handler.get_weather('12.97', '77.59') == {"call": 1}
+    time.sleep(0.15)
+    # Served immediately from the stale entry while one background fetch refreshes it
+    assert weather_handler.get_weather('12.97', '77.59') == {"call": 1}
+    assert cache.stats()['stale_hits'] == 1
+    assert wait_for(lambda: len(stub.requests) == 2 and not cache.stats()['inflight'])
+    assert weather_handler.get_weather('12.97', '77.59') == {"call": 2}
+    assert cache.stats()['revalidations'] == 1
+
+def test_concurrent_requests_for_one_cell_are_coalesced(stub, monkeypatch):
+    stub.delay = 0.3
+    cache = use_cache(monkeypatch, ttl=60, stale_ttl=60)
+    results = []
+    start = threading.Barrier(8)
+
+    def request():
+        start.wait()
+        results.append(weather_handler.get_weather('19.0760', '72.8777'))
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [{"call": 1}] * 8
+    assert len(stub.requests) == 1
+    assert cache.stats()['misses'] + cache.stats()['hits'] == 8
+    assert cache.stats()['coalesced'] >= 1
+
+def test_entry_expires_after_ttl(stub, monkeypatch):
+    cache = use_cache(monkeypatch, ttl=0.1, stale_ttl=0)
+    assert weather_handler.get_weather('22.57', '88.36') == {"call": 1}
+    time.sleep(0.15)
+    assert weather_handler.get_weather('22.57', '88.36') == {"call": 2}
+    assert len(stub.requests) == 2
+    assert cache.stats()['stale_hits'] == 0
+    assert cache.stats()['misses'] == 2
+
+def test_hit_ratio_and_upstream_latency_are_reported(stub, monkeypatch):
+    stub.delay = 0.05
+    for _ in range(4):
+        weather_handler.get_weather('26.91', '75.79')
+    metrics = collect_metrics()['weather_cache']
+    assert metrics['misses'] == 1
+    assert metrics['hits'] == 3
+    assert metrics['hit_ratio'] == 0.75
+    assert metrics['upstream_latency']['count'] == 1
+    assert metrics['upstream_latency']['max_ms'] >= 50
+
+def test_cache_stats_reach_the_structured_metrics_log(stub, monkeypatch, capsys):
+    weather_handler.get_weather('17.38', '78.48')
+    with override_settings(metrics_log_interval=1e-9):
+        assert log_metrics_if_due()
+    line = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert line['metrics']['weather_cache']['misses'] >= 1
+
+def test_request_without_api_key_is_rejected(stub):
+    class Request:
+        method = 'GET'
+        headers = {}
+        args = {'lat': '12.97', 'lon': '77.59'}
+    with override_settings(weather_api_key=''):
+        response = weather_handler.handle_weather_request(Request())
+    assert response.status_code == 500
+    assert stub.requests == []
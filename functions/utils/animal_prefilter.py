@@ -0,0 +1,165 @@
+import io
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.metrics_utils import LatencyHistogram, register_metrics
+
+# Optional on-CPU "maybe animal" classifier run before Cloud Vision. Frames scoring below
+# the threshold are answered as clear without a Vision call. Disabled unless a model path
+# is set; .onnx needs onnxruntime and .tflite needs tflite-runtime (or tensorflow), neither
+# of which is in requirements.txt.
+ANIMAL_PREFILTER_MODEL = os.getenv('ANIMAL_PREFILTER_MODEL', '')
+ANIMAL_PREFILTER_THRESHOLD = float(os.getenv('ANIMAL_PREFILTER_THRESHOLD', '0.2'))
+# Index of the animal class in the model output; ignored for single-output models
+ANIMAL_PREFILTER_CLASS_INDEX = int(os.getenv('ANIMAL_PREFILTER_CLASS_INDEX', '1'))
+ANIMAL_PREFILTER_THREADS = int(os.getenv('ANIMAL_PREFILTER_THREADS', '2'))
+ANIMAL_PREFILTER_MAX_BATCH = int(os.getenv('ANIMAL_PREFILTER_MAX_BATCH', '16'))
+# Per-channel normalization applied after scaling pixels to [0, 1] (ImageNet defaults)
+ANIMAL_PREFILTER_MEAN = [float(v) for v in os.getenv('ANIMAL_PREFILTER_MEAN', '0.485,0.456,0.406').split(',')]
+ANIMAL_PREFILTER_STD = [float(v) for v in os.getenv('ANIMAL_PREFILTER_STD', '0.229,0.224,0.225').split(',')]
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+class _OnnxBackend:
+    def __init__(self, path, threads):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_shape = model_input.shape
+        # A symbolic or -1 leading dimension means the model takes whole batches
+        self.dynamic_batch = not isinstance(model_input.shape[0], int) or model_input.shape[0] < 1
+
+    def run(self, batch):
+        # InferenceSession.run is thread-safe
+        return self.session.run(None, {self.input_name: batch})[0]
+
+class _TFLiteBackend:
+    def __init__(self, path, threads):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.interpreter = Interpreter(model_path=path, num_threads=threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.input_shape = list(self.input_detail['shape'])
+        self.dynamic_batch = False
+        self._lock = threading.Lock()
+
+    def run(self, batch):
+        # One interpreter per process; invocations must not overlap
+        with self._lock:
+            self.interpreter.set_tensor(self.input_detail['index'], batch.astype(self.input_detail['dtype']))
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_index).copy()
+
+class AnimalPrefilter:
+    """
+    Warm ONNX Runtime session or TFLite interpreter that scores frames with a
+    probability that they contain an animal. Frames are decoded and resized with PIL,
+    normalized, and scored in batches of up to max_batch when the model has a dynamic
+    batch dimension (one at a time otherwise). Input layout (NCHW or NHWC) and size are
+    read from the model.
+    """
+
+    def __init__(self, path, threshold=ANIMAL_PREFILTER_THRESHOLD, class_index=ANIMAL_PREFILTER_CLASS_INDEX,
+                 threads=ANIMAL_PREFILTER_THREADS, max_batch=ANIMAL_PREFILTER_MAX_BATCH):
+        self.path = path
+        self.threshold = threshold
+        self.class_index = class_index
+        self.max_batch = max_batch
+        if path.endswith('.tflite'):
+            self.backend = _TFLiteBackend(path, threads)
+        else:
+            self.backend = _OnnxBackend(path, threads)
+        shape = self.backend.input_shape
+        self.channels_first = shape[1] == 3
+        self.height, self.width = (shape[2], shape[3]) if self.channels_first else (shape[1], shape[2])
+        self._mean = np.array(ANIMAL_PREFILTER_MEAN, dtype=np.float32)
+        self._std = np.array(ANIMAL_PREFILTER_STD, dtype=np.float32)
+        self.latency = LatencyHistogram()
+        self.scored = 0
+        self.passed = 0
+        self.filtered = 0
+
+    def _preprocess(self, image_bytes):
+        from PIL import Image
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft('RGB', (self.width * 2, self.height * 2))  # JPEG: decode at reduced scale
+        image = image.convert('RGB').resize((self.width, self.height), Image.BILINEAR)
+        pixels = (np.asarray(image, dtype=np.float32) / 255.0 - self._mean) / self._std
+        return pixels.transpose(2, 0, 1) if self.channels_first else pixels
+
+    def _scores(self, output):
+        output = np.asarray(output, dtype=np.float32).reshape(output.shape[0], -1)
+        if output.shape[1] == 1:
+            values = output[:, 0]
+            # Logits are squashed; models that already output a probability are left alone
+            if values.min() < 0 or values.max() > 1:
+                values = 1 / (1 + np.exp(-values))
+            return values
+        probs = output if np.allclose(output.sum(axis=1), 1, atol=1e-3) and output.min() >= 0 else _softmax(output)
+        return probs[:, self.class_index]
+
+    def score_many(self, frames):
+        """Animal probability per frame (image bytes), in input order"""
+        start = time.perf_counter()
+        inputs = np.stack([self._preprocess(frame) for frame in frames]).astype(np.float32)
+        step = self.max_batch if self.backend.dynamic_batch else 1
+        scores = np.concatenate([self._scores(self.backend.run(inputs[i:i + step])) for i in range(0, len(inputs), step)])
+        self.latency.record((time.perf_counter() - start) * 1000)
+        self.scored += len(frames)
+        return [float(score) for score in scores]
+
+    def score(self, frame):
+        return self.score_many([frame])[0]
+
+    def maybe_animal(self, frame):
+        """(passes, score): whether the frame should still go to Cloud Vision"""
+        score = self.score(frame)
+        passes = score >= self.threshold
+        if passes:
+            self.passed += 1
+        else:
+            self.filtered += 1
+        return passes, score
+
+    def stats(self):
+        return OrderedDict([
+            ("model", os.path.basename(self.path)),
+            ("threshold", self.threshold),
+            ("scored", self.scored),
+            ("passed", self.passed),
+            ("filtered", self.filtered),
+            ("latency", self.latency.stats())
+        ])
+
+_prefilter = None
+_prefilter_failed = False
+_prefilter_lock = threading.Lock()
+
+def get_animal_prefilter():
+    """Process-wide AnimalPrefilter, or None when no model is configured or it cannot load"""
+    global _prefilter, _prefilter_failed
+    if not ANIMAL_PREFILTER_MODEL or _prefilter_failed:
+        return None
+    with _prefilter_lock:
+        if _prefilter is None and not _prefilter_failed:
+            try:
+                _prefilter = AnimalPrefilter(ANIMAL_PREFILTER_MODEL)
+                register_metrics('animal_prefilter', _prefilter.stats)
+            except Exception as e:
+                # Missing runtime or a bad model must never block detection; Vision still runs
+                print(f"[PREFILTER] Could not load {ANIMAL_PREFILTER_MODEL}, continuing without it: {e}")
+                _prefilter_failed = True
+        return _prefilter
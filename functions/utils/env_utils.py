@@ -1,27 +1,15 @@
 
-import os
+from utils.settings import get_settings
 
+# Thin wrappers over the memoized Settings; cheap enough to call on every request
 def is_local_environment():
-    env = os.getenv('ENV', os.getenv('ENVIRONMENT', 'production')).lower()
-    print(f"[ENV_UTILS] ENV/ENVIRONMENT: {env}")
-    result = env == 'local'
-    print(f"[ENV_UTILS] is_local_environment: {result}")
-    return result
+    return get_settings().is_local
 
 def is_deployed_environment():
-    env = os.getenv('ENV', os.getenv('ENVIRONMENT', 'production')).lower()
-    print(f"[ENV_UTILS] ENV/ENVIRONMENT: {env}")
-    result = env == 'production'
-    print(f"[ENV_UTILS] is_deployed_environment: {result}")
-    return result
+    return get_settings().is_deployed
 
 def should_import_cloud_services():
-    force_real_api = os.getenv('FORCE_REAL_API', 'false').lower() == 'true'
-    deployed = is_deployed_environment()
-    print(f"[ENV_UTILS] FORCE_REAL_API: {force_real_api}, is_deployed_environment: {deployed}")
-    result = deployed or force_real_api
-    print(f"[ENV_UTILS] should_import_cloud_services: {result}")
-    return result
+    return get_settings().use_cloud_services
 
 class MockHttpsFn:
     class Request:
@@ -0,0 +1,162 @@
+import heapq
+import threading
+from utils.geo_utils import to_unit_vector, chord_to_km, km_to_chord
+
+# Rebuild the tree once pending inserts + stale entries exceed this share of the indexed points
+REBUILD_RATIO = 0.25
+MIN_REBUILD_CHANGES = 32
+
+class _KDNode:
+    __slots__ = ('point', 'key', 'axis', 'left', 'right')
+
+    def __init__(self, point, key, axis, left, right):
+        self.point = point
+        self.key = key
+        self.axis = axis
+        self.left = left
+        self.right = right
+
+def _build(items, depth=0):
+    if not items:
+        return None
+    axis = depth % 3
+    items.sort(key=lambda item: item[1][axis])
+    mid = len(items) // 2
+    key, point = items[mid]
+    return _KDNode(point, key, axis, _build(items[:mid], depth + 1), _build(items[mid + 1:], depth + 1))
+
+def _sq_dist(a, b):
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+class GeoIndex:
+    """
+    In-memory spatial index over lat/lng points keyed by id.
+    Points live on the unit sphere in a 3-d k-d tree, so chord distance orders results
+    exactly like haversine. Upserts and removals go to a small overlay (pending points and
+    tombstones) that is merged into the tree once it grows past REBUILD_RATIO.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._points = {}       # key -> (lat, lng)
+        self._payloads = {}     # key -> payload
+        self._root = None
+        self._tree_keys = set()
+        self._pending = {}      # key -> unit vector, not yet in the tree
+        self._tombstones = set()
+        self._engine = None     # HaversineEngine snapshot, dropped on any change
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def get(self, key):
+        return self._payloads.get(key)
+
+    def upsert(self, key, lat, lng, payload=None):
+        with self._lock:
+            self._payloads[key] = payload
+            if self._points.get(key) == (lat, lng):
+                return
+            self._points[key] = (lat, lng)
+            self._engine = None
+            if key in self._tree_keys:
+                self._tombstones.add(key)
+            self._pending[key] = to_unit_vector(lat, lng)
+            self._maybe_rebuild()
+
+    def remove(self, key):
+        with self._lock:
+            if key not in self._points:
+                return
+            del self._points[key]
+            self._engine = None
+            self._payloads.pop(key, None)
+            self._pending.pop(key, None)
+            if key in self._tree_keys:
+                self._tombstones.add(key)
+            self._maybe_rebuild()
+
+    def rebuild(self):
+        with self._lock:
+            items = [(key, to_unit_vector(lat, lng)) for key, (lat, lng) in self._points.items()]
+            self._root = _build(items)
+            self._tree_keys = set(self._points)
+            self._pending = {}
+            self._tombstones = set()
+
+    def engine(self):
+        """Vectorized HaversineEngine over the current points, for batch/multi-origin queries"""
+        with self._lock:
+            if self._engine is None:
+                from utils.haversine_engine import HaversineEngine
+                keys = list(self._points)
+                self._engine = HaversineEngine(
+                    keys,
+                    [self._points[key][0] for key in keys],
+                    [self._points[key][1] for key in keys]
+                )
+            return self._engine
+
+    def _maybe_rebuild(self):
+        changes = len(self._pending) + len(self._tombstones)
+        if changes > max(MIN_REBUILD_CHANGES, REBUILD_RATIO * len(self._tree_keys)):
+            self.rebuild()
+
+    def nearest(self, lat, lng, k=3):
+        """Return [(key, distance_km)] for the k closest points, nearest first"""
+        if k <= 0:
+            return []
+        target = to_unit_vector(lat, lng)
+        heap = []  # max-heap on squared chord via negation
+        def offer(key, point):
+            d = _sq_dist(point, target)
+            if len(heap) < k:
+                heapq.heappush(heap, (-d, key))
+            elif d < -heap[0][0]:
+                heapq.heapreplace(heap, (-d, key))
+        with self._lock:
+            stack = [self._root] if self._root else []
+            while stack:
+                node = stack.pop()
+                if node.key not in self._tombstones:
+                    offer(node.key, node.point)
+                diff = target[node.axis] - node.point[node.axis]
+                near, far = (node.left, node.right) if diff < 0 else (node.right, node.left)
+                # Visit the far side only if the splitting plane is closer than the current k-th best
+                if far and (len(heap) < k or diff * diff < -heap[0][0]):
+                    stack.append(far)
+                if near:
+                    stack.append(near)
+            for key, point in self._pending.items():
+                offer(key, point)
+        return [(key, chord_to_km(d ** 0.5)) for d, key in sorted((-d, key) for d, key in heap)]
+
+    def within(self, lat, lng, radius_km, limit=None):
+        """Return [(key, distance_km)] for all points within radius_km, nearest first"""
+        target = to_unit_vector(lat, lng)
+        max_chord = km_to_chord(radius_km)
+        max_sq = max_chord * max_chord
+        found = []
+        with self._lock:
+            stack = [self._root] if self._root else []
+            while stack:
+                node = stack.pop()
+                d = _sq_dist(node.point, target)
+                if d <= max_sq and node.key not in self._tombstones:
+                    found.append((d, node.key))
+                diff = target[node.axis] - node.point[node.axis]
+                if node.left and diff - max_chord <= 0:
+                    stack.append(node.left)
+                if node.right and diff + max_chord >= 0:
+                    stack.append(node.right)
+            for key, point in self._pending.items():
+                d = _sq_dist(point, target)
+                if d <= max_sq:
+                    found.append((d, key))
+        found.sort()
+        if limit is not None:
+            found = found[:limit]
+        return [(key, chord_to_km(d ** 0.5)) for d, key in found]
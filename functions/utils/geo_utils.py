@@ -0,0 +1,23 @@
+import math
+
+EARTH_RADIUS_KM = 6371
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km between two lat/lng points"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def to_unit_vector(lat, lng):
+    """Project lat/lng onto the unit sphere; chord length is monotonic in great-circle distance"""
+    phi, lam = math.radians(lat), math.radians(lng)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+def chord_to_km(chord):
+    return EARTH_RADIUS_KM * 2 * math.asin(min(1.0, chord / 2))
+
+def km_to_chord(km):
+    return 2 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2)
@@ -0,0 +1,54 @@
+import numpy as np
+from utils.geo_utils import EARTH_RADIUS_KM
+
+def _top_k(distances, k):
+    """Indices of the k smallest distances along the last axis, nearest first, without a full sort"""
+    n = distances.shape[-1]
+    if k <= 0:
+        return np.empty(distances.shape[:-1] + (0,), dtype=np.intp)
+    if k >= n:
+        return np.argsort(distances, axis=-1)
+    idx = np.argpartition(distances, k - 1, axis=-1)[..., :k]
+    order = np.argsort(np.take_along_axis(distances, idx, axis=-1), axis=-1)
+    return np.take_along_axis(idx, order, axis=-1)
+
+class HaversineEngine:
+    """
+    Vectorized haversine distances from an origin to a fixed set of points.
+    Coordinates are held as contiguous float64 radians with cos(lat) precomputed.
+    """
+
+    def __init__(self, keys, lats, lngs):
+        self.keys = list(keys)
+        self.lat_rad = np.radians(np.ascontiguousarray(lats, dtype=np.float64))
+        self.lng_rad = np.radians(np.ascontiguousarray(lngs, dtype=np.float64))
+        self.cos_lat = np.cos(self.lat_rad)
+        if not (len(self.keys) == self.lat_rad.shape[0] == self.lng_rad.shape[0]):
+            raise ValueError("keys, lats and lngs must have the same length")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def distances(self, lat, lng):
+        """Distances in km from a single origin to every point"""
+        phi = np.radians(lat)
+        a = (np.sin((self.lat_rad - phi) / 2) ** 2
+             + np.cos(phi) * self.cos_lat * np.sin((self.lng_rad - np.radians(lng)) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def nearest(self, lat, lng, k=3):
+        """Return [(key, distance_km)] for the k closest points, nearest first"""
+        if k <= 0 or not self.keys:
+            return []
+        d = self.distances(lat, lng)
+        return [(self.keys[i], float(d[i])) for i in _top_k(d, k)]
+
+    def within(self, lat, lng, radius_km, limit=None):
+        """Return [(key, distance_km)] for all points within radius_km, nearest first"""
+        d = self.distances(lat, lng)
+        hits = np.flatnonzero(d <= radius_km)
+        if limit is not None and limit < len(hits):
+            hits = hits[_top_k(d[hits], limit)]
+        else:
+            hits = hits[np.argsort(d[hits])]
+        return [(self.keys[i], float(d[i])) for i in hits]
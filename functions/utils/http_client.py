@@ -0,0 +1,166 @@
+import time
+import random
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+from utils.metrics_utils import LatencyHistogram, register_metrics
+from utils.settings import get_settings
+
+# One pooled keep-alive session per instance for every outbound HTTP call
+RETRY_STATUSES = (429, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+class CircuitOpenError(Exception):
+    """Raised without calling the upstream while its circuit is open"""
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failures` consecutive failed requests (each counted once, after its
+    retries); one half-open trial after `reset_after`
+    """
+
+    def __init__(self, failures=None, reset_after=None):
+        settings = get_settings()
+        self.failures = settings.http_breaker_failures if failures is None else failures
+        self.reset_after = settings.http_breaker_reset if reset_after is None else reset_after
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_after:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record(self, success):
+        with self._lock:
+            self._trial_in_flight = False
+            if success:
+                self.state = 'closed'
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failures:
+                if self.state != 'open':
+                    self.times_opened += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+class _Upstream:
+    __slots__ = ('breaker', 'latency', 'requests', 'errors', 'retries', 'rejected')
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+
+class HttpClient:
+    """
+    Shared requests.Session with per-host connection pools and keep-alive, default
+    (connect, read) timeouts, jittered-backoff retries on connection errors and
+    429/502/503/504, and a circuit breaker plus latency histogram per upstream.
+    Non-idempotent methods (POST, PATCH) are only retried when the caller passes retries.
+    """
+
+    def __init__(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self._requests = requests
+        settings = get_settings()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=settings.http_pool_connections, pool_maxsize=settings.http_pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._upstreams = {}
+        self._lock = threading.Lock()
+
+    def _upstream(self, name):
+        with self._lock:
+            upstream = self._upstreams.get(name)
+            if upstream is None:
+                upstream = self._upstreams[name] = _Upstream()
+            return upstream
+
+    def request(self, method, url, upstream=None, retries=None, timeout=None, **kwargs):
+        """requests-style call; raises CircuitOpenError, or the last error once retries are exhausted"""
+        method = method.upper()
+        name = upstream or urlparse(url).netloc
+        stats = self._upstream(name)
+        settings = get_settings()
+        if retries is None:
+            retries = settings.http_max_retries if method in IDEMPOTENT_METHODS else 0
+        timeout = timeout or (settings.http_connect_timeout, settings.http_read_timeout)
+        if not stats.breaker.allow():
+            stats.rejected += 1
+            raise CircuitOpenError(f"Circuit open for upstream {name}")
+        succeeded = False
+        try:
+            for attempt in range(retries + 1):
+                stats.requests += 1
+                start = time.perf_counter()
+                try:
+                    resp = self.session.request(method, url, timeout=timeout, **kwargs)
+                except self._requests.RequestException:
+                    stats.latency.record((time.perf_counter() - start) * 1000)
+                    stats.errors += 1
+                    if attempt == retries:
+                        raise
+                else:
+                    stats.latency.record((time.perf_counter() - start) * 1000)
+                    failed = resp.status_code >= 500 or resp.status_code == 429
+                    if failed:
+                        stats.errors += 1
+                    if resp.status_code not in RETRY_STATUSES or attempt == retries:
+                        succeeded = not failed
+                        return resp
+                    resp.close()
+                stats.retries += 1
+                time.sleep(random.uniform(0, settings.http_retry_backoff * (2 ** attempt)))
+        finally:
+            # One breaker outcome per logical request, however many attempts it took
+            stats.breaker.record(succeeded)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            upstreams = list(self._upstreams.items())
+        return OrderedDict(
+            (name, OrderedDict([
+                ("requests", u.requests),
+                ("errors", u.errors),
+                ("retries", u.retries),
+                ("rejected", u.rejected),
+                ("circuit", u.breaker.state),
+                ("times_opened", u.breaker.times_opened),
+                ("latency", u.latency.stats())
+            ]))
+            for name, u in upstreams
+        )
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+def get_http_client():
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HttpClient()
+            register_metrics('http_client', _http_client.stats)
+        return _http_client
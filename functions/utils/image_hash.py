@@ -0,0 +1,97 @@
+import io
+import numpy as np
+from PIL import Image, ImageOps
+
+HASH_SIZE = 8
+PHASH_IMAGE_SIZE = 32
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+
+# Only the low-frequency HASH_SIZE rows of the DCT basis are ever needed
+_PHASH_DCT = _dct_matrix(PHASH_IMAGE_SIZE)[:HASH_SIZE]
+
+def _open_image(image):
+    """Decode bytes and apply EXIF orientation; PIL images are assumed to be oriented already"""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        # Re-encoded WhatsApp copies have the EXIF rotation baked into the pixels
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(image)))
+    return image
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+def phash(image):
+    """64-bit DCT perceptual hash of image bytes or a PIL image"""
+    gray = _open_image(image).convert('L').resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.LANCZOS, reducing_gap=2.0)
+    pixels = np.asarray(gray, dtype=np.float64)
+    dct = _PHASH_DCT @ pixels @ _PHASH_DCT.T
+    # Compare against the median excluding the DC term, which only carries overall brightness
+    median = np.median(dct.flatten()[1:])
+    return _bits_to_int(dct > median)
+
+def dhash(image):
+    """64-bit difference hash of image bytes or a PIL image"""
+    gray = _open_image(image).convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS, reducing_gap=2.0)
+    pixels = np.asarray(gray, dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes for Hamming-radius lookups"""
+
+    def __init__(self):
+        self._root = None  # [hash, values, {distance: child}]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, item_hash, value):
+        self.size += 1
+        if self._root is None:
+            self._root = [item_hash, [value], {}]
+            return
+        node = self._root
+        while True:
+            d = hamming_distance(item_hash, node[0])
+            if d == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [item_hash, [value], {}]
+                return
+            node = child
+
+    def items(self):
+        """Yield (hash, value) for every stored value"""
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            for value in node[1]:
+                yield node[0], value
+            stack.extend(node[2].values())
+
+    def search(self, item_hash, max_distance):
+        """Return [(distance, value)] within max_distance, closest first"""
+        found = []
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            d = hamming_distance(item_hash, node[0])
+            if d <= max_distance:
+                found.extend((d, value) for value in node[1])
+            # Triangle inequality: only children at distance d +/- max_distance can match
+            for child_d, child in node[2].items():
+                if d - max_distance <= child_d <= d + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
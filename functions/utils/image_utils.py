@@ -0,0 +1,89 @@
+import io
+import os
+import time
+import threading
+from PIL import Image, ImageOps
+
+IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', '1600'))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
+IMAGE_THUMBNAIL_EDGE = int(os.getenv('IMAGE_THUMBNAIL_EDGE', '256'))
+EXIF_ORIENTATION_TAG = 0x0112
+
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "passthrough": 0, "bytes_in": 0, "bytes_out": 0, "total_ms": 0.0}
+
+class NormalizedImage:
+    """
+    Result of normalize_image. `data` is the JPEG buffer every downstream consumer
+    (storage, Vision, Gemini) should share; `image` is the decoded, oriented PIL image.
+    """
+    __slots__ = ('data', 'thumbnail', 'image', 'width', 'height', 'original_size', 'elapsed_ms')
+
+    def __init__(self, data, thumbnail, image, width, height, original_size, elapsed_ms):
+        self.data = data
+        self.thumbnail = thumbnail
+        self.image = image
+        self.width = width
+        self.height = height
+        self.original_size = original_size
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def bytes_saved(self):
+        return self.original_size - len(self.data)
+
+def _encode_jpeg(image, quality):
+    buf = io.BytesIO()
+    image.save(buf, format='JPEG', quality=quality, optimize=True)
+    return buf.getvalue()
+
+def _record(original_size, output_size, elapsed_ms, passthrough=False):
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["passthrough"] += int(passthrough)
+        _stats["bytes_in"] += original_size
+        _stats["bytes_out"] += output_size
+        _stats["total_ms"] += elapsed_ms
+
+def normalize_image(image_bytes, max_edge=IMAGE_MAX_EDGE, quality=IMAGE_JPEG_QUALITY, thumbnail_edge=IMAGE_THUMBNAIL_EDGE):
+    """
+    Decode once, apply EXIF orientation, downsize to max_edge and re-encode as JPEG.
+    Images Pillow cannot decode are passed through unchanged (image and thumbnail are None).
+    """
+    start = time.perf_counter()
+    try:
+        source = Image.open(io.BytesIO(image_bytes))
+        source_format = source.format
+        scale = max_edge / max(source.size)
+        if source_format == 'JPEG' and scale < 1:
+            # Let libjpeg decode at a reduced DCT scale instead of full resolution
+            source.draft('RGB', (int(source.width * scale), int(source.height * scale)))
+        rotated = source.getexif().get(EXIF_ORIENTATION_TAG, 1) != 1
+        image = ImageOps.exif_transpose(source) if rotated else source
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        resized = max(image.size) > max_edge
+        if resized:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        data = _encode_jpeg(image, quality)
+        # Already-small JPEGs that needed no rotation or resize keep their original bytes
+        if source_format == 'JPEG' and not rotated and not resized and len(data) >= len(image_bytes):
+            data = image_bytes
+        thumb = image.copy()
+        thumb.thumbnail((thumbnail_edge, thumbnail_edge), Image.LANCZOS)
+        thumbnail = _encode_jpeg(thumb, quality)
+    except Exception as e:
+        print(f"[IMAGE_UTILS] Could not normalize image, passing through original bytes: {e}")
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        _record(len(image_bytes), len(image_bytes), elapsed_ms, passthrough=True)
+        return NormalizedImage(image_bytes, None, None, None, None, len(image_bytes), elapsed_ms)
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+    _record(len(image_bytes), len(data), elapsed_ms)
+    return NormalizedImage(data, thumbnail, image, image.width, image.height, len(image_bytes), elapsed_ms)
+
+def image_normalization_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+    stats["avg_ms"] = round(stats["total_ms"] / stats["images"], 1) if stats["images"] else None
+    return stats
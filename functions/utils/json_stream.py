@@ -0,0 +1,70 @@
+import json
+from collections import OrderedDict
+
+class IncrementalObjectParser:
+    """
+    Incremental parser for a single streamed JSON object.
+    feed() returns the (key, value) pairs of top-level members that became complete in
+    that chunk, so callers can forward them before the rest of the object arrives.
+    Text before the opening brace (e.g. a ```json fence) and after the closing one is ignored.
+    """
+
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self._member_start = None
+        self.done = False
+        self.result = OrderedDict()
+
+    def feed(self, chunk):
+        self._text += chunk
+        text = self._text
+        members = []
+        i = self._pos
+        while i < len(text) and not self.done:
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif not self._started:
+                if c == '{':
+                    self._started = True
+                    self._depth = 1
+                    self._member_start = i + 1
+            elif c == '"':
+                self._in_string = True
+            elif c in '{[':
+                self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete_member(text[self._member_start:i], members)
+                    self.done = True
+            elif c == ',' and self._depth == 1:
+                self._complete_member(text[self._member_start:i], members)
+                self._member_start = i + 1
+            i += 1
+        self._pos = i
+        return members
+
+    def _complete_member(self, member_text, members):
+        if not member_text.strip():
+            return
+        member = json.loads('{' + member_text + '}', object_pairs_hook=OrderedDict)
+        for key, value in member.items():
+            self.result[key] = value
+            members.append((key, value))
+
+    def close(self):
+        """Return the full parsed object, raising ValueError if the stream ended early"""
+        if not self.done:
+            raise ValueError("Incomplete JSON object in stream")
+        return self.result
@@ -0,0 +1,146 @@
+from collections import OrderedDict, deque
+
+# Built-in keyword sets. Each set maps a class to its keywords (synonyms or taxa that
+# should report as that class) with an optional per-class confidence threshold.
+# match='contains': keyword found inside the label; match='either': also a label that is
+# itself part of a keyword (e.g. label "Ox" for keyword "ox").
+ANIMAL_KEYWORDS = [
+    "cow", "buffalo", "bull", "ox", "boar", "nilgai", "goat", "pig", "deer",
+    "bovinae", "livestock", "herd", "cattle", "animal"
+]
+AGRICULTURAL_KEYWORDS = ['plant', 'leaf', 'disease', 'fungus', 'spot', 'yellow', 'brown', 'white']
+DEFAULT_LABEL_SETS = {
+    'animals': {
+        'match': 'either',
+        'threshold': 0.6,
+        'classes': {keyword: {'keywords': [keyword]} for keyword in ANIMAL_KEYWORDS}
+    },
+    'agricultural': {
+        'match': 'contains',
+        'threshold': 0.0,
+        'classes': {keyword: {'keywords': [keyword]} for keyword in AGRICULTURAL_KEYWORDS}
+    }
+}
+
+LABEL_MEMO_SIZE = 8192
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton: every keyword occurring in a text, overlaps included, in one scan"""
+
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for keyword in keywords:
+            self._insert(keyword)
+        self._link()
+
+    def _insert(self, keyword):
+        state = 0
+        for char in keyword:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        if keyword not in self._out[state]:
+            self._out[state] += (keyword,)
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                # Depth-one states fail back to the root, not to themselves
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def find(self, text):
+        found = set()
+        state = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+class LabelClassifier:
+    """
+    Classifies Vision labels against several keyword sets at once. All keywords of all
+    sets share one automaton, so each label description is scanned a single time; the
+    reverse containment needed by match='either' sets is a lookup in a precomputed
+    substring table. A label counts for a class when its score reaches the class threshold.
+    """
+
+    def __init__(self, label_sets=None):
+        self.label_sets = label_sets or DEFAULT_LABEL_SETS
+        self._targets = {}     # keyword -> [(set, class)] for keywords found inside labels
+        self._reverse = {}     # substring of an 'either' keyword -> [(set, class)]
+        self._thresholds = {}  # (set, class) -> threshold
+        self._order = {}       # (set, class) -> position, to report classes in config order
+        for set_name, spec in self.label_sets.items():
+            default_threshold = float(spec.get('threshold', 0.0))
+            either = spec.get('match', 'contains') == 'either'
+            for class_name, class_spec in spec.get('classes', {}).items():
+                target = (set_name, class_name)
+                self._thresholds[target] = float(class_spec.get('threshold', default_threshold))
+                self._order[target] = len(self._order)
+                for keyword in class_spec.get('keywords', [class_name]):
+                    keyword = keyword.lower()
+                    if not keyword:
+                        continue
+                    self._targets.setdefault(keyword, []).append(target)
+                    if either:
+                        for start in range(len(keyword)):
+                            for end in range(start + 1, len(keyword) + 1):
+                                self._reverse.setdefault(keyword[start:end], []).append(target)
+        self._automaton = KeywordAutomaton(self._targets)
+        # Vision's label vocabulary is small, so matches are memoized per description
+        self._memo = {}
+
+    def _match(self, description):
+        matched = self._memo.get(description)
+        if matched is not None:
+            return matched
+        text = description.lower()
+        targets = set()
+        for keyword in self._automaton.find(text):
+            targets.update(self._targets[keyword])
+        targets.update(self._reverse.get(text, ()))
+        matched = tuple(sorted(targets, key=self._order.__getitem__))
+        if len(self._memo) >= LABEL_MEMO_SIZE:
+            self._memo.clear()
+        self._memo[description] = matched
+        return matched
+
+    def classify(self, labels):
+        """
+        Match Vision labels (objects with description and score) against every set.
+        Returns {set: {'classes': {class: max score}, 'labels': [matching labels]}}.
+        """
+        results = OrderedDict(
+            (set_name, {'classes': OrderedDict(), 'labels': []}) for set_name in self.label_sets
+        )
+        for label in labels:
+            score = float(label.score)
+            matched_sets = set()
+            for set_name, class_name in self._match(label.description):
+                if score < self._thresholds[(set_name, class_name)]:
+                    continue
+                classes = results[set_name]['classes']
+                classes[class_name] = max(classes.get(class_name, 0), score)
+                matched_sets.add(set_name)
+            for set_name in matched_sets:
+                results[set_name]['labels'].append(label)
+        return results
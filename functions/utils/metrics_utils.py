@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from utils.settings import get_settings
+
+# name -> zero-arg callable returning a JSON-serializable dict
+_metric_providers = OrderedDict()
+
+def register_metrics(name, provider):
+    """Register a stats provider (e.g. a cache's stats method) under a name"""
+    _metric_providers[name] = provider
+
+def collect_metrics():
+    metrics = OrderedDict()
+    for name, provider in _metric_providers.items():
+        try:
+            metrics[name] = provider()
+        except Exception as e:
+            metrics[name] = {"error": str(e)}
+    return metrics
+
+# Deployed, every function has its own instances and /ping?metrics=true only reaches the ping
+# function's. Each instance therefore also prints its metrics as one structured (JSON) log line,
+# at most every METRICS_LOG_INTERVAL seconds and only after a request, since no CPU is left
+# for a background timer. Cloud Logging indexes the fields for log-based metrics.
+_metrics_logged_at = time.monotonic()
+_metrics_log_lock = threading.Lock()
+
+def log_metrics_if_due():
+    """Print this instance's metrics as a structured log line if the interval has passed"""
+    global _metrics_logged_at
+    interval = get_settings().metrics_log_interval
+    if interval <= 0 or not _metric_providers:
+        return False
+    now = time.monotonic()
+    with _metrics_log_lock:
+        if now - _metrics_logged_at < interval:
+            return False
+        _metrics_logged_at = now
+    print(json.dumps({
+        "severity": "INFO",
+        "message": "[METRICS] instance metrics",
+        "function": os.getenv('K_SERVICE') or os.getenv('FUNCTION_TARGET') or 'local',
+        "metrics": collect_metrics()
+    }, default=str))
+    return True
+
+# Upper bounds in milliseconds; the last bucket catches everything slower
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with count/sum/max and bucket-resolution percentiles"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed_ms):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if elapsed_ms <= bound:
+                    self.counts[i] += 1
+                    break
+            self.count += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (max_ms for the overflow bucket)"""
+        if not self.count:
+            return None
+        target = p / 100 * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return self.max_ms if bound == float('inf') else bound
+        return self.max_ms
+
+    def stats(self):
+        with self._lock:
+            return OrderedDict([
+                ("count", self.count),
+                ("avg_ms", round(self.total_ms / self.count, 1) if self.count else None),
+                ("max_ms", round(self.max_ms, 1)),
+                ("p50_ms", self.percentile(50)),
+                ("p95_ms", self.percentile(95)),
+                ("p99_ms", self.percentile(99)),
+                ("buckets", OrderedDict(
+                    ("le_inf" if bound == float('inf') else f"le_{bound}", n)
+                    for bound, n in zip(self.buckets, self.counts)
+                ))
+            ])
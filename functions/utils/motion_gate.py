@@ -0,0 +1,81 @@
+import io
+import threading
+import numpy as np
+from utils.cache_utils import LRUCache
+from utils.settings import get_settings
+
+# Frames of a static scene are answered without Vision or any writes. Each camera keeps a
+# small grayscale background model; a frame "moved" when enough of its pixels differ.
+# The slow foreground learning rate lets a permanent change (a parked tractor) fade into
+# the background. Thresholds and rates are Settings.motion_*.
+
+def motion_frame(image_bytes, width, height):
+    """Downscaled grayscale float32 frame, with the mean removed so global lighting shifts cancel"""
+    from PIL import Image
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft('L', (width * 4, height * 4))  # JPEG: let the decoder skip most of the work
+    pixels = np.asarray(image.convert('L').resize((width, height), Image.BILINEAR), dtype=np.float32)
+    return pixels - pixels.mean()
+
+class MotionGate:
+    """
+    Per-camera running-average background model over tiny grayscale frames.
+    `check` diffs a frame against its camera's background and updates the model in
+    place (fast for unchanged pixels, slow for changed ones). The first frame of a
+    camera, or the first after its reference expired, always counts as motion.
+    References live in an LRU cache, so memory stays at max_cameras small frames.
+    """
+
+    def __init__(self, max_cameras=None, ttl=None, pixel_threshold=None, min_changed=None):
+        settings = get_settings()
+        self.pixel_threshold = settings.motion_pixel_threshold if pixel_threshold is None else pixel_threshold
+        self.min_changed = settings.motion_min_changed if min_changed is None else min_changed
+        self.frame_size = (settings.motion_frame_width, settings.motion_frame_height)
+        self.background_alpha = settings.motion_background_alpha
+        self.foreground_alpha = settings.motion_foreground_alpha
+        self._backgrounds = LRUCache(settings.motion_tracked_cameras if max_cameras is None else max_cameras,
+                                     ttl=settings.motion_reference_ttl if ttl is None else ttl)
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.static = 0
+
+    def check(self, key, image_bytes):
+        """(moved, changed_fraction) for one frame; changed_fraction is None without a reference"""
+        frame = motion_frame(image_bytes, *self.frame_size)
+        with self._lock:
+            self.frames += 1
+            background = self._backgrounds.get(key)
+            if background is None or background.shape != frame.shape:
+                self._backgrounds.set(key, frame)
+                return True, None
+            changed = np.abs(frame - background) > self.pixel_threshold
+            fraction = float(changed.mean())
+            alpha = np.where(changed, self.foreground_alpha, self.background_alpha).astype(np.float32)
+            background += alpha * (frame - background)
+            # Re-setting refreshes the reference TTL
+            self._backgrounds.set(key, background)
+            moved = fraction >= self.min_changed
+            if not moved:
+                self.static += 1
+            return moved, fraction
+
+    def stats(self):
+        stats = self._backgrounds.stats()
+        stats["frames"] = self.frames
+        stats["static_frames"] = self.static
+        return stats
+
+_motion_gate = None
+_motion_gate_lock = threading.Lock()
+
+def get_motion_gate():
+    """Per-instance MotionGate, or None when MOTION_GATE_ENABLED=false"""
+    global _motion_gate
+    if not get_settings().motion_gate_enabled:
+        return None
+    with _motion_gate_lock:
+        if _motion_gate is None:
+            from utils.metrics_utils import register_metrics
+            _motion_gate = MotionGate()
+            register_metrics('motion_gate', _motion_gate.stats)
+        return _motion_gate
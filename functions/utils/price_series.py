@@ -0,0 +1,180 @@
+import numpy as np
+
+# On-disk/packed layout: one record per day, int32 days since epoch + float32 price
+SERIES_DTYPE = np.dtype([('day', '<i4'), ('price', '<f4')])
+# Local cache layout in the column dtypes PriceSeries works in, so a memory-mapped file
+# is used through views instead of being converted (copied) on load
+SERIES_CACHE_DTYPE = np.dtype([('day', '<M8[D]'), ('price', '<f8')])
+RESAMPLE_UNITS = ('D', 'W', 'M')
+TREND_THRESHOLD_PCT = 2.0
+
+def parse_day(value):
+    """np.datetime64 day for a 'YYYY-MM-DD' string (longer timestamps are truncated); ValueError otherwise"""
+    try:
+        return np.datetime64(str(value)[:10], 'D')
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+
+def _valid_row(row):
+    try:
+        parse_day(row[0])
+        float(row[1])
+        return True
+    except (TypeError, ValueError):
+        return False
+
+class PriceSeries:
+    """
+    Columnar daily price series for one (mandi, crop): sorted datetime64[D] days and
+    float64 prices. Every analytic below is a whole-array NumPy operation.
+    """
+    __slots__ = ('days', 'prices')
+
+    def __init__(self, days, prices):
+        self.days = np.asarray(days, dtype='datetime64[D]')
+        self.prices = np.asarray(prices, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.days)
+
+    @classmethod
+    def from_history(cls, price_history, price_field='modal_price'):
+        """Build from a [{'date': 'YYYY-MM-DD', 'modal_price': ...}] list; later duplicates of a day win"""
+        rows = [(p['date'], p[price_field]) for p in price_history or []
+                if p.get('date') and p.get(price_field) is not None]
+        try:
+            days = np.array([str(d)[:10] for d, _ in rows], dtype='datetime64[D]')
+            prices = np.array([float(v) for _, v in rows], dtype=np.float64)
+        except (TypeError, ValueError):
+            # A malformed stored row must not fail the whole series; drop just that row
+            valid = [row for row in rows if _valid_row(row)]
+            print(f"[PRICE_SERIES] Skipped {len(rows) - len(valid)} malformed price_history rows")
+            rows = valid
+            days = np.array([str(d)[:10] for d, _ in rows], dtype='datetime64[D]')
+            prices = np.array([float(v) for _, v in rows], dtype=np.float64)
+        if not rows:
+            return cls([], [])
+        # Stable sort, then keep the last record for each day
+        order = np.argsort(days, kind='stable')
+        days, prices = days[order], prices[order]
+        last = np.append(days[1:] != days[:-1], True)
+        return cls(days[last], prices[last])
+
+    @classmethod
+    def from_records(cls, records):
+        """From a SERIES_DTYPE or SERIES_CACHE_DTYPE array, e.g. a memory-mapped .npy file"""
+        if records.dtype == SERIES_CACHE_DTYPE:
+            # Field views keep the memory map; nothing is read until a slice is used
+            return cls(records['day'], records['price'])
+        return cls(records['day'].astype('datetime64[D]'), records['price'])
+
+    def to_records(self, dtype=SERIES_DTYPE):
+        records = np.empty(len(self), dtype=dtype)
+        records['day'] = self.days if dtype == SERIES_CACHE_DTYPE else self.days.astype(np.int64)
+        records['price'] = self.prices
+        return records
+
+    def to_bytes(self):
+        return self.to_records().tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls.from_records(np.frombuffer(data, dtype=SERIES_DTYPE))
+
+    def merge(self, other):
+        """Union of both series; where both have a day, other's price wins"""
+        days = np.concatenate([self.days, other.days])
+        prices = np.concatenate([self.prices, other.prices])
+        order = np.argsort(days, kind='stable')
+        days, prices = days[order], prices[order]
+        last = np.append(days[1:] != days[:-1], True) if len(days) else np.array([], dtype=bool)
+        return PriceSeries(days[last], prices[last])
+
+    def to_history(self, price_field='modal_price'):
+        return [{'date': str(d), price_field: round(float(p), 2)} for d, p in zip(self.days, self.prices)]
+
+    def between(self, start=None, end=None):
+        """Inclusive date-range slice; start/end are 'YYYY-MM-DD' strings or None (ValueError if malformed)"""
+        lo = np.searchsorted(self.days, parse_day(start), 'left') if start else 0
+        hi = np.searchsorted(self.days, parse_day(end), 'right') if end else len(self)
+        return PriceSeries(self.days[lo:hi], self.prices[lo:hi])
+
+    def resample(self, unit='W'):
+        """Mean price per calendar bucket ('D', 'W' starting Monday, 'M'), labelled by bucket start"""
+        if unit not in RESAMPLE_UNITS:
+            raise ValueError(f"resample must be one of: {', '.join(RESAMPLE_UNITS)}")
+        if unit == 'D' or not len(self):
+            return self
+        if unit == 'W':
+            # Day 0 (1970-01-01) was a Thursday; shift so buckets start on Monday
+            ordinal = self.days.astype(np.int64)
+            buckets = ((ordinal + 3) // 7 * 7 - 3).astype('datetime64[D]')
+        else:
+            buckets = self.days.astype('datetime64[M]').astype('datetime64[D]')
+        labels, inverse = np.unique(buckets, return_inverse=True)
+        sums = np.bincount(inverse, weights=self.prices)
+        counts = np.bincount(inverse)
+        return PriceSeries(labels, sums / counts)
+
+    def downsample(self, max_points):
+        """Average consecutive points into at most max_points buckets, keeping each bucket's last date"""
+        n = len(self)
+        if not max_points or n <= max_points:
+            return self
+        starts = (np.arange(max_points) * n) // max_points
+        ends = np.append(starts[1:], n)
+        means = np.add.reduceat(self.prices, starts) / (ends - starts)
+        return PriceSeries(self.days[ends - 1], means)
+
+    def moving_average(self, window=7):
+        """Trailing mean over `window` points; NaN until the window fills"""
+        out = np.full(len(self), np.nan)
+        if window <= 0 or len(self) < window:
+            return out
+        csum = np.cumsum(np.insert(self.prices, 0, 0.0))
+        out[window - 1:] = (csum[window:] - csum[:-window]) / window
+        return out
+
+    def volatility(self, window=None):
+        """Std of daily log returns (percent) over the last `window` points, or all of them"""
+        prices = self.prices if not window else self.prices[-(window + 1):]
+        prices = prices[prices > 0]
+        if len(prices) < 3:
+            return None
+        return float(np.std(np.diff(np.log(prices)), ddof=1) * 100)
+
+    def change_pct(self):
+        if len(self) < 2 or self.prices[0] == 0:
+            return None
+        return float((self.prices[-1] - self.prices[0]) / self.prices[0] * 100)
+
+    def forecast(self, horizon_days=7, lookback=30):
+        """Least-squares linear fit over the last `lookback` points, projected horizon_days past the last day"""
+        if len(self) < 3:
+            return None
+        days = self.days[-lookback:].astype(np.int64)
+        prices = self.prices[-lookback:]
+        x = (days - days[-1]).astype(np.float64)
+        slope, intercept = np.polyfit(x, prices, 1)
+        predicted = intercept + slope * horizon_days
+        return {
+            'date': str(self.days[-1] + np.timedelta64(horizon_days, 'D')),
+            'price': round(float(max(predicted, 0.0)), 2),
+            'slope_per_day': round(float(slope), 4)
+        }
+
+    def trend(self, lookback=30, threshold_pct=TREND_THRESHOLD_PCT):
+        """'rising', 'falling' or 'stable' from the fitted slope across the lookback span"""
+        fit = self.forecast(horizon_days=0, lookback=lookback)
+        if fit is None:
+            return None
+        window = self.days[-lookback:].astype(np.int64)
+        mean = float(np.mean(self.prices[-lookback:]))
+        if mean <= 0:
+            return 'stable'
+        change = fit['slope_per_day'] * (window[-1] - window[0]) / mean * 100
+        if change > threshold_pct:
+            return 'rising'
+        if change < -threshold_pct:
+            return 'falling'
+        return 'stable'
@@ -35,4 +35,25 @@ def create_success_response(request_id, data=None):
         ("requestId", request_id),
         ("data", data or {})
     ])
-    return ordered_json_response(resp)
\ No newline at end of file
+    return ordered_json_response(resp)
+
+STREAM_MIMETYPES = {
+    'sse': 'text/event-stream',
+    'ndjson': 'application/x-ndjson'
+}
+
+def format_stream_event(event, data, stream_format='sse'):
+    if stream_format == 'ndjson':
+        return json.dumps(OrderedDict([("event", event), ("data", data)]), ensure_ascii=False) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_response(events, stream_format='sse'):
+    """Stream (event, data) pairs as server-sent events or NDJSON (Flask only)"""
+    def generate():
+        for event, data in events:
+            yield format_stream_event(event, data, stream_format)
+    response = Response(generate(), mimetype=STREAM_MIMETYPES[stream_format])
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,123 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from utils.metrics_utils import register_metrics
+from utils.settings import get_settings
+
+# Cloud clients are created on first use and memoized per process, so an entry point only
+# pays for the SDKs its handler actually touches (ping and the static endpoints pay none)
+
+class ServiceRegistry:
+    """Named zero-arg factories, each run once on first get() and memoized; records init time"""
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._init_ms = OrderedDict()
+        # Re-entrant: factories fetch the services they depend on (e.g. firebase_app)
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def register_once(self, name, factory):
+        """Register unless a factory already exists under name (for per-argument services)"""
+        with self._lock:
+            if name not in self._factories:
+                self._factories[name] = factory
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                start = time.perf_counter()
+                instance = self._factories[name]()
+                self._init_ms[name] = round((time.perf_counter() - start) * 1000, 1)
+                self._instances[name] = instance
+            return instance
+
+    def override(self, name, instance):
+        """Install a ready-made instance, e.g. a fake client in tests"""
+        with self._lock:
+            self._instances[name] = instance
+
+    def reset(self, name=None):
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+    def stats(self):
+        return OrderedDict([
+            ("registered", sorted(self._factories)),
+            ("initialized_ms", OrderedDict(self._init_ms))
+        ])
+
+def _firebase_app():
+    import firebase_admin
+    if firebase_admin._apps:
+        return firebase_admin.get_app()
+    return firebase_admin.initialize_app(options={
+        "storageBucket": get_settings().bucket_name,
+        "databaseURL": get_settings().firebase_database_url
+    })
+
+def _firestore():
+    registry.get('firebase_app')
+    from firebase_admin import firestore
+    return firestore.client()
+
+def _realtime_db():
+    registry.get('firebase_app')
+    from firebase_admin import db
+    return db
+
+def _vision():
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient()
+
+def _genai():
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv('GEMINI_API_KEY', 'gemini-api-key'))
+    return genai
+
+registry = ServiceRegistry()
+registry.register('firebase_app', _firebase_app)
+registry.register('firestore', _firestore)
+registry.register('realtime_db', _realtime_db)
+registry.register('vision', _vision)
+registry.register('genai', _genai)
+register_metrics('services', registry.stats)
+
+def get_firestore():
+    return registry.get('firestore')
+
+def get_realtime_db():
+    """firebase_admin.db, with the app initialized; use .reference(path)"""
+    return registry.get('realtime_db')
+
+def get_vision_client():
+    return registry.get('vision')
+
+def get_gemini_model(name=None):
+    name = name or get_settings().gemini_model
+    key = f'gemini_model:{name}'
+    registry.register_once(key, lambda: registry.get('genai').GenerativeModel(name))
+    return registry.get(key)
+
+def get_storage_bucket(name=None):
+    name = name or get_settings().bucket_name
+    key = f'storage_bucket:{name}'
+    def bucket():
+        registry.get('firebase_app')
+        from firebase_admin import storage
+        return storage.bucket(name)
+    registry.register_once(key, bucket)
+    return registry.get(key)
@@ -0,0 +1,303 @@
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, replace
+
+# Process-wide configuration, read from the environment once and then immutable.
+# Code that needs one of these values calls get_settings() when it runs (not at import),
+# so override_settings() in tests reaches it. Collection names, model paths and image
+# encoding parameters of single modules stay module constants.
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+def _flag(environ, name, default):
+    return environ.get(name, default).lower() == 'true'
+
+def _list(environ, name, default):
+    value = environ.get(name)
+    return default if value is None else tuple(item.strip() for item in value.split(',') if item.strip())
+
+@dataclass(frozen=True)
+class Settings:
+    # Environment
+    env: str = 'production'
+    force_real_api: bool = False
+    log_level: str = 'INFO'
+    # Cloud resources
+    # Baseline default of the diagnosis image uploads; set GCS_BUCKET in every deployment
+    bucket_name: str = 'cropmind-89afe.appspot.com'
+    firebase_database_url: str = 'https://cropmind-89afe-default-rtdb.asia-southeast1.firebasedatabase.app'
+    gemini_model: str = 'gemini-1.5-flash'
+    weather_api_url: str = 'https://ape.peat-cloud.com/v2/weather'
+    # Secret: only ever from the environment (WEATHER_API_KEY)
+    weather_api_key: str = ''
+    # Feature flags
+    diagnosis_cache_enabled: bool = True
+    # Off by default: deployed functions lose CPU once the response is sent, so a background
+    # writer may not run until the next request (or ever). Enable for local / always-on hosts.
+    write_behind_enabled: bool = False
+    # Off by default for the same reason; /tmp journals and retry timers die with the instance
+    notify_async_enabled: bool = False
+    incident_aggregation_enabled: bool = True
+    profile_cache_enabled: bool = True
+    weather_cache_enabled: bool = True
+    motion_gate_enabled: bool = True
+    # Timeouts (seconds)
+    http_connect_timeout: float = 3.05
+    http_read_timeout: float = 10.0
+    weather_api_timeout: float = 10.0
+    mandi_index_load_timeout: float = 10.0
+    # Cache sizes (entries)
+    diagnosis_cache_size: int = 256
+    profile_cache_size: int = 4096
+    weather_cache_size: int = 2048
+    mandi_view_cache_size: int = 4096
+    # Concurrency limits
+    diagnosis_max_workers: int = 8
+    batch_gemini_concurrency: int = 4
+    notify_workers: int = 4
+    write_behind_task_workers: int = 4
+    http_pool_maxsize: int = 20
+    # Observability: seconds between structured metrics log lines per instance, 0 disables
+    metrics_log_interval: float = 60.0
+    # Diagnosis pipeline. 'concurrent' overlaps the storage upload with Vision + Gemini,
+    # 'sequential' runs them one by one. skip_vision saves the Vision round trip at a quality
+    # cost: the Gemini prompt loses the label context that steers it towards visible symptoms.
+    diagnosis_execution_mode: str = 'concurrent'
+    diagnosis_skip_vision: bool = False
+    batch_max_images: int = 50
+    # Diagnosis cache: TTL and the optional shared tier, 'none', 'firestore' or 'disk'
+    diagnosis_cache_ttl: int = 7 * 24 * 3600
+    diagnosis_cache_shared: str = 'none'
+    diagnosis_cache_collection: str = 'diagnosis_cache'
+    diagnosis_cache_dir: str = '/tmp/cropmind_diagnosis_cache'
+    diagnosis_cache_disk_max_entries: int = 5000
+    # Near-duplicate reuse: same user + crop + language, perceptual hash within max distance, inside the window
+    near_duplicate_enabled: bool = True
+    near_duplicate_hash: str = 'phash'
+    near_duplicate_max_distance: int = 6
+    near_duplicate_window: int = 6 * 3600
+    near_duplicate_max_groups: int = 1024
+    # Recent-history cache, off by default: it only sees saves made by its own instance, and
+    # deployed, diagnose and history are separate functions
+    history_cache_enabled: bool = False
+    history_cache_depth: int = 50
+    history_cache_users: int = 1000
+    history_cache_ttl: int = 300
+    # Mandi index: re-stream after the TTL when the snapshot listener is unavailable; 'kdtree'
+    # walks the geo index, 'numpy' scans every mandi with the vectorized HaversineEngine.
+    # Crop prices come from the mandi listener ('mandis') or the crop_prices collection.
+    mandi_index_ttl: float = 600.0
+    mandi_nearest_backend: str = 'kdtree'
+    crop_price_index_source: str = 'mandis'
+    # Weather: answered per geohash cell (precision 5 is ~4.9 km), cached stale-while-revalidate
+    weather_geohash_precision: int = 5
+    weather_cache_ttl: int = 600
+    weather_cache_stale_ttl: int = 1800
+    # Outbound HTTP: retries with jittered backoff, and the failed requests that open an
+    # upstream's circuit and how long it stays open
+    http_pool_connections: int = 10
+    http_max_retries: int = 2
+    http_retry_backoff: float = 0.3
+    http_breaker_failures: int = 5
+    http_breaker_reset: float = 30.0
+    # Write-behind queue; enqueue_timeout is how long a request waits for queue space before
+    # writing synchronously itself
+    write_behind_queue_size: int = 1000
+    write_behind_linger: float = 0.1
+    write_behind_max_retries: int = 5
+    write_behind_backoff: float = 0.5
+    write_behind_enqueue_timeout: float = 0.05
+    # Alert notifications. In asynchronous mode a job every channel failed on is re-queued after
+    # retry_backoff * 2^attempt seconds, up to max_attempts deliveries; the same recipient and
+    # alert key is sent once per dedup window, and a farmer gets at most rate_limit alerts per
+    # rate_window seconds
+    notify_api_url: str = 'https://api-indwreiyca-uc.a.run.app'
+    notify_channels: tuple = ('whatsapp', 'sms')
+    notify_queue_dir: str = '/tmp/cropmind_notifications'
+    notify_queue_size: int = 500
+    notify_max_retries: int = 2
+    notify_max_attempts: int = 5
+    notify_retry_backoff: float = 30.0
+    notify_dedup_window: int = 300
+    notify_rate_limit: int = 5
+    notify_rate_window: int = 3600
+    notify_status_collection: str = 'animal_detections'
+    # Animal detection: one incident per camera per window; a byte-identical re-sent frame
+    # reuses the last Vision result
+    incident_window: int = 120
+    incident_tracked_cameras: int = 4096
+    frame_reuse_enabled: bool = True
+    # Motion gate: frames are compared as small grayscale thumbnails against a running
+    # background; a frame moved when more than min_changed of its pixels differ by more than
+    # pixel_threshold. Pixels that look like foreground blend in more slowly.
+    motion_frame_width: int = 48
+    motion_frame_height: int = 36
+    motion_pixel_threshold: float = 25.0
+    motion_min_changed: float = 0.01
+    motion_background_alpha: float = 0.05
+    motion_foreground_alpha: float = 0.005
+    motion_tracked_cameras: int = 1024
+    motion_reference_ttl: int = 900
+    # Farm/farmer profiles: the TTL bounds staleness. The optional listener watches the whole
+    # collection, so every instance would read every profile; it is off by default.
+    profile_cache_ttl: int = 300
+    profile_cache_negative_ttl: int = 300
+    profile_cache_watch: bool = False
+
+    @classmethod
+    def from_env(cls, environ=None):
+        environ = os.environ if environ is None else environ
+        d = cls()
+        return cls(
+            env=environ.get('ENV', environ.get('ENVIRONMENT', d.env)).lower(),
+            force_real_api=_flag(environ, 'FORCE_REAL_API', 'false'),
+            log_level=environ.get('LOG_LEVEL', d.log_level).upper(),
+            bucket_name=environ.get('GCS_BUCKET', d.bucket_name),
+            firebase_database_url=environ.get('FIREBASE_DATABASE_URL', d.firebase_database_url),
+            gemini_model=environ.get('GEMINI_MODEL', d.gemini_model),
+            weather_api_url=environ.get('WEATHER_API_URL', d.weather_api_url),
+            weather_api_key=environ.get('WEATHER_API_KEY', d.weather_api_key),
+            diagnosis_cache_enabled=_flag(environ, 'DIAGNOSIS_CACHE_ENABLED', 'true'),
+            write_behind_enabled=_flag(environ, 'WRITE_BEHIND_ENABLED', 'false'),
+            notify_async_enabled=_flag(environ, 'NOTIFY_ASYNC_ENABLED', 'false'),
+            incident_aggregation_enabled=_flag(environ, 'INCIDENT_AGGREGATION_ENABLED', 'true'),
+            profile_cache_enabled=_flag(environ, 'PROFILE_CACHE_ENABLED', 'true'),
+            weather_cache_enabled=_flag(environ, 'WEATHER_CACHE_ENABLED', 'true'),
+            motion_gate_enabled=_flag(environ, 'MOTION_GATE_ENABLED', 'true'),
+            http_connect_timeout=float(environ.get('HTTP_CONNECT_TIMEOUT', d.http_connect_timeout)),
+            http_read_timeout=float(environ.get('HTTP_READ_TIMEOUT', d.http_read_timeout)),
+            weather_api_timeout=float(environ.get('WEATHER_API_TIMEOUT', d.weather_api_timeout)),
+            mandi_index_load_timeout=float(environ.get('MANDI_INDEX_LOAD_TIMEOUT', d.mandi_index_load_timeout)),
+            diagnosis_cache_size=int(environ.get('DIAGNOSIS_CACHE_SIZE', d.diagnosis_cache_size)),
+            profile_cache_size=int(environ.get('PROFILE_CACHE_SIZE', d.profile_cache_size)),
+            weather_cache_size=int(environ.get('WEATHER_CACHE_SIZE', d.weather_cache_size)),
+            mandi_view_cache_size=int(environ.get('MANDI_VIEW_CACHE_SIZE', d.mandi_view_cache_size)),
+            diagnosis_max_workers=int(environ.get('DIAGNOSIS_MAX_WORKERS', d.diagnosis_max_workers)),
+            batch_gemini_concurrency=int(environ.get('BATCH_GEMINI_CONCURRENCY', d.batch_gemini_concurrency)),
+            notify_workers=int(environ.get('NOTIFY_WORKERS', d.notify_workers)),
+            write_behind_task_workers=int(environ.get('WRITE_BEHIND_TASK_WORKERS', d.write_behind_task_workers)),
+            http_pool_maxsize=int(environ.get('HTTP_POOL_MAXSIZE', d.http_pool_maxsize)),
+            metrics_log_interval=float(environ.get('METRICS_LOG_INTERVAL', d.metrics_log_interval)),
+            diagnosis_execution_mode=environ.get('DIAGNOSIS_EXECUTION_MODE', d.diagnosis_execution_mode).lower(),
+            diagnosis_skip_vision=_flag(environ, 'DIAGNOSIS_SKIP_VISION', 'false'),
+            batch_max_images=int(environ.get('BATCH_MAX_IMAGES', d.batch_max_images)),
+            diagnosis_cache_ttl=int(environ.get('DIAGNOSIS_CACHE_TTL', d.diagnosis_cache_ttl)),
+            diagnosis_cache_shared=environ.get('DIAGNOSIS_CACHE_SHARED', d.diagnosis_cache_shared).lower(),
+            diagnosis_cache_collection=environ.get('DIAGNOSIS_CACHE_COLLECTION', d.diagnosis_cache_collection),
+            diagnosis_cache_dir=environ.get('DIAGNOSIS_CACHE_DIR', d.diagnosis_cache_dir),
+            diagnosis_cache_disk_max_entries=int(environ.get('DIAGNOSIS_CACHE_DISK_MAX_ENTRIES', d.diagnosis_cache_disk_max_entries)),
+            near_duplicate_enabled=_flag(environ, 'NEAR_DUPLICATE_ENABLED', 'true'),
+            near_duplicate_hash=environ.get('NEAR_DUPLICATE_HASH', d.near_duplicate_hash).lower(),
+            near_duplicate_max_distance=int(environ.get('NEAR_DUPLICATE_MAX_DISTANCE', d.near_duplicate_max_distance)),
+            near_duplicate_window=int(environ.get('NEAR_DUPLICATE_WINDOW', d.near_duplicate_window)),
+            near_duplicate_max_groups=int(environ.get('NEAR_DUPLICATE_MAX_GROUPS', d.near_duplicate_max_groups)),
+            history_cache_enabled=_flag(environ, 'HISTORY_CACHE_ENABLED', 'false'),
+            history_cache_depth=int(environ.get('HISTORY_CACHE_DEPTH', d.history_cache_depth)),
+            history_cache_users=int(environ.get('HISTORY_CACHE_USERS', d.history_cache_users)),
+            history_cache_ttl=int(environ.get('HISTORY_CACHE_TTL', d.history_cache_ttl)),
+            mandi_index_ttl=float(environ.get('MANDI_INDEX_TTL', d.mandi_index_ttl)),
+            mandi_nearest_backend=environ.get('MANDI_NEAREST_BACKEND', d.mandi_nearest_backend).lower(),
+            crop_price_index_source=environ.get('CROP_PRICE_INDEX_SOURCE', d.crop_price_index_source).lower(),
+            weather_geohash_precision=int(environ.get('WEATHER_GEOHASH_PRECISION', d.weather_geohash_precision)),
+            weather_cache_ttl=int(environ.get('WEATHER_CACHE_TTL', d.weather_cache_ttl)),
+            weather_cache_stale_ttl=int(environ.get('WEATHER_CACHE_STALE_TTL', d.weather_cache_stale_ttl)),
+            http_pool_connections=int(environ.get('HTTP_POOL_CONNECTIONS', d.http_pool_connections)),
+            http_max_retries=int(environ.get('HTTP_MAX_RETRIES', d.http_max_retries)),
+            http_retry_backoff=float(environ.get('HTTP_RETRY_BACKOFF', d.http_retry_backoff)),
+            http_breaker_failures=int(environ.get('HTTP_BREAKER_FAILURES', d.http_breaker_failures)),
+            http_breaker_reset=float(environ.get('HTTP_BREAKER_RESET', d.http_breaker_reset)),
+            write_behind_queue_size=int(environ.get('WRITE_BEHIND_QUEUE_SIZE', d.write_behind_queue_size)),
+            write_behind_linger=float(environ.get('WRITE_BEHIND_LINGER', d.write_behind_linger)),
+            write_behind_max_retries=int(environ.get('WRITE_BEHIND_MAX_RETRIES', d.write_behind_max_retries)),
+            write_behind_backoff=float(environ.get('WRITE_BEHIND_BACKOFF', d.write_behind_backoff)),
+            write_behind_enqueue_timeout=float(environ.get('WRITE_BEHIND_ENQUEUE_TIMEOUT', d.write_behind_enqueue_timeout)),
+            notify_api_url=environ.get('NOTIFY_API_URL', d.notify_api_url),
+            notify_channels=_list(environ, 'NOTIFY_CHANNELS', d.notify_channels),
+            notify_queue_dir=environ.get('NOTIFY_QUEUE_DIR', d.notify_queue_dir),
+            notify_queue_size=int(environ.get('NOTIFY_QUEUE_SIZE', d.notify_queue_size)),
+            notify_max_retries=int(environ.get('NOTIFY_MAX_RETRIES', d.notify_max_retries)),
+            notify_max_attempts=int(environ.get('NOTIFY_MAX_ATTEMPTS', d.notify_max_attempts)),
+            notify_retry_backoff=float(environ.get('NOTIFY_RETRY_BACKOFF', d.notify_retry_backoff)),
+            notify_dedup_window=int(environ.get('NOTIFY_DEDUP_WINDOW', d.notify_dedup_window)),
+            notify_rate_limit=int(environ.get('NOTIFY_RATE_LIMIT', d.notify_rate_limit)),
+            notify_rate_window=int(environ.get('NOTIFY_RATE_WINDOW', d.notify_rate_window)),
+            notify_status_collection=environ.get('NOTIFY_STATUS_COLLECTION', d.notify_status_collection),
+            incident_window=int(environ.get('INCIDENT_WINDOW', d.incident_window)),
+            incident_tracked_cameras=int(environ.get('INCIDENT_TRACKED_CAMERAS', d.incident_tracked_cameras)),
+            frame_reuse_enabled=_flag(environ, 'FRAME_REUSE_ENABLED', 'true'),
+            motion_frame_width=int(environ.get('MOTION_FRAME_WIDTH', d.motion_frame_width)),
+            motion_frame_height=int(environ.get('MOTION_FRAME_HEIGHT', d.motion_frame_height)),
+            motion_pixel_threshold=float(environ.get('MOTION_PIXEL_THRESHOLD', d.motion_pixel_threshold)),
+            motion_min_changed=float(environ.get('MOTION_MIN_CHANGED', d.motion_min_changed)),
+            motion_background_alpha=float(environ.get('MOTION_BACKGROUND_ALPHA', d.motion_background_alpha)),
+            motion_foreground_alpha=float(environ.get('MOTION_FOREGROUND_ALPHA', d.motion_foreground_alpha)),
+            motion_tracked_cameras=int(environ.get('MOTION_TRACKED_CAMERAS', d.motion_tracked_cameras)),
+            motion_reference_ttl=int(environ.get('MOTION_REFERENCE_TTL', d.motion_reference_ttl)),
+            profile_cache_ttl=int(environ.get('PROFILE_CACHE_TTL', d.profile_cache_ttl)),
+            profile_cache_negative_ttl=int(environ.get('PROFILE_CACHE_NEGATIVE_TTL', d.profile_cache_negative_ttl)),
+            profile_cache_watch=_flag(environ, 'PROFILE_CACHE_WATCH', 'false'),
+        )
+
+    @property
+    def is_local(self):
+        return self.env == 'local'
+
+    @property
+    def is_deployed(self):
+        return self.env == 'production'
+
+    @property
+    def use_cloud_services(self):
+        return self.is_deployed or self.force_real_api
+
+    def enabled_for(self, level):
+        return LOG_LEVELS.get(level, 20) >= LOG_LEVELS.get(self.log_level, 20)
+
+_settings = None
+_settings_lock = threading.Lock()
+
+def get_settings():
+    """The process Settings, resolved from the environment on first call"""
+    global _settings
+    settings = _settings
+    if settings is not None:
+        return settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = Settings.from_env()
+            log('DEBUG', 'SETTINGS', 'resolved', **{f.name: getattr(_settings, f.name) for f in fields(Settings)})
+        return _settings
+
+@contextmanager
+def override_settings(**changes):
+    """
+    Temporarily replace fields of the process Settings (for tests). The get_* factories
+    read Settings when called, so feature flags take effect immediately; singletons that
+    were already built keep the sizes and limits they were built with.
+    """
+    global _settings
+    previous = get_settings()
+    with _settings_lock:
+        _settings = replace(previous, **changes)
+    try:
+        yield _settings
+    finally:
+        with _settings_lock:
+            _settings = previous
+
+def reset_settings():
+    """Drop the resolved Settings so the next get_settings() re-reads the environment"""
+    global _settings
+    with _settings_lock:
+        _settings = None
+
+def log(level, tag, message, **fields):
+    """print('[TAG] message key=value ...') when level is at or above LOG_LEVEL"""
+    settings = _settings if _settings is not None else get_settings()
+    if not settings.enabled_for(level):
+        return
+    details = ' '.join(f"{key}={value}" for key, value in fields.items())
+    print(f"[{tag}] {message} {details}" if details else f"[{tag}] {message}")
+
+def debug(tag, message, **fields):
+    log('DEBUG', tag, message, **fields)
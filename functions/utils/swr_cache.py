@@ -0,0 +1,108 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from utils.cache_utils import LRUCache
+from utils.metrics_utils import LatencyHistogram
+
+class _Flight:
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+class StaleWhileRevalidateCache:
+    """
+    Bounded cache for upstream responses. Entries younger than `ttl` are served as-is;
+    entries up to `ttl + stale_ttl` old are served immediately while one background fetch
+    refreshes them. Concurrent fetches for the same key are coalesced into one upstream
+    call. Failed fetches are never cached, and a failed revalidation keeps the stale value.
+    """
+
+    def __init__(self, ttl, stale_ttl, max_size=1024, workers=4):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = LRUCache(max_size=max_size)  # key -> (fetched_at, value)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='swr-revalidate')
+        self.upstream_latency = LatencyHistogram()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.revalidations = 0
+        self.upstream_errors = 0
+
+    def get(self, key, fetch):
+        """Cached value for key, calling fetch() (at most once concurrently per key) when needed"""
+        entry = self._entries.get(key, count=False)
+        if entry is not None:
+            age = time.time() - entry[0]
+            if age <= self.ttl:
+                self.hits += 1
+                return entry[1]
+            if age <= self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._revalidate(key, fetch)
+                return entry[1]
+        self.misses += 1
+        return self._fetch(key, fetch)
+
+    def _revalidate(self, key, fetch):
+        with self._lock:
+            if key in self._inflight:
+                return
+        self.revalidations += 1
+        self._pool.submit(self._fetch, key, fetch, False)
+
+    def _fetch(self, key, fetch, wait=True):
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            if not wait:
+                return None
+            flight.event.wait()
+        else:
+            start = time.perf_counter()
+            try:
+                flight.value = fetch()
+                self._entries.set(key, (time.time(), flight.value))
+            except Exception as e:
+                flight.error = e
+                self.upstream_errors += 1
+                if not wait:
+                    print(f"[SWR_CACHE] Background revalidation of {key} failed, keeping stale value: {e}")
+            finally:
+                self.upstream_latency.record((time.perf_counter() - start) * 1000)
+                with self._lock:
+                    del self._inflight[key]
+                flight.event.set()
+        if flight.error is not None and wait:
+            raise flight.error
+        return flight.value
+
+    def invalidate(self, key):
+        self._entries.pop(key)
+
+    def stats(self):
+        served = self.hits + self.stale_hits + self.misses
+        return OrderedDict([
+            ("size", len(self._entries)),
+            ("hits", self.hits),
+            ("stale_hits", self.stale_hits),
+            ("misses", self.misses),
+            ("hit_ratio", round((self.hits + self.stale_hits) / served, 4) if served else None),
+            ("coalesced", self.coalesced),
+            ("revalidations", self.revalidations),
+            ("upstream_errors", self.upstream_errors),
+            ("inflight", len(self._inflight)),
+            ("upstream_latency", self.upstream_latency.stats())
+        ])
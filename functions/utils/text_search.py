@@ -0,0 +1,176 @@
+import re
+import heapq
+import threading
+import unicodedata
+from collections import Counter
+
+# Candidates re-ranked with edit distance per requested result
+RERANK_FACTOR = 3
+MIN_SCORE = 0.2
+# Trigrams in more than this share of fields (e.g. 'man' in 'mandi') only seed candidates when
+# the query has nothing rarer; the exact overlap is still counted for the shortlist
+COMMON_GRAM_RATIO = 0.05
+MIN_SEED_GRAMS = 2
+_NON_WORD = re.compile(r'[^\w]+', re.UNICODE)
+
+def normalize_text(text):
+    """NFKC, casefold and collapse punctuation/whitespace; Devanagari and Kannada marks are kept"""
+    text = unicodedata.normalize('NFKC', str(text or '')).casefold()
+    return _NON_WORD.sub(' ', text).replace('_', ' ').strip()
+
+def trigrams(text):
+    """Character trigrams of each token, padded so short words and prefixes still match"""
+    grams = set()
+    for token in text.split():
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def edit_distances(query, text, max_distance):
+    """
+    (distance to text, best distance to any prefix of text) in one Levenshtein pass;
+    both are max_distance + 1 once every alignment is already beyond max_distance
+    """
+    previous = list(range(len(text) + 1))
+    for i, qc in enumerate(query, 1):
+        current = [i]
+        append = current.append
+        left = i
+        # Row walk with inline comparisons; min() over three values is the slow part in CPython
+        for tc, diagonal, up in zip(text, previous, previous[1:]):
+            cost = diagonal if qc == tc else diagonal + 1
+            if up < cost:
+                cost = up + 1
+            if left < cost:
+                cost = left + 1
+            append(cost)
+            left = cost
+        if min(current) > max_distance:
+            return max_distance + 1, max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1), min(min(previous), max_distance + 1)
+
+def _token_similarity(query, text):
+    """Best edit-distance similarity of the query against a same-width token window of text, or its prefix"""
+    q_tokens = query.split()
+    tokens = text.split()
+    if not q_tokens or not tokens:
+        return 0.0
+    width = len(q_tokens)
+    best = 0.0
+    for start in range(max(1, len(tokens) - width + 1)):
+        window = ' '.join(tokens[start:start + width])
+        longest = max(len(query), len(window))
+        # Anything under 0.5 similarity is no better than no match, so stop the DP early
+        bound = longest // 2
+        full, prefix = edit_distances(query, window, bound)
+        if full <= bound:
+            best = max(best, 1 - full / longest)
+        # Partially typed names: compare against the best-matching prefix of the window
+        if prefix <= len(query) // 2:
+            best = max(best, 1 - prefix / len(query))
+    return best
+
+class TrigramIndex:
+    """
+    Inverted trigram index over weighted text fields per key, for typo-tolerant search.
+    Postings hold distinct texts, each with the keys that carry it, so a crop or state name
+    shared by thousands of mandis is scored once. Candidates are scored by trigram Dice
+    overlap, then the best are re-ranked with edit distance. add()/remove() update postings
+    in place, so the index never needs a full rebuild.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}   # trigram -> set of texts
+        self._texts = {}      # text -> (trigrams, {key: weight})
+        self._key_texts = {}  # key -> [texts]
+
+    def __len__(self):
+        return len(self._key_texts)
+
+    def add(self, key, fields):
+        """Index (text, weight) pairs for key, replacing anything indexed for it before"""
+        with self._lock:
+            self.remove(key)
+            texts = []
+            for text, weight in fields:
+                text = normalize_text(text)
+                if not text or text in texts:
+                    continue
+                entry = self._texts.get(text)
+                if entry is None:
+                    grams = frozenset(trigrams(text))
+                    entry = self._texts[text] = (grams, {})
+                    for gram in grams:
+                        self._postings.setdefault(gram, set()).add(text)
+                entry[1][key] = weight
+                texts.append(text)
+            if texts:
+                self._key_texts[key] = texts
+
+    def remove(self, key):
+        with self._lock:
+            for text in self._key_texts.pop(key, []):
+                grams, owners = self._texts[text]
+                owners.pop(key, None)
+                if owners:
+                    continue
+                del self._texts[text]
+                for gram in grams:
+                    posting = self._postings.get(gram)
+                    if posting is not None:
+                        posting.discard(text)
+                        if not posting:
+                            del self._postings[gram]
+
+    def search(self, query, limit=10, min_score=MIN_SCORE):
+        """Return [(key, score)] best first; score is in 0..1 times the matched field's weight"""
+        query = normalize_text(query)
+        if not query or limit <= 0:
+            return []
+        q_grams = trigrams(query)
+        with self._lock:
+            # Seed candidates from the rarest trigrams, then score the best seeds exactly
+            by_rarity = sorted(q_grams, key=lambda gram: len(self._postings.get(gram, ())))
+            common = max(64, COMMON_GRAM_RATIO * len(self._texts))
+            seeds = Counter()
+            for i, gram in enumerate(by_rarity):
+                posting = self._postings.get(gram, ())
+                if i >= MIN_SEED_GRAMS and len(posting) > common:
+                    break
+                seeds.update(posting)
+            best_by_key = {}
+            for text, count in seeds.most_common(limit * RERANK_FACTOR * 4):
+                grams, owners = self._texts[text]
+                dice = 2 * count / (len(q_grams) + len(grams))
+                # Queries wholly contained in a long field should not be diluted by its length
+                coverage = count / len(q_grams)
+                base = max(dice, 0.8 * coverage)
+                for key, weight in owners.items():
+                    score = base * weight
+                    if score > best_by_key.get(key, (0,))[0]:
+                        best_by_key[key] = (score, text, weight)
+        shortlist = heapq.nlargest(limit * RERANK_FACTOR, best_by_key.items(), key=lambda item: item[1][0])
+        ranked = []
+        top = []  # min-heap of the best `limit` scores so far
+        similarities = {}
+        for key, (trigram_score, text, weight) in shortlist:
+            # Similarity is at most 1, so skip the edit distance when even that cannot make the results
+            if len(top) == limit and (0.5 * trigram_score / weight + 0.5) * weight < top[0]:
+                continue
+            similarity = similarities.get(text)
+            if similarity is None:
+                similarity = _token_similarity(query, text)
+                if query in text:
+                    similarity = max(similarity, 0.9 if text.startswith(query) else 0.8)
+                similarities[text] = similarity
+            score = (0.5 * trigram_score / weight + 0.5 * similarity) * weight
+            if score >= min_score:
+                ranked.append((key, round(score, 4)))
+                if len(top) < limit:
+                    heapq.heappush(top, score)
+                elif score > top[0]:
+                    heapq.heapreplace(top, score)
+        ranked.sort(key=lambda item: -item[1])
+        return ranked[:limit]
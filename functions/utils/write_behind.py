@@ -0,0 +1,211 @@
+import os
+import time
+import queue
+import atexit
+import random
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from utils.settings import get_settings
+
+FIRESTORE_BATCH_LIMIT = 500
+
+def retry_with_backoff(fn, *args, max_retries=None, backoff=None):
+    """Call fn, retrying with exponential backoff and full jitter; re-raises the last error"""
+    settings = get_settings()
+    max_retries = settings.write_behind_max_retries if max_retries is None else max_retries
+    backoff = settings.write_behind_backoff if backoff is None else backoff
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args)
+        except Exception:
+            if attempt == max_retries:
+                raise
+            time.sleep(random.uniform(0, backoff * (2 ** attempt)))
+
+class WriteBehindQueue:
+    """
+    Bounded in-memory write-behind queue drained by one background thread.
+    Firestore sets are grouped into batched commits (up to 500 per commit, after waiting
+    `linger` seconds for more); other tasks such as storage uploads run on a small pool.
+    Failed commits are retried with backoff, then written one by one to isolate bad docs.
+    Note: on Cloud Functions the queue only drains promptly with CPU allocated outside
+    requests; flush() runs at exit and on SIGTERM so pending writes are not lost.
+    """
+
+    def __init__(self, max_size=None, linger=None, task_workers=None):
+        settings = get_settings()
+        self.linger = settings.write_behind_linger if linger is None else linger
+        # How long a request may wait for queue space before writing synchronously itself
+        self.enqueue_timeout = settings.write_behind_enqueue_timeout
+        self._queue = queue.Queue(maxsize=settings.write_behind_queue_size if max_size is None else max_size)
+        task_workers = settings.write_behind_task_workers if task_workers is None else task_workers
+        self._tasks = ThreadPoolExecutor(max_workers=task_workers, thread_name_prefix='write-behind-task')
+        self._task_futures = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.enqueued = 0
+        self.committed = 0
+        self.commits = 0
+        self.retries = 0
+        self.dropped = 0
+        self.synchronous_fallbacks = 0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def _put(self, item):
+        self._ensure_worker()
+        try:
+            self._queue.put(item, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self.synchronous_fallbacks += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def set_document(self, collection, doc_id, data):
+        """Queue a Firestore set; writes synchronously if the queue stays full"""
+        if not self._put(('set', collection, doc_id, data)):
+            self._commit([('set', collection, doc_id, data)])
+
+    def submit(self, fn, *args):
+        """Queue an arbitrary write task (e.g. an upload); runs it inline if the queue stays full"""
+        if not self._put(('task', fn, args)):
+            retry_with_backoff(fn, *args)
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.linger
+            while len(items) < FIRESTORE_BATCH_LIMIT:
+                remaining = deadline - time.monotonic()
+                try:
+                    items.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                sets = [item for item in items if item[0] == 'set']
+                for item in items:
+                    if item[0] == 'task':
+                        self._submit_task(item[1], item[2])
+                if sets:
+                    self._commit(sets)
+            except Exception as e:
+                print(f"[WRITE_BEHIND] Worker error: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def _submit_task(self, fn, args):
+        def run():
+            try:
+                retry_with_backoff(fn, *args)
+            except Exception as e:
+                self.dropped += 1
+                print(f"[WRITE_BEHIND] Task {getattr(fn, '__name__', fn)} failed after retries: {e}")
+        future = self._tasks.submit(run)
+        with self._lock:
+            self._task_futures.add(future)
+        future.add_done_callback(self._discard_future)
+
+    def _discard_future(self, future):
+        with self._lock:
+            self._task_futures.discard(future)
+
+    def _commit(self, sets):
+        from utils.services import get_firestore
+        db = get_firestore()
+        def commit(chunk):
+            batch = db.batch()
+            for _, collection, doc_id, data in chunk:
+                batch.set(db.collection(collection).document(doc_id), data)
+            batch.commit()
+        for start in range(0, len(sets), FIRESTORE_BATCH_LIMIT):
+            chunk = sets[start:start + FIRESTORE_BATCH_LIMIT]
+            try:
+                retry_with_backoff(commit, chunk)
+                self.commits += 1
+                self.committed += len(chunk)
+                continue
+            except Exception as e:
+                print(f"[WRITE_BEHIND] Batch of {len(chunk)} failed after retries, writing individually: {e}")
+            for item in chunk:
+                try:
+                    commit([item])
+                    self.commits += 1
+                    self.committed += 1
+                except Exception as e:
+                    self.dropped += 1
+                    print(f"[WRITE_BEHIND] Dropped write {item[1]}/{item[2]}: {e}")
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been committed or dropped"""
+        if self._thread is None:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return
+            time.sleep(0.01)
+        with self._lock:
+            futures = list(self._task_futures)
+        wait(futures, timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "committed": self.committed,
+            "commits": self.commits,
+            "dropped": self.dropped,
+            "synchronous_fallbacks": self.synchronous_fallbacks,
+            "pending_tasks": len(self._task_futures)
+        }
+
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+_shutdown_flush_installed = False
+
+def install_shutdown_flush():
+    """
+    Flush queued writes on SIGTERM, then hand the signal to whatever handler was installed
+    before. Signal handlers can only be set from the main thread, so main.py calls this at
+    import; returns False when called from any other thread.
+    """
+    global _shutdown_flush_installed
+    if _shutdown_flush_installed:
+        return True
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    previous = signal.getsignal(signal.SIGTERM)
+    def on_sigterm(signum, frame):
+        if _write_behind is not None:
+            _write_behind.flush(8)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+    signal.signal(signal.SIGTERM, on_sigterm)
+    _shutdown_flush_installed = True
+    return True
+
+def get_write_behind():
+    """Per-instance WriteBehindQueue, or None when WRITE_BEHIND_ENABLED=false"""
+    global _write_behind
+    if not get_settings().write_behind_enabled:
+        return None
+    with _write_behind_lock:
+        if _write_behind is None:
+            from utils.metrics_utils import register_metrics
+            _write_behind = WriteBehindQueue()
+            atexit.register(_write_behind.flush, 10)
+            if not install_shutdown_flush():
+                print("[WRITE_BEHIND] SIGTERM flush not installed; call install_shutdown_flush() from the main thread at startup")
+            register_metrics('write_behind', _write_behind.stats)
+        return _write_behind
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+import random
+
+# Make the functions/ package importable when run from the repo root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions'))
+
+from utils.geo_utils import haversine
+from utils.haversine_engine import HaversineEngine
+
+SIZES = [1000, 10000, 100000]
+LIMIT = 3
+QUERIES = 20
+
+def random_mandis(n, seed=42):
+    rng = random.Random(seed)
+    # Rough bounding box of India
+    return [(str(i), rng.uniform(8.0, 37.0), rng.uniform(68.0, 97.0)) for i in range(n)]
+
+def scalar_nearest(mandis, lat, lng, limit):
+    # Mirrors the original find_nearby_mandis loop: one haversine per mandi, then a full sort
+    mandi_list = [(haversine(lat, lng, m_lat, m_lng), mandi_id) for mandi_id, m_lat, m_lng in mandis]
+    mandi_list.sort()
+    return mandi_list[:limit]
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    rng = random.Random(7)
+    lat, lng = rng.uniform(8.0, 37.0), rng.uniform(68.0, 97.0)
+    print(f"{'mandis':>8} {'scalar ms':>10} {'numpy ms':>10} {'speedup':>8}")
+    for n in SIZES:
+        mandis = random_mandis(n)
+        engine = HaversineEngine([m[0] for m in mandis], [m[1] for m in mandis], [m[2] for m in mandis])
+        expected = [mandi_id for _, mandi_id in scalar_nearest(mandis, lat, lng, LIMIT)]
+        actual = [mandi_id for mandi_id, _ in engine.nearest(lat, lng, LIMIT)]
+        if expected != actual:
+            print(f"[ERROR] Result mismatch at n={n}: {expected} vs {actual}")
+            sys.exit(1)
+        scalar_ms = timed(lambda: scalar_nearest(mandis, lat, lng, LIMIT), max(1, QUERIES // (n // 1000)))
+        numpy_ms = timed(lambda: engine.nearest(lat, lng, LIMIT), QUERIES)
+        print(f"{n:>8} {scalar_ms:>10.2f} {numpy_ms:>10.3f} {scalar_ms / numpy_ms:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
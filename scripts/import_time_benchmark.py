@@ -0,0 +1,68 @@
+import os
+import sys
+import subprocess
+
+# Cold-start import cost per Cloud Functions entry point, measured with `python -X importtime`
+# in a fresh interpreter: importing main plus the one handler module the entry point loads
+# on its first request. Run from the repo root with the functions/ requirements installed.
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+
+ENTRY_POINTS = [
+    ('ping_entry', 'handlers.ping_handler'),
+    ('diagnose_crop_entry', 'handlers.crop_diagnose_handler'),
+    ('mandi_nearby_entry', 'handlers.mandi_handler'),
+    ('detect_animals_entry', 'handlers.animal_detect_handler'),
+    ('weather_entry', 'handlers.weather_handler'),
+    ('govt_schemes_entry', 'handlers.govt_insurance_handler'),
+    ('insurance_options_entry', 'handlers.insurance_handler'),
+]
+TOP_MODULES = 5
+RUNS = 3
+
+def import_times(statement):
+    """{top-level module: cumulative us} for one fresh interpreter executing statement"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=FUNCTIONS_DIR, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # column header
+        # Nesting is shown by two spaces per level after the single separator space
+        if not name[1:].startswith(' '):
+            times[name.strip()] = times.get(name.strip(), 0) + int(cumulative)
+    return times
+
+def best_of(statement):
+    runs = [import_times(statement) for _ in range(RUNS)]
+    return min(runs, key=lambda times: sum(times.values()))
+
+def main():
+    baseline = best_of('pass')
+    try:
+        main_only = best_of('import main')
+    except RuntimeError as e:
+        print(f"[ERROR] Could not import main: {e}")
+        sys.exit(1)
+    main_ms = sum(us for name, us in main_only.items() if name not in baseline) / 1000
+    print(f"{'entry point':<26} {'main ms':>8} {'handler ms':>11} {'total ms':>9}  heaviest imports")
+    for entry, module in ENTRY_POINTS:
+        try:
+            total = best_of(f'import main, {module}')
+        except RuntimeError as e:
+            print(f"{entry:<26} [ERROR] {e}")
+            continue
+        startup = {name: us for name, us in total.items() if name not in baseline}
+        total_ms = sum(startup.values()) / 1000
+        heaviest = sorted(startup.items(), key=lambda item: -item[1])[:TOP_MODULES]
+        summary = ', '.join(f"{name} {us / 1000:.0f}" for name, us in heaviest)
+        print(f"{entry:<26} {main_ms:>8.1f} {total_ms - main_ms:>11.1f} {total_ms:>9.1f}  {summary}")
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,34 @@
 import os
 import sys
+import glob
 import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import firebase_admin
 from firebase_admin import credentials, firestore, initialize_app
 from dotenv import load_dotenv
 
+# Make the functions/ package importable when run from the repo root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions'))
+
+from handlers.crop_price_index import persist_crop_prices_bulk, previous_crop_slugs, rebuild_crop_price_collection
+from handlers.price_series_store import PriceSeriesStore
+from utils.price_series import PriceSeries
+from utils.write_behind import retry_with_backoff
+
 # Load environment variables from .env
 load_dotenv()
 
 COLLECTION_NAME = os.environ.get('MANDI_COLLECTION', 'mandis')
+FIRESTORE_BATCH_LIMIT = 500
+DEFAULT_MAX_OPS_PER_SECOND = 500
+DEFAULT_WORKERS = 8
+# BulkWriter's own default before it gives up on a document
+BULK_WRITER_MAX_ATTEMPTS = 10
+PROGRESS_EVERY = 5.0
 
 # Initialize Firebase Admin
 if not firebase_admin._apps:
@@ -20,23 +40,310 @@ if not firebase_admin._apps:
     initialize_app(cred)
 db = firestore.client()
 
-def upload_mandi_json(json_path):
-    with open(json_path, 'r', encoding='utf-8') as f:
-        mandi_data = json.load(f)
-    mandi_id = mandi_data.get('mandi_id')
-    if not mandi_id:
-        print(f"[ERROR] mandi_id missing in {json_path}")
-        return
-    doc_ref = db.collection(COLLECTION_NAME).document(str(mandi_id))
-    doc_ref.set(mandi_data)
-    print(f"[SUCCESS] Uploaded mandi data for '{mandi_data.get('mandi_name')}' (ID: {mandi_id}) to Firestore.")
+# --- Input ---
+
+def _expand_paths(paths):
+    """Files for each argument: '-' (NDJSON on stdin), a directory, a glob or a file; each once"""
+    seen = set()
+    for path in paths:
+        if path == '-':
+            expanded = [path]
+        elif os.path.isdir(path):
+            expanded = [
+                os.path.join(root, name)
+                for root, _, files in sorted(os.walk(path))
+                for name in sorted(files) if name.endswith(('.json', '.ndjson', '.jsonl'))
+            ]
+        elif any(c in path for c in '*?['):
+            expanded = sorted(glob.glob(path, recursive=True))
+        else:
+            expanded = [path]
+        for item in expanded:
+            key = item if item == '-' else os.path.abspath(item)
+            if key not in seen:
+                seen.add(key)
+                yield item
+
+def iter_records(paths):
+    """Yield (source, record) from .json files (object or array) and NDJSON files/stdin"""
+    for path in _expand_paths(paths):
+        if path != '-' and not os.path.exists(path):
+            yield path, FileNotFoundError(f"File not found: {path}")
+            continue
+        if path == '-' or path.endswith(('.ndjson', '.jsonl')):
+            f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+            try:
+                for line_no, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield f"{path}:{line_no}", json.loads(line)
+                    except ValueError as e:
+                        yield f"{path}:{line_no}", e
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except ValueError as e:
+            yield path, e
+            continue
+        for i, record in enumerate(data if isinstance(data, list) else [data]):
+            yield (f"{path}[{i}]" if isinstance(data, list) else path), record
+
+def validate_mandi(record):
+    """Return a list of problems; an empty list means the record can be written"""
+    if not isinstance(record, dict):
+        return ["record is not a JSON object"]
+    errors = []
+    if not record.get('mandi_id'):
+        errors.append("mandi_id missing")
+    if not record.get('mandi_name'):
+        errors.append("mandi_name missing")
+    for field, low, high in (('lat', -90, 90), ('lng', -180, 180)):
+        try:
+            if not low <= float(record.get(field)) <= high:
+                errors.append(f"{field} out of range")
+        except (TypeError, ValueError):
+            errors.append(f"{field} missing or not a number")
+    crops = record.get('crops', [])
+    if not isinstance(crops, list):
+        errors.append("crops must be a list")
+    else:
+        for i, crop in enumerate(crops):
+            if not isinstance(crop, dict) or not crop.get('slug') or not crop.get('name'):
+                errors.append(f"crops[{i}] needs slug and name")
+    return errors
+
+def content_hash(record):
+    canonical = json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+# --- Writing ---
+
+class RateLimiter:
+    """Token bucket shared by the writer threads"""
+
+    def __init__(self, ops_per_second):
+        self.rate = float(ops_per_second)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        # Requests larger than the bucket wait for a full bucket rather than forever
+        n = min(n, self.rate)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            time.sleep(wait)
+
+class BatchedWriter:
+    """Parallel, rate-limited batched commits; used when BulkWriter is not available"""
+
+    def __init__(self, max_ops_per_second, workers):
+        self.limiter = RateLimiter(max_ops_per_second)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+        self.pending = []
+
+    def set(self, doc_ref, data):
+        self.pending.append((doc_ref, data))
+        if len(self.pending) >= min(FIRESTORE_BATCH_LIMIT, int(self.limiter.rate)):
+            self._submit()
+
+    def _submit(self):
+        chunk, self.pending = self.pending, []
+        def commit():
+            self.limiter.acquire(len(chunk))
+            batch = db.batch()
+            for doc_ref, data in chunk:
+                batch.set(doc_ref, data)
+            batch.commit()
+        self.futures.append((self.pool.submit(retry_with_backoff, commit), chunk))
+
+    def close(self):
+        """Wait for every commit; returns the ids of documents in batches that failed"""
+        if self.pending:
+            self._submit()
+        failed = set()
+        for future, chunk in self.futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed.update(doc_ref.id for doc_ref, _ in chunk)
+                print(f"[ERROR] Batch commit failed after retries: {e}")
+        self.pool.shutdown()
+        return failed
+
+class BulkWriterSession:
+    """BulkWriter that records the documents it gave up on, through on_write_error"""
+
+    def __init__(self, bulk_writer, max_attempts=BULK_WRITER_MAX_ATTEMPTS):
+        self.bulk_writer = bulk_writer
+        self.max_attempts = max_attempts
+        self.failed = set()
+        self._lock = threading.Lock()
+        bulk_writer.on_write_error(self._on_write_error)
+
+    def _on_write_error(self, failure, bulk_writer):
+        # Returning True retries the write (with BulkWriter's backoff)
+        if failure.attempts < self.max_attempts:
+            return True
+        doc_id = failure.operation.reference.id
+        with self._lock:
+            self.failed.add(doc_id)
+        print(f"[ERROR] Write failed for {doc_id} after {failure.attempts} attempts: {failure.message}")
+        return False
+
+    def set(self, doc_ref, data):
+        self.bulk_writer.set(doc_ref, data)
+
+    def close(self):
+        """Flush and close; returns the ids of documents that could not be written"""
+        self.bulk_writer.close()
+        return set(self.failed)
+
+def open_writer(max_ops_per_second, workers):
+    """Firestore BulkWriter (parallel mode, ramped to the rate limit) or the batched fallback"""
+    try:
+        from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions, SendMode
+    except ImportError:
+        return BatchedWriter(max_ops_per_second, workers)
+    options = BulkWriterOptions(
+        initial_ops_per_second=min(DEFAULT_MAX_OPS_PER_SECOND, max_ops_per_second),
+        max_ops_per_second=max_ops_per_second,
+        mode=SendMode.parallel
+    )
+    return BulkWriterSession(db.bulk_writer(options=options))
+
+class Progress:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.counts = {'read': 0, 'invalid': 0, 'unchanged': 0, 'written': 0}
+
+    def add(self, key):
+        self.counts[key] += 1
+        now = time.monotonic()
+        if now - self.last_report >= PROGRESS_EVERY:
+            self.last_report = now
+            self.report()
+
+    def report(self, final=False):
+        elapsed = time.monotonic() - self.started
+        rate = self.counts['read'] / elapsed if elapsed else 0
+        label = "[DONE]" if final else "[PROGRESS]"
+        print(f"{label} read={self.counts['read']} written={self.counts['written']} "
+              f"unchanged={self.counts['unchanged']} invalid={self.counts['invalid']} "
+              f"elapsed={elapsed:.1f}s rate={rate:.0f} records/s")
+
+def upload_price_series(changed, strip_history=False, workers=DEFAULT_WORKERS, max_ops_per_second=DEFAULT_MAX_OPS_PER_SECOND):
+    """Merge each changed crop's price_history into its price_series document"""
+    store = PriceSeriesStore(directory=None)
+    limiter = RateLimiter(max_ops_per_second)
+    def merge(mandi_id, slug, history):
+        # One read and one write per series
+        limiter.acquire(2)
+        existing = store.get(mandi_id, slug)
+        series = existing.merge(history) if existing else history
+        retry_with_backoff(store.put, mandi_id, slug, series, db)
+        return len(series)
+    jobs = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for mandi_id, mandi_data in changed:
+            for crop in mandi_data.get('crops', []):
+                history = PriceSeries.from_history(crop.get('price_history', []))
+                if len(history):
+                    jobs.append(pool.submit(merge, mandi_id, crop['slug'], history))
+    for job in jobs:
+        job.result()
+    if strip_history:
+        for _, mandi_data in changed:
+            for crop in mandi_data.get('crops', []):
+                crop.pop('price_history', None)
+    return len(jobs)
+
+def ingest(paths, force=False, strip_history=False, max_ops_per_second=DEFAULT_MAX_OPS_PER_SECOND,
+           workers=DEFAULT_WORKERS, dry_run=False):
+    """
+    Validate and upsert mandi records, skipping documents whose content hash is unchanged,
+    then refresh price_series and crop_prices for the records that changed
+    """
+    progress = Progress()
+    collection = db.collection(COLLECTION_NAME)
+    # One projected read of every stored hash instead of a get() per record
+    known = {} if force else {
+        doc.id: (doc.to_dict() or {}).get('content_hash') for doc in collection.select(['content_hash']).stream()
+    }
+    changed = {}
+    for source, record in iter_records(paths):
+        progress.add('read')
+        errors = [str(record)] if isinstance(record, Exception) else validate_mandi(record)
+        if errors:
+            print(f"[INVALID] {source}: {'; '.join(errors)}")
+            progress.add('invalid')
+            continue
+        mandi_id = str(record['mandi_id'])
+        digest = content_hash(record)
+        if known.get(mandi_id) == digest:
+            progress.add('unchanged')
+            continue
+        known[mandi_id] = digest
+        changed[mandi_id] = {**record, 'content_hash': digest}
+    changed = list(changed.items())
+    if dry_run:
+        progress.counts['written'] = len(changed)
+        progress.report(final=True)
+        return progress.counts
+    # Series first, so --strip-history never drops history that was not stored
+    series_count = upload_price_series(changed, strip_history, workers, max_ops_per_second)
+    # Crops each changed mandi listed before this run, so dropped crops lose their entries
+    previous = previous_crop_slugs(db, [mandi_id for mandi_id, _ in changed], COLLECTION_NAME)
+    writer = open_writer(max_ops_per_second, workers)
+    for mandi_id, mandi_data in changed:
+        writer.set(collection.document(mandi_id), mandi_data)
+        progress.add('written')
+    failed = writer.close()
+    progress.counts['written'] -= len(failed)
+    # Crop price entries follow the mandi documents that were actually written
+    written = [(mandi_id, mandi_data) for mandi_id, mandi_data in changed if mandi_id not in failed]
+    crop_count = persist_crop_prices_bulk(db, written, previous)
+    progress.report(final=True)
+    print(f"[SUCCESS] Updated {series_count} price series and entries for {crop_count} crops.")
+    if failed:
+        print(f"[ERROR] {len(failed)} mandis failed to write; re-run to retry them (unchanged records are skipped).")
+    return progress.counts
+
+def rebuild_crop_prices():
+    docs = db.collection(COLLECTION_NAME).stream()
+    count = rebuild_crop_price_collection(db, ((doc.id, doc.to_dict()) for doc in docs))
+    print(f"[SUCCESS] Rebuilt crop price index for {count} crops.")
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: python mandi_data_uploader.py <path_to_mandi_json>")
-        sys.exit(1)
-    json_path = sys.argv[1]
-    if not os.path.exists(json_path):
-        print(f"[ERROR] File not found: {json_path}")
+    parser = argparse.ArgumentParser(description="Upload mandi JSON/NDJSON records to Firestore")
+    parser.add_argument('paths', nargs='*', help="JSON/NDJSON files, directories, globs, or '-' for NDJSON on stdin")
+    parser.add_argument('--rebuild-crop-prices', action='store_true', help="Rebuild crop_prices from every mandi and exit")
+    parser.add_argument('--strip-history', action='store_true', help="Drop price_history from mandi documents once stored as price_series")
+    parser.add_argument('--force', action='store_true', help="Write every record even if its content hash is unchanged")
+    parser.add_argument('--dry-run', action='store_true', help="Validate and diff only, without writing")
+    parser.add_argument('--max-ops-per-second', type=int, default=DEFAULT_MAX_OPS_PER_SECOND)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+    if args.rebuild_crop_prices:
+        rebuild_crop_prices()
+        sys.exit(0)
+    if not args.paths:
+        parser.print_usage()
         sys.exit(1)
-    upload_mandi_json(json_path)
+    counts = ingest(args.paths, force=args.force, strip_history=args.strip_history,
+                    max_ops_per_second=args.max_ops_per_second, workers=args.workers, dry_run=args.dry_run)
+    sys.exit(1 if counts['invalid'] else 0)